@@ -0,0 +1,255 @@
+"""Headless throughput and latency benchmarks for the signal pipeline.
+
+Runs Qt offscreen, so it works without a display:
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --baseline results.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, SAMPLING_FREQUENCY, BUFFER_MEMORY_BYTES, HOT_HISTORY_SAMPLES
+from service.data_buffer import DataBuffer, to_samples
+from service.dsp import StreamingBandpassFilter, StreamingRMS, sliding_rms, bandpass_sos
+from service.events import EventDetector
+from service.metrics import metrics
+from service.protocol import encode_frames
+from service.source import SourceData
+from service.tcp import TCPService
+
+
+def time_call(function, repeat=5):
+    """Median wall time of `function()` in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def summarize(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {"mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)), "max": float(np.max(values))}
+
+
+def random_frames(count):
+    return np.random.randn(count, NUMBER_OF_CHANNELS, CHANNEL_LENGTH).astype(np.float32)
+
+
+def benchmark_ingest(frames, port, rate=0.0, protocol="raw", dtype="float32"):
+    """Send frames over a local socket into TCPService, unthrottled when rate is 0."""
+    received = []
+    arrival_times = []
+    source = SourceData("benchmark")
+
+    def on_new_data(batch, source_name):
+        source.append(to_samples(batch))
+        now = time.perf_counter()
+        arrival_times.extend([now] * len(batch))
+        received.append(len(batch))
+
+    kill_event = threading.Event()
+    service = TCPService(on_new_data, lambda status: None, "localhost", port)
+    server_thread = threading.Thread(target=service.start, args=(kill_event,))
+    server_thread.start()
+    time.sleep(0.2)
+
+    payload = random_frames(frames)
+    if protocol == "v2":
+        payload = [encode_frames(payload[index:index + 1], index, dtype) for index in range(frames)]
+    else:
+        payload = [frame.tobytes() for frame in payload]
+    send_times = []
+    sender = socket.create_connection(("localhost", port))
+    started = time.perf_counter()
+    for index, frame in enumerate(payload):
+        if rate > 0:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        send_times.append(time.perf_counter())
+        sender.sendall(frame)
+
+    deadline = time.perf_counter() + 10
+    while len(arrival_times) < frames and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    sender.close()
+    kill_event.set()
+    service.stop()
+    server_thread.join()
+
+    latencies = [(arrival - sent) * 1000 for sent, arrival in zip(send_times, arrival_times)]
+    return {
+        "frames": len(arrival_times),
+        "frames_per_second": len(arrival_times) / elapsed,
+        "frames_per_wakeup": float(np.mean(received)) if received else 0.0,
+        "send_to_buffer_ms": summarize(latencies),
+    }
+
+
+def benchmark_render(frames, rate, stacked=False):
+    """Feed MainViewModel at `rate` frames/s and time the live widget frames.
+
+    With stacked=True the all-channel StackedPlotWidget is timed instead.
+    """
+    from view.channel_plot_widget import ChannelPlotWidget
+    from view.stacked_plot_widget import StackedPlotWidget
+    from viewmodel.main import MainViewModel
+
+    app = QApplication.instance()
+    view_model = MainViewModel(record_sessions=False)
+    append_times = {}
+    render_latencies = []
+
+    def get_new_channel_data(channel_index, position, max_samples=None, signal_type="unfiltered", max_backlog=None):
+        data, position = view_model.get_new_channel_data(channel_index, position, max_samples, signal_type,
+                                                         max_backlog)
+        if len(data) and position in append_times:
+            render_latencies.append((time.perf_counter() - append_times[position]) * 1000)
+        return data, position
+
+    def get_new_data(position, max_samples=None, signal_type="unfiltered", max_backlog=None):
+        data, position = view_model.get_new_data(position, max_samples, signal_type, max_backlog)
+        if data.shape[1] and position in append_times:
+            render_latencies.append((time.perf_counter() - append_times[position]) * 1000)
+        return data, position
+
+    widget = StackedPlotWidget(get_new_data) if stacked else ChannelPlotWidget(get_new_channel_data)
+    render_durations = []
+    render_frame = widget.render_frame
+
+    def timed_render_frame():
+        started = time.perf_counter()
+        render_frame()
+        render_durations.append((time.perf_counter() - started) * 1000)
+
+    view_model.new_data.connect(timed_render_frame)
+
+    metrics.reset()
+    payload = random_frames(frames)
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    for index, frame in enumerate(payload):
+        view_model.on_new_data(frame, "benchmark")
+        append_times[(index + 1) * CHANNEL_LENGTH] = time.perf_counter()
+        deadline = started + (index + 1) * interval
+        while time.perf_counter() < deadline:
+            app.processEvents()
+    app.processEvents()
+    view_model.new_data.disconnect(timed_render_frame)
+    view_model.close_recordings()
+
+    return {
+        "frames": frames,
+        "rate": rate,
+        "render_frame_ms": summarize(render_durations),
+        "buffer_to_render_ms": summarize(render_latencies),
+        "stages": view_model.get_metrics(),
+    }
+
+
+def benchmark_fill_level(fill, repeat):
+    """Time reads, DSP and offline plotting with the hot ring `fill` full (above 1 the rest is cold)."""
+    from view.offline_analysis_widget import OfflineAnalysisWidget
+    from scipy import signal
+
+    chunks = max(1, int(HOT_HISTORY_SAMPLES // CHANNEL_LENGTH * fill))
+    buffer = DataBuffer(BUFFER_MEMORY_BYTES, NUMBER_OF_CHANNELS)
+    for chunk in random_frames(chunks):
+        buffer.append_chunk(chunk)
+    channel = buffer.get_channel_data(0)
+    chunk = to_samples(random_frames(1))
+    bandpass = StreamingBandpassFilter()
+    rms = StreamingRMS()
+    detector = EventDetector(NUMBER_OF_CHANNELS)
+
+    result = {
+        "chunks": chunks,
+        "samples": len(channel),
+        "get_channel_data_ms": time_call(lambda: buffer.get_channel_data(0), repeat),
+        "get_channel_envelope_ms": time_call(lambda: buffer.get_channel_envelope(0), repeat),
+        "query_last_second_ms": time_call(lambda: buffer.query(0, last=SAMPLING_FREQUENCY), repeat),
+        "streaming_filter_chunk_ms": time_call(lambda: bandpass.process(chunk), repeat),
+        "streaming_rms_chunk_ms": time_call(lambda: rms.process(chunk), repeat),
+        "event_detection_chunk_ms": time_call(lambda: detector.process(chunk), repeat),
+        "offline_filter_ms": time_call(lambda: signal.sosfiltfilt(bandpass_sos(), channel), repeat),
+        "offline_rms_ms": time_call(lambda: sliding_rms(channel), repeat),
+        "offline_plot_ms": {},
+    }
+
+    widget = OfflineAnalysisWidget(buffer.query, buffer.get_channel_envelope, None)
+    for view_mode in range(widget.view_mode_selector.count()):
+        for signal_type in range(widget.signal_type_selector.count()):
+            widget.view_mode_selector.blockSignals(True)
+            widget.signal_type_selector.blockSignals(True)
+            widget.view_mode_selector.setCurrentIndex(view_mode)
+            widget.signal_type_selector.setCurrentIndex(signal_type)
+            widget.view_mode_selector.blockSignals(False)
+            widget.signal_type_selector.blockSignals(False)
+            name = (f"{widget.view_mode_selector.currentText()}/"
+                    f"{widget.signal_type_selector.currentText()}")
+            result["offline_plot_ms"][name] = time_call(lambda: (widget.plot(), widget.wait_for_analysis()), 1)
+    return result
+
+
+def compare(results, baseline, path=""):
+    """Print every numeric result next to its baseline value."""
+    for key, value in results.items():
+        name = f"{path}/{key}" if path else key
+        if isinstance(value, dict):
+            compare(value, baseline.get(key, {}) if isinstance(baseline, dict) else {}, name)
+        elif isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            print(f"{name:70s} {baseline[key]:12.3f} -> {value:12.3f} ({value / baseline[key]:6.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark of the signal pipeline')
+    parser.add_argument('--output', default='bench_output.json', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--frames', type=int, default=5000, help='Frames sent in the ingest benchmark')
+    parser.add_argument('--ingest-rate', type=float, default=0.0,
+                        help='Frames/s sent in the ingest benchmark, 0 for unthrottled')
+    parser.add_argument('--render-rate', type=float, default=500.0, help='Frames/s fed to the live widget')
+    parser.add_argument('--fill', type=float, nargs='+', default=[0.1, 0.5, 1.0, 2.0],
+                        help='Hot ring fill levels for the offline benchmarks; above 1 includes cold history')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per timed call')
+    parser.add_argument('--port', type=int, default=5999, help='Local port for the ingest benchmark')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)  # noqa: F841, needed by the widgets
+
+    results = {
+        "ingest": benchmark_ingest(args.frames, args.port, args.ingest_rate),
+        "ingest_v2_int16": benchmark_ingest(args.frames, args.port, args.ingest_rate, "v2", "int16"),
+        "render": benchmark_render(min(args.frames, 2000), args.render_rate),
+        "render_all_channels": benchmark_render(min(args.frames, 2000), args.render_rate, stacked=True),
+        "fill_levels": {str(fill): benchmark_fill_level(fill, args.repeat) for fill in args.fill},
+    }
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,65 @@ SIGNAL_SIZE = NUMBER_OF_CHANNELS * CHANNEL_LENGTH
 RECEIVE_FREQUENCY = 4
 
 RECEIVE_CHUNK_SIZE = RECEIVE_FREQUENCY * SIGNAL_SIZE
+FRAMES_PER_RECEIVE = 16
 
 SERVER_HOST = "localhost"
 SERVER_PORT = 5000
+STATUS_INTERVAL = 2.0  # seconds; repeats of a receive-loop status or error message within it are coalesced
+INGEST_PROCESS = False  # receive in a separate process that publishes samples through shared memory
+INGEST_RING_SAMPLES = CHANNEL_LENGTH * 8192  # samples per channel in each source's shared ring (18.9 MB)
+INGEST_POLL_INTERVAL = 0.002  # seconds the GUI process waits for new samples when the rings are empty
+INGEST_METRICS_INTERVAL = 0.5  # seconds between metrics updates from the ingest process
 
-BUFFER_LIMIT = 10000
+BUFFER_MEMORY_BYTES = 512 * 1024 * 1024  # history of each source: hot ring plus compressed cold blocks
+HOT_HISTORY_SAMPLES = 180_000  # newest samples per channel kept uncompressed as float32
+COLD_BLOCK_SAMPLES = 8192  # samples per channel in one compressed block, a multiple of 64
+COLD_COMPRESSION = "lossless"  # or "int16": quantized per block and channel, lossy but about half the size
+
+RECORD_SESSIONS = True
+RECORDING_DIRECTORY = "recordings"
+RECORDING_QUEUE_BYTES = 256 * 1024 * 1024  # chunks waiting for the disk; newer ones are dropped beyond this
 
 SAMPLING_FREQUENCY = 1000
 LOW_CUTOFF_FREQUENCY = 1.0
 HIGH_CUTOFF_FREQUENCY = 100.0
 RMS_WINDOW = 50
 FILTER_ORDER = 4
+
+LIVE_FPS = 30
+LIVE_WINDOW_SAMPLES = 5000
+LIVE_DROP_POLICY = "latest"  # or "paced"
+LIVE_MAX_BACKLOG = 5 * LIVE_WINDOW_SAMPLES
+DERIVED_HISTORY_SAMPLES = 2 * LIVE_MAX_BACKLOG  # filtered/RMS history, only the live views read it
+
+LOD_FACTOR = 4
+PLOT_MAX_POINTS = 2000
+LIVE_MAX_COLUMNS = 1000
+STACKED_MAX_COLUMNS = 500  # min/max columns per channel in the all-channel view
+
+SPECTROGRAM_WINDOW = 256  # samples per short-time FFT
+SPECTROGRAM_HOP = 64  # samples between consecutive spectra
+SPECTROGRAM_COLUMNS = 400  # spectra kept for the live image
+WELCH_SEGMENT = 1024  # samples per averaged segment of the offline PSD
+WELCH_BLOCK_SEGMENTS = 256  # segments transformed at once, bounds PSD memory
+
+# On-ingest event detection rules; None disables a rule
+EVENT_THRESHOLD = 100.0  # |amplitude| rising to this level
+EVENT_SATURATION = 1000.0  # |amplitude| at the input range
+EVENT_FLATLINE_SAMPLES = SAMPLING_FREQUENCY // 2  # consecutive unchanged samples
+EVENT_FLATLINE_TOLERANCE = 0.0  # largest change still counted as unchanged
+EVENT_BURST_FACTOR = 4.0  # frame mean square over its running baseline
+EVENT_BURST_ALPHA = 0.01  # weight of each frame in the baseline
+EVENT_INDEX_LIMIT = 1_000_000  # events kept per source (11 bytes each), oldest dropped first
+
+DERIVED_CACHE_BYTES = 256 * 1024 * 1024  # offline filtered/RMS/FFT/envelope results
+ANALYSIS_WORKERS = 2  # threads computing offline analysis off the GUI thread
+ALL_CHANNEL_POOL_SAMPLES = 50_000_000  # all-channel recording analysis above this many values uses processes
+ALL_CHANNEL_CHUNK_SAMPLES = 65_536  # rows each of those processes reads and analyses at once
+OFFLINE_DENSE_SAMPLES = 20_000_000  # longer single-channel spans are analysed in pages
+OFFLINE_PAGE_SAMPLES = 1_048_576  # samples per page of those
+
+LAZY_STARTUP = True  # build the plot widgets and the offline window on first use
+
+METRICS_ENABLED = True
+METRICS_LOG_INTERVAL = 60
@@ -1,16 +1,23 @@
+import argparse
+import atexit
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-from PyQt5.QtWidgets import QApplication
+from config import INGEST_PROCESS
+from service.startup import startup_profile
 
-from view.main_view import MainView
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s %(filename)s:%(lineno)d "
-           "[%(asctime)s] - %(name)s - %(message)s",
-    handlers=[
+def configure_logging():
+    """Log through a queue: every thread only enqueues records, one listener thread writes them.
+
+    A slow disk or console then never stalls the thread that logs, such as
+    the receive thread.
+    """
+    formatter = logging.Formatter("%(levelname)s %(filename)s:%(lineno)d "
+                                  "[%(asctime)s] - %(name)s - %(message)s")
+    handlers = [
         RotatingFileHandler(
             filename='logs/all.log',
             maxBytes=1024 * 1024 * 25,
@@ -23,15 +30,45 @@ logging.basicConfig(
         ),
         logging.StreamHandler(sys.stdout)
     ]
-)
+    handlers[1].setLevel(logging.ERROR)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # writes what is still queued
 
-logging.getLogger().handlers[1].setLevel(logging.ERROR)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Signal visualization application')
+    parser.add_argument('--listen', action='store_true', help='Start the TCP server right away')
+    parser.add_argument('--ingest-process', action='store_true', default=INGEST_PROCESS,
+                        help='Receive in a separate process that shares samples through memory')
+    parser.add_argument('--profile-startup', action='store_true', help='Log how long each startup stage took')
+    args, qt_args = parser.parse_known_args()
+    startup_profile.enabled = args.profile_startup
+
+    # Configured and imported here, not at module level: the ingest process
+    # imports this module too and needs neither the log files nor Qt
+    configure_logging()
+    with startup_profile.stage("import Qt"):
+        from PyQt5.QtWidgets import QApplication
+    with startup_profile.stage("import main window"):
+        from view.main_view import MainView
+
     # Start the Qt app
-    app = QApplication(sys.argv)
-    window = MainView()  # Create main window
+    with startup_profile.stage("Qt application"):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with startup_profile.stage("main window"):
+        window = MainView(ingest_process=args.ingest_process)  # Create main window
+    if args.listen:
+        window.start_tcp()  # accept sources before the plots are built
+        startup_profile.mark("TCP server started")
     window.show()        # Show the window
     sys.exit(app.exec_())  # Run app loop
 
@@ -0,0 +1,200 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from config import (SAMPLING_FREQUENCY, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, FILTER_ORDER, RMS_WINDOW,
+                    WELCH_SEGMENT, ALL_CHANNEL_CHUNK_SAMPLES)
+from service.dsp import bandpass_sos, sliding_rms, StreamingBandpassFilter, StreamingRMS
+from service.recording import Recording
+from service.spectrogram import hann
+
+STATISTICS = ("Mean", "Std Dev", "Min", "Max", "RMS", "Dominant Hz", "Band Power")
+_DEFAULT_PARAMETERS = (FILTER_ORDER, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, SAMPLING_FREQUENCY, RMS_WINDOW)
+
+
+def process_signals(data, signal_type, order=FILTER_ORDER, lowcut=LOW_CUTOFF_FREQUENCY,
+                    highcut=HIGH_CUTOFF_FREQUENCY, fs=SAMPLING_FREQUENCY, rms_window=RMS_WINDOW):
+    """Apply a signal type (0 unfiltered, 1 filtered, 2 RMS) to every row of a channels x samples matrix."""
+    if signal_type == 1 and data.shape[1] > 3 * (2 * order + 1):
+        return signal.sosfiltfilt(bandpass_sos(order, lowcut, highcut, fs), data, axis=1)
+    if signal_type == 2:
+        return sliding_rms(data, rms_window, axis=1)
+    return data
+
+
+def channel_statistics(data, fs=SAMPLING_FREQUENCY, band=(LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY)):
+    """Return a channels x len(STATISTICS) matrix for a channels x samples matrix.
+
+    Every statistic is one axis-wise NumPy call over the whole matrix. Band
+    power is the mean square of the components between band[0] and band[1] Hz.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    length = data.shape[1]
+    result = np.full((data.shape[0], len(STATISTICS)), np.nan)
+    if length == 0:
+        return result
+
+    mean = data.mean(axis=1)
+    result[:, 0] = mean
+    result[:, 1] = data.std(axis=1)
+    result[:, 2] = data.min(axis=1)
+    result[:, 3] = data.max(axis=1)
+    result[:, 4] = np.sqrt(np.mean(data ** 2, axis=1))
+
+    # One-sided power per bin, scaled so the bins sum to the variance
+    power = np.abs(np.fft.rfft(data - mean[:, None], axis=1)) ** 2 * (2.0 / length ** 2)
+    freqs = np.fft.rfftfreq(length, 1.0 / fs)
+    if len(freqs) > 1:
+        result[:, 5] = freqs[1 + np.argmax(power[:, 1:], axis=1)]
+    in_band = (freqs >= band[0]) & (freqs <= band[1])
+    result[:, 6] = power[:, in_band].sum(axis=1)
+    return result
+
+
+def signal_statistics(data, signal_type, order=FILTER_ORDER, lowcut=LOW_CUTOFF_FREQUENCY,
+                      highcut=HIGH_CUTOFF_FREQUENCY, fs=SAMPLING_FREQUENCY, rms_window=RMS_WINDOW):
+    """channel_statistics of process_signals, with the band power taken over the filter band."""
+    processed = process_signals(data, signal_type, order, lowcut, highcut, fs, rms_window)
+    return channel_statistics(processed, fs, (lowcut, highcut))
+
+
+class StreamingStatistics:
+    """channel_statistics of a channels x samples stream that arrives in chunks, in bounded memory.
+
+    Mean, standard deviation, minimum, maximum and RMS are exact. Dominant
+    frequency and band power come from a Welch PSD of `segment`-sample
+    windows accumulated across chunks, not from one FFT of the whole signal,
+    so their resolution is fs / segment.
+    """
+
+    def __init__(self, number_of_channels, fs=SAMPLING_FREQUENCY, band=(LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY),
+                 segment=WELCH_SEGMENT):
+        self.__fs = fs
+        self.__band = band
+        self.__segment = segment
+        self.__hop = segment - segment // 2
+        self.__taper = hann(segment)
+        self.__count = 0
+        self.__reference = None  # first sample per channel; sums are taken around it for precision
+        self.__sum = np.zeros(number_of_channels)
+        self.__sum_of_squares = np.zeros(number_of_channels)
+        self.__minimum = np.full(number_of_channels, np.inf)
+        self.__maximum = np.full(number_of_channels, -np.inf)
+        self.__power = np.zeros((number_of_channels, segment // 2 + 1))
+        self.__windows = 0
+        self.__tail = np.zeros((number_of_channels, 0))
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.shape[1] == 0:
+            return
+        if self.__reference is None:
+            self.__reference = chunk[:, 0].copy()
+        centered = chunk - self.__reference[:, None]
+        self.__count += chunk.shape[1]
+        self.__sum += centered.sum(axis=1)
+        self.__sum_of_squares += np.einsum('ij,ij->i', centered, centered)
+        np.minimum(self.__minimum, chunk.min(axis=1), out=self.__minimum)
+        np.maximum(self.__maximum, chunk.max(axis=1), out=self.__maximum)
+
+        # Welch windows continue across chunks; the samples of unfinished ones are kept
+        data = np.concatenate((self.__tail, chunk), axis=1)
+        count = (data.shape[1] - self.__segment) // self.__hop + 1 if data.shape[1] >= self.__segment else 0
+        if count:
+            windows = sliding_window_view(data, self.__segment, axis=1)[:, ::self.__hop][:, :count]
+            windows = windows - windows.mean(axis=2, keepdims=True)
+            self.__power += np.sum(np.abs(np.fft.rfft(windows * self.__taper, axis=2)) ** 2, axis=1)
+            self.__windows += count
+        self.__tail = data[:, count * self.__hop:]
+
+    def psd(self):
+        """Return (freqs in Hz, channels x freqs Welch PSD) of the samples so far, like welch_psd."""
+        if not self.__windows:
+            return np.array([]), np.zeros((len(self.__sum), 0))
+        psd = self.__power / (self.__windows * self.__fs * np.sum(self.__taper ** 2))
+        psd[:, 1:psd.shape[1] - (self.__segment % 2 == 0)] *= 2
+        return np.fft.rfftfreq(self.__segment, 1.0 / self.__fs), psd
+
+    def result(self):
+        result = np.full((len(self.__sum), len(STATISTICS)), np.nan)
+        if self.__count == 0:
+            return result
+        mean = self.__sum / self.__count
+        result[:, 0] = self.__reference + mean
+        result[:, 1] = np.sqrt(np.maximum(self.__sum_of_squares / self.__count - mean ** 2, 0.0))
+        result[:, 2] = self.__minimum
+        result[:, 3] = self.__maximum
+        result[:, 4] = np.sqrt(result[:, 1] ** 2 + result[:, 0] ** 2)
+        if self.__windows:
+            freqs, psd = self.psd()
+            result[:, 5] = freqs[1 + np.argmax(psd[:, 1:], axis=1)]
+            in_band = (freqs >= self.__band[0]) & (freqs <= self.__band[1])
+            result[:, 6] = psd[:, in_band].sum(axis=1) * (self.__fs / self.__segment)
+        return result
+
+
+def paged_statistics(pages, number_of_channels, signal_type, parameters=()):
+    """Statistics of a channels x samples signal that arrives as consecutive pages, in bounded memory.
+
+    The signal types and their differences from signal_statistics are those
+    of recording_statistics.
+    """
+    order, lowcut, highcut, fs, rms_window = tuple(parameters) + _DEFAULT_PARAMETERS[len(parameters):]
+    statistics = StreamingStatistics(number_of_channels, fs, (lowcut, highcut))
+    bandpass = StreamingBandpassFilter(order, lowcut, highcut, fs) if signal_type == 1 else None
+    rms = StreamingRMS(rms_window) if signal_type == 2 else None
+    for page in pages:
+        if bandpass is not None:
+            page = bandpass.process(page)
+        elif rms is not None:
+            page = rms.process(page)
+        statistics.process(page)
+    if rms is not None:
+        statistics.process(rms.flush())
+    return statistics.result()
+
+
+def _recording_statistics(path, channels, signal_type, parameters, chunk_samples):
+    # Runs in a pool process. The file is row-major, so every process reads
+    # all rows, a chunk at a time, and keeps the columns of its channels
+    recording = Recording(path)
+    pages = (np.ascontiguousarray(recording.read_rows(first, first + chunk_samples)[:, channels].T)
+             for first in range(0, len(recording), chunk_samples))
+    return channels, paged_statistics(pages, len(channels), signal_type, parameters)
+
+
+def recording_statistics(path, number_of_channels, signal_type, parameters=(), workers=None, on_progress=None,
+                         chunk_samples=ALL_CHANNEL_CHUNK_SAMPLES):
+    """Statistics of a whole recording, one channel group per pool process.
+
+    Used for recordings too long to hold as a single float64 matrix: each
+    process streams the file through StreamingStatistics `chunk_samples`
+    rows at a time, so its memory does not grow with the recording. The
+    filtered signal is the causal band-pass of the live view rather than
+    the zero-phase one of signal_statistics. `parameters` are the optional
+    arguments of signal_statistics after signal_type. on_progress(done,
+    total) is called as groups finish and may raise to stop early.
+    """
+    workers = workers or os.cpu_count() or 1
+    groups = np.array_split(np.arange(number_of_channels), min(workers, number_of_channels))
+    result = np.full((number_of_channels, len(STATISTICS)), np.nan)
+    # spawn, not fork: the parent is a threaded Qt process
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(groups), mp_context=context) as pool:
+        futures = [pool.submit(_recording_statistics, path, group, signal_type, tuple(parameters), chunk_samples)
+                   for group in groups]
+        try:
+            for done, future in enumerate(futures, 1):
+                channels, statistics = future.result()
+                result[channels] = statistics
+                if on_progress is not None:
+                    on_progress(done, len(futures))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return result
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import DERIVED_CACHE_BYTES
+from service.dsp import sliding_rms
+from service.metrics import metrics
+
+
+class DerivedCache:
+    """Memory-bounded LRU cache of values derived from a sample history.
+
+    Entries are keyed on the transform key plus the identity part of the data
+    version, and remember the (oldest, total) range they were computed from.
+    A lookup with a newer range of the same history is handed to `extend`
+    when one is given, so append-only growth does not recompute everything.
+    Safe to share between threads; values are computed outside the lock.
+    """
+
+    def __init__(self, max_bytes=DERIVED_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key, version, compute, extend=None):
+        entry_key = (key, version[:-2])
+        with self.__lock:
+            entry = self.__entries.get(entry_key)
+            if entry is not None and entry[0] == version:
+                self.__entries.move_to_end(entry_key)
+                metrics.count("cache_hits")
+                return entry[1]
+        if entry is not None:
+            cached_version, value, _ = entry
+            dropped = version[-2] - cached_version[-2]
+            if extend is not None and dropped >= 0 and version[-1] >= cached_version[-1]:
+                value = extend(value, dropped)
+                if value is not None:
+                    metrics.count("cache_extends")
+                    self.__store(entry_key, version, value)
+                    return value
+        metrics.count("cache_misses")
+        value = compute()
+        self.__store(entry_key, version, value)
+        return value
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def __store(self, entry_key, version, value):
+        size = value_size(value)
+        with self.__lock:
+            previous = self.__entries.pop(entry_key, None)
+            if previous is not None:
+                self.__bytes -= previous[2]
+            if size > self.max_bytes:
+                return
+            self.__entries[entry_key] = (version, value, size)
+            self.__bytes += size
+            while self.__bytes > self.max_bytes:
+                _, (_, _, evicted) = self.__entries.popitem(last=False)
+                self.__bytes -= evicted
+                metrics.count("cache_evictions")
+            metrics.gauge("cache_mb", self.__bytes / 1e6)
+
+
+def value_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(value_size(item) for item in value)
+    return 64
+
+
+def extend_sliding_rms(previous, data, dropped, window):
+    """Update sliding_rms(old data) to sliding_rms(data) after an append.
+
+    `data[0]` is sample `dropped` of the old history. Only the first and last
+    window // 2 outputs depend on the history edges, so everything between
+    them is reused. Returns None when there is too little overlap to reuse.
+    """
+    half = window // 2
+    kept = len(previous) - dropped
+    if kept < 2 * half + 1 or len(data) < window + half:
+        return None
+    tail_start = min(kept - 2 * half, len(data) - window)
+    return np.concatenate((
+        sliding_rms(data[:window + half], window)[:half],
+        previous[dropped + half:len(previous) - half],
+        sliding_rms(data[tail_start:], window)[kept - half - tail_start:],
+    ))
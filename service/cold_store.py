@@ -0,0 +1,196 @@
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import COLD_BLOCK_SAMPLES, COLD_COMPRESSION
+from service.metrics import metrics
+
+SUMMARY_SAMPLES = 64  # min/max summary resolution kept uncompressed for envelopes
+
+# data is the channels x samples float32 block until the compressor replaces
+# the whole entry with one whose data is a tuple of compressed channels
+_Block = namedtuple("_Block", "first data mins maxs scale offset")
+
+# One thread shared by every store; zlib releases the GIL while it works
+_compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cold-compress")
+
+
+class ColdStore:
+    """Older history as compressed blocks of `block_samples` samples of every channel.
+
+    "lossless" byte-shuffles the float32 values and deflates them; "int16"
+    first quantizes each channel of a block to 16 bits between its min and
+    max, which is lossy but about half the size again. Blocks stay readable
+    uncompressed until the background compressor swaps them in. A coarse
+    min/max summary of every block is kept for envelopes, and the oldest
+    blocks are dropped when the store exceeds `max_bytes`.
+    """
+
+    def __init__(self, number_of_channels, max_bytes, block_samples=COLD_BLOCK_SAMPLES, method=COLD_COMPRESSION):
+        if method not in ("lossless", "int16"):
+            raise ValueError(f"unknown cold compression {method!r}")
+        if block_samples <= 0 or block_samples % SUMMARY_SAMPLES:
+            raise ValueError(f"cold block of {block_samples} samples is not a multiple of {SUMMARY_SAMPLES}")
+        self.block_samples = block_samples
+        self.max_bytes = max_bytes
+        self.__number_of_channels = number_of_channels
+        self.__method = method
+        self.__blocks = deque()
+        self.__bytes = 0
+        self.__compressed = [0, 0]  # (float32 bytes, compressed bytes) of the compressed blocks
+        self.__lock = threading.Lock()
+
+    @property
+    def start(self):
+        """Absolute position of the oldest stored sample, None when empty."""
+        with self.__lock:
+            return self.__blocks[0].first if self.__blocks else None
+
+    @property
+    def nbytes(self):
+        return self.__bytes
+
+    def add(self, first, block):
+        """Store a channels x block_samples float32 block starting at absolute sample `first`."""
+        summaries = block.reshape(self.__number_of_channels, -1, SUMMARY_SAMPLES)
+        entry = _Block(first, block, summaries.min(axis=2), summaries.max(axis=2), None, None)
+        with self.__lock:
+            self.__blocks.append(entry)
+            self.__bytes += _size(entry)
+            self.__evict()
+        _compressor.submit(self.__compress, entry)
+
+    def __compress(self, entry):
+        started = time.perf_counter()
+        data = entry.data
+        scale = offset = None
+        if self.__method == "int16":
+            low, high = data.min(axis=1), data.max(axis=1)
+            offset = (low + high) / 2
+            scale = np.maximum(high - low, 1e-30) / 65534
+            data = np.rint((data - offset[:, None]) / scale[:, None]).astype(np.int16)
+        # Channels are compressed separately, so reading one channel inflates only its own bytes
+        channels = tuple(zlib.compress(_shuffle(channel), 1) for channel in data)
+        compressed = _Block(entry.first, channels, entry.mins, entry.maxs, scale, offset)
+        with self.__lock:
+            for index, candidate in enumerate(self.__blocks):
+                if candidate is entry:
+                    self.__blocks[index] = compressed
+                    self.__bytes += _size(compressed) - _size(entry)
+                    self.__compressed[0] += entry.data.nbytes
+                    self.__compressed[1] += _size(compressed) - entry.mins.nbytes - entry.maxs.nbytes
+                    break
+            else:
+                return  # evicted or cleared meanwhile
+            self.__evict()
+            stored = self.__bytes
+            ratio = self.__compressed[0] / max(1, self.__compressed[1])
+        metrics.record("cold_compress", time.perf_counter() - started)
+        metrics.gauge("cold_mb", stored / 2 ** 20)
+        metrics.gauge("cold_ratio", ratio)
+
+    def __evict(self):
+        while self.__bytes > self.max_bytes and self.__blocks:
+            block = self.__blocks.popleft()
+            self.__bytes -= _size(block)
+            if not _pending(block):
+                self.__compressed[0] -= self.block_samples * self.__number_of_channels * 4
+                self.__compressed[1] -= _size(block) - block.mins.nbytes - block.maxs.nbytes
+            metrics.count("cold_blocks_evicted")
+
+    def snapshot(self, start, stop):
+        """Return the blocks that overlap absolute samples [start, stop), for read() or envelope().
+
+        Taking the snapshot is cheap; decoding it needs no lock, so callers
+        take it under their own lock and decode after releasing it.
+        """
+        with self.__lock:
+            return [block for block in self.__blocks
+                    if block.first < stop and block.first + self.block_samples > start]
+
+    def read(self, blocks, channels, start, stop):
+        """Decode absolute samples [start, stop) of `channels` (an index, slice or index array) from a snapshot."""
+        started = time.perf_counter()
+        parts = []
+        for block in blocks:
+            data = self.__decode(block, channels)
+            parts.append(data[..., max(0, start - block.first):stop - block.first])
+        metrics.record("cold_decompress", time.perf_counter() - started)
+        return np.concatenate(parts, axis=-1)
+
+    def envelope(self, blocks, channel_index, start, stop, points):
+        """Min/max envelope of absolute samples [start, stop) from the block summaries.
+
+        Returns (x, y) like MinMaxPyramid.query, or None when the range has
+        fewer than `points` summaries and raw samples are the better answer.
+        """
+        if (stop - start) // SUMMARY_SAMPLES < points:
+            return None
+        group = max(1, (stop - start) // (SUMMARY_SAMPLES * points))
+        first = blocks[0].first
+        mins = np.concatenate([block.mins[channel_index] for block in blocks])
+        maxs = np.concatenate([block.maxs[channel_index] for block in blocks])
+        low = (start - first) // SUMMARY_SAMPLES
+        high = -(-(stop - first) // SUMMARY_SAMPLES)
+        mins, maxs = mins[low:high].copy(), maxs[low:high].copy()
+        # The edge summaries usually stick out of the range; recompute them from their samples
+        if (start - first) % SUMMARY_SAMPLES:
+            mins[0], maxs[0] = self.__extremes(blocks, channel_index, start,
+                                               min(stop, first + (low + 1) * SUMMARY_SAMPLES))
+        if (stop - first) % SUMMARY_SAMPLES and (high - low > 1 or (start - first) % SUMMARY_SAMPLES == 0):
+            mins[-1], maxs[-1] = self.__extremes(blocks, channel_index,
+                                                 max(start, first + (high - 1) * SUMMARY_SAMPLES), stop)
+        offsets = np.arange(low, high, group)
+        y = np.column_stack((np.minimum.reduceat(mins, offsets - low),
+                             np.maximum.reduceat(maxs, offsets - low))).ravel()
+        x = np.repeat(np.maximum(first + offsets * SUMMARY_SAMPLES, start), 2)
+        return x, y
+
+    def __extremes(self, blocks, channel_index, start, stop):
+        # Min and max of samples [start, stop), which lie within one block
+        block = next(block for block in blocks if block.first <= start < block.first + self.block_samples)
+        samples = self.read([block], channel_index, start, stop)
+        return samples.min(), samples.max()
+
+    def __decode(self, block, channels):
+        if _pending(block):
+            return block.data[channels]
+        indices = channels if isinstance(channels, np.ndarray) else range(self.__number_of_channels)[channels]
+        single = isinstance(indices, int)
+        dtype = np.float32 if block.scale is None else np.int16
+        data = np.stack([_unshuffle(zlib.decompress(block.data[index]), dtype)
+                         for index in ([indices] if single else indices)])
+        if block.scale is not None:
+            data = (data * block.scale[indices, None] + block.offset[indices, None]).astype(np.float32)
+        return data[0] if single else data
+
+    def clear(self):
+        with self.__lock:
+            self.__blocks.clear()
+            self.__bytes = 0
+            self.__compressed = [0, 0]
+
+
+def _pending(block):
+    return isinstance(block.data, np.ndarray)
+
+
+def _size(block):
+    data = block.data.nbytes if _pending(block) else sum(len(channel) for channel in block.data)
+    return data + block.mins.nbytes + block.maxs.nbytes
+
+
+def _shuffle(data):
+    # Group the n-th byte of every value together; the high bytes of
+    # neighbouring samples repeat, which deflate compresses well
+    return np.ascontiguousarray(data.view(np.uint8).reshape(-1, data.itemsize).T).tobytes()
+
+
+def _unshuffle(buffer, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    values = np.frombuffer(buffer, dtype=np.uint8).reshape(itemsize, -1).T
+    return np.ascontiguousarray(values).view(dtype).ravel()
@@ -1,29 +1,331 @@
+import threading
+import time
+
 import numpy as np
-from collections import deque
 
-from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, BUFFER_LIMIT
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, PLOT_MAX_POINTS, HOT_HISTORY_SAMPLES
+from service.cold_store import ColdStore
+from service.lod import MinMaxPyramid
+from service.metrics import metrics
+
+# One record per appended chunk: its first sample, arrival time and number since clear()
+CHUNK_INDEX_DTYPE = np.dtype([('position', '<i8'), ('timestamp', '<f8'), ('sequence', '<i8')])
 
 
 class DataBuffer:
-    def __init__(self, buffer_limit, number_of_channels):
-        self.__buffer = deque(maxlen=buffer_limit)
+    """History of every channel within a memory budget of `memory_budget` bytes.
+
+    The newest `hot_samples` samples stay in a float32 ring (hot tier). Before
+    the ring overwrites samples they are moved, a block at a time, into a
+    compressed ColdStore that gets what is left of the budget. History reads
+    span both tiers; the live reads (get_*_since) only the hot ring. With
+    memory_budget=None the buffer only has the hot ring.
+
+    Every append is indexed by arrival time, so query() can return a sample
+    range, the newest samples or a time window of any set of channels
+    without copying the rest of the history.
+    """
+
+    def __init__(self, memory_budget, number_of_channels, lod=True, hot_samples=HOT_HISTORY_SAMPLES):
         self.__number_of_channels = number_of_channels
+        self.__capacity = hot_samples
+        if memory_budget is not None:
+            self.__capacity = max(CHANNEL_LENGTH, min(hot_samples, memory_budget // (8 * number_of_channels)))
+        # Every sample is written twice, at head and head + capacity, so the
+        # newest `capacity` samples are always one contiguous slice.
+        self.__data = np.zeros((number_of_channels, 2 * self.__capacity), dtype=np.float32)
+        self.__head = 0
+        self.__size = 0
+        self.__total = 0
+        self.__epoch = 0  # bumped by clear(), so positions from before it are never reused
+        self.__pyramid = MinMaxPyramid(number_of_channels, self.__capacity) if lod else None
+        self.__lock = threading.Lock()
+        self.__index = np.zeros(1024, dtype=CHUNK_INDEX_DTYPE)
+        self.__index_start = 0
+        self.__index_end = 0
+        self.__sequence = 0
+
+        self.__cold = None
+        self.__archived = 0  # absolute position of the first sample not yet in the cold tier
+        if memory_budget is not None:
+            cold_budget = memory_budget - self.__data.nbytes - (self.__pyramid.nbytes if lod else 0)
+            cold = ColdStore(number_of_channels, cold_budget)
+            if cold_budget > 0 and self.__capacity >= 2 * cold.block_samples:
+                self.__cold = cold
+
+    def append_chunk(self, chunk, timestamp=None):
+        """Append a channels x samples chunk that arrived at `timestamp` (time.time() by default)."""
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if chunk.ndim == 1:
+            chunk = to_chunk(chunk)
+        with self.__lock:
+            self.__add_index(time.time() if timestamp is None else timestamp)
+        # Pieces short enough that every cold block is archived before the ring overwrites it
+        step = self.__capacity if self.__cold is None else self.__capacity - self.__cold.block_samples
+        for first in range(0, chunk.shape[1], step):
+            self.__append(chunk[:, first:first + step])
+
+    def __append(self, chunk):
+        length = chunk.shape[1]
+        with self.__lock:
+            if self.__cold is not None:
+                self.__archive(length)
+            start = self.__head
+            first = min(length, self.__capacity - start)
+            for offset in (start, start + self.__capacity):
+                self.__data[:, offset:offset + first] = chunk[:, :first]
+            if first < length:
+                rest = length - first
+                self.__data[:, :rest] = chunk[:, first:]
+                self.__data[:, self.__capacity:self.__capacity + rest] = chunk[:, first:]
+            self.__head = (start + length) % self.__capacity
+            self.__size = min(self.__size + length, self.__capacity)
+            if self.__pyramid is not None:
+                self.__pyramid.append(chunk, self.__total)
+            self.__total += length
+
+    def __archive(self, length):
+        # Move the blocks the next `length` samples would overwrite to the cold tier
+        block = self.__cold.block_samples
+        while self.__total + length - self.__archived > self.__capacity:
+            start = (self.__head - (self.__total - self.__archived)) % self.__capacity
+            self.__cold.add(self.__archived, self.__data[:, start:start + block].copy())
+            self.__archived += block
 
-    def append_chunk(self, chunk):
-        self.__buffer.append(to_chunk(chunk))
+    def __add_index(self, timestamp):
+        if self.__index_end == len(self.__index):
+            # Drop the records of samples no longer stored, keeping the one the oldest sample belongs to
+            index = self.__index[self.__index_start:self.__index_end]
+            index = index[max(0, np.searchsorted(index['position'], self.__oldest(), side='right') - 1):]
+            if len(index) > len(self.__index) // 2:
+                self.__index = np.resize(self.__index, 2 * len(self.__index))
+            self.__index[:len(index)] = index
+            self.__index_start, self.__index_end = 0, len(index)
+        self.__index[self.__index_end] = (self.__total, timestamp, self.__sequence)
+        self.__index_end += 1
+        self.__sequence += 1
+
+    def __oldest(self):
+        oldest = self.__total - self.__size
+        cold_start = None if self.__cold is None else self.__cold.start
+        return oldest if cold_start is None else min(oldest, cold_start)
+
+    def __cold_blocks(self, hot_oldest):
+        """Return (absolute position of the oldest sample, cold blocks holding the samples before hot_oldest)."""
+        if self.__cold is None:
+            return hot_oldest, []
+        blocks = self.__cold.snapshot(0, hot_oldest)
+        return (blocks[0].first if blocks else hot_oldest), blocks
 
     def is_empty(self):
-        return len(self.__buffer) == 0
-
-    def get_channel_data(self, channel_index):
-        if not self.__buffer or channel_index < 0 or channel_index >= self.__number_of_channels:
-            return np.array([])
-        channel_data = [chunk[channel_index] for chunk in self.__buffer]
-        return np.concatenate(channel_data)
-    
+        return self.__size == 0
+
+    def occupancy(self):
+        """Fraction of the hot ring that holds samples."""
+        return self.__size / self.__capacity
+
+    def get_channel_data(self, channel_index, copy=True):
+        """Return the stored history of one channel, oldest sample first.
+
+        With copy=False and no cold history a read-only view into the ring is
+        returned; it is only valid until the next append overwrites its
+        oldest samples.
+        """
+        if channel_index < 0 or channel_index >= self.__number_of_channels:
+            return np.array([], dtype=np.float32)
+        started = time.perf_counter()
+        if copy or self.__cold is not None:
+            data, _ = self.query(channel_index)
+            metrics.record("get_channel_data", time.perf_counter() - started)
+            return data
+        with self.__lock:
+            if self.__size == 0:
+                return np.array([], dtype=np.float32)
+            start = (self.__head - self.__size) % self.__capacity
+            data = self.__data[channel_index, start:start + self.__size]
+        view = data.view()
+        view.flags.writeable = False
+        return view
+
+    def get_version(self):
+        """Return the version query() gives for the whole history, (epoch, oldest, total), without reading it."""
+        with self.__lock:
+            return self.__epoch, self.__oldest(), self.__total
+
+    def query(self, channels=None, start=None, stop=None, last=None, since=None, until=None):
+        """Return (data, version) of a span of the stored history.
+
+        `channels` is a channel index (1-D result), a sequence of them or None
+        for all (channels x samples). The span is narrowed by absolute sample
+        positions [start, stop), by arrival time since <= t <= until (in
+        time.time() seconds, to chunk resolution) and finally to the `last`
+        samples. version is (epoch, first, stop) of the returned span; only
+        the cold blocks it overlaps are decompressed.
+        """
+        started = time.perf_counter()
+        if channels is not None and np.ndim(channels) == 0:
+            channels = int(channels)
+            valid = 0 <= channels < self.__number_of_channels
+        elif channels is None:
+            channels = slice(None)
+            valid = True
+        else:
+            channels = np.asarray(channels, dtype=np.intp)
+            valid = bool(np.all((channels >= 0) & (channels < self.__number_of_channels)))
+        if not valid:
+            raise IndexError(f"channel out of range: {channels}")
+
+        # Copy the hot samples and snapshot the cold blocks under the lock;
+        # decompress after releasing it, so appends are not held up
+        with self.__lock:
+            hot_oldest = self.__total - self.__size
+            first, end = query_span(self.__oldest(), self.__total, self.__index[self.__index_start:self.__index_end],
+                                    start, stop, last, since, until)
+            version = (self.__epoch, first, end)
+            hot_first = max(first, hot_oldest)
+            ring_start = (self.__head - (self.__total - hot_first)) % self.__capacity
+            hot = self.__data[channels, ring_start:ring_start + max(0, end - hot_first)]
+            if not isinstance(channels, np.ndarray):
+                hot = hot.copy()  # a channel list already selects a copy
+            blocks = self.__cold.snapshot(first, min(end, hot_oldest)) if first < hot_oldest else []
+        if blocks:
+            cold = self.__cold.read(blocks, channels, first, min(end, hot_oldest))
+            hot = np.concatenate((cold, hot), axis=-1)
+        metrics.record("query", time.perf_counter() - started)
+        return hot, version
+
+    def get_chunk_index(self, start=None, stop=None):
+        """Return the CHUNK_INDEX_DTYPE records of the chunks appended within absolute samples [start, stop)."""
+        with self.__lock:
+            index = self.__index[self.__index_start:self.__index_end]
+            start = self.__oldest() if start is None else max(start, self.__oldest())
+            low = max(0, np.searchsorted(index['position'], start, side='right') - 1)
+            high = len(index) if stop is None else np.searchsorted(index['position'], stop)
+            return index[low:high].copy()
+
+    def get_channel_data_since(self, channel_index, position, max_samples=None, max_backlog=None):
+        """Return the samples appended after absolute sample `position`, oldest first.
+
+        Returns (data, next_position). Samples that already fell out of the
+        ring are skipped, and so are the oldest pending samples beyond
+        `max_backlog`. At most `max_samples` are copied; the rest stay pending.
+        """
+        if channel_index < 0 or channel_index >= self.__number_of_channels:
+            return np.array([], dtype=np.float32), position
+        return self.__get_since(channel_index, position, max_samples, max_backlog)
+
+    def get_data_since(self, position, max_samples=None, max_backlog=None):
+        """Like get_channel_data_since, for all channels as a channels x samples array."""
+        return self.__get_since(slice(None), position, max_samples, max_backlog)
+
+    def __get_since(self, channels, position, max_samples, max_backlog):
+        started = time.perf_counter()
+        with self.__lock:
+            total = self.__total
+            if position > total:
+                position = 0  # buffer was cleared since the last read
+            pending = min(total - position, self.__size)
+            if max_backlog is not None:
+                pending = min(pending, max_backlog)
+            count = pending if max_samples is None else min(pending, max_samples)
+            start = (self.__head - pending) % self.__capacity
+            data = self.__data[channels, start:start + count].copy()
+        metrics.record("get_channel_data", time.perf_counter() - started)
+        return data, total - pending + count
+
+    def get_channel_envelope(self, channel_index, start=0, stop=None, points=PLOT_MAX_POINTS):
+        """Return (x, y) for plotting history samples [start, stop) of one channel.
+
+        Indices count from the oldest stored sample, like get_channel_data.
+        Long ranges come from the min/max pyramid and the cold block summaries
+        as about `points` min/max pairs, so the result size follows the plot
+        width, not the history.
+        """
+        if channel_index < 0 or channel_index >= self.__number_of_channels:
+            return np.array([]), np.array([], dtype=np.float32)
+        with self.__lock:
+            hot_oldest = self.__total - self.__size
+            oldest, blocks = self.__cold_blocks(hot_oldest)
+            stop = self.__total - oldest if stop is None else min(stop, self.__total - oldest)
+            start = max(0, start)
+            if stop <= start:
+                return np.array([]), np.array([], dtype=np.float32)
+            start, stop = oldest + start, oldest + stop
+            parts = []
+            if stop > hot_oldest:
+                hot_start = max(start, hot_oldest)
+                parts.append(self.__hot_envelope(channel_index, hot_start, stop,
+                                                 max(1, points * (stop - hot_start) // (stop - start))))
+        if start < hot_oldest:
+            cold_stop = min(stop, hot_oldest)
+            size = self.__cold.block_samples
+            blocks = [block for block in blocks if block.first < cold_stop and block.first + size > start]
+            envelope = self.__cold.envelope(blocks, channel_index, start, cold_stop,
+                                            max(1, points * (cold_stop - start) // (stop - start)))
+            if envelope is None:
+                envelope = np.arange(start, cold_stop), self.__cold.read(blocks, channel_index, start, cold_stop)
+            parts.insert(0, envelope)
+        x = np.concatenate([part[0] for part in parts]) if len(parts) > 1 else parts[0][0]
+        y = np.concatenate([part[1] for part in parts]) if len(parts) > 1 else parts[0][1]
+        return x - oldest, y
+
+    def __hot_envelope(self, channel_index, start, stop, points):
+        if self.__pyramid is not None:
+            envelope = self.__pyramid.query(channel_index, start, stop, points,
+                                            lambda first, end: self.__hot_samples(channel_index, first, end))
+            if envelope is not None:
+                return envelope
+        return np.arange(start, stop), self.__hot_samples(channel_index, start, stop).copy()
+
+    def __hot_samples(self, channel_index, start, stop):
+        # A view of absolute samples [start, stop) of the hot ring
+        ring_start = (self.__head - (self.__total - start)) % self.__capacity
+        return self.__data[channel_index, ring_start:ring_start + stop - start]
+
     def clear(self):
-        self.__buffer.clear()
+        with self.__lock:
+            self.__head = 0
+            self.__size = 0
+            self.__total = 0
+            self.__archived = 0
+            self.__index_start = self.__index_end = 0
+            self.__sequence = 0
+            self.__epoch += 1
+            if self.__cold is not None:
+                self.__cold.clear()
+
+
+def query_span(oldest, total, index, start=None, stop=None, last=None, since=None, until=None):
+    """Resolve query() bounds to absolute samples [first, stop) within [oldest, total).
+
+    `index` holds a (position, timestamp) record per chunk, oldest first; a
+    time bound selects whole chunks by their arrival time.
+    """
+    first, end = oldest, total
+    if start is not None:
+        first = max(first, start)
+    if stop is not None:
+        end = min(end, stop)
+    if since is not None:
+        first = max(first, _position_at(index, since, 'left', total))
+    if until is not None:
+        end = min(end, _position_at(index, until, 'right', total))
+    if last is not None:
+        first = max(first, end - last)
+    return first, max(first, end)
+
+
+def _position_at(index, timestamp, side, total):
+    # First sample of the first chunk that arrived at or after (left) / after (right) `timestamp`
+    found = np.searchsorted(index['timestamp'], timestamp, side=side)
+    return int(index['position'][found]) if found < len(index) else total
 
 
 def to_chunk(chunk):
-    return np.array(chunk).reshape(NUMBER_OF_CHANNELS, CHANNEL_LENGTH)
+    return np.asarray(chunk, dtype=np.float32).reshape(NUMBER_OF_CHANNELS, CHANNEL_LENGTH)
+
+
+def to_samples(frames):
+    """Join one or more 32x18 frames into a single channels x samples array."""
+    frames = np.asarray(frames, dtype=np.float32).reshape(-1, NUMBER_OF_CHANNELS, CHANNEL_LENGTH)
+    return np.concatenate(frames, axis=1)
@@ -0,0 +1,118 @@
+from functools import lru_cache
+
+import numpy as np
+
+from config import SAMPLING_FREQUENCY, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, FILTER_ORDER, RMS_WINDOW
+
+
+@lru_cache(maxsize=None)
+def bandpass_sos(order=FILTER_ORDER, lowcut=LOW_CUTOFF_FREQUENCY, highcut=HIGH_CUTOFF_FREQUENCY,
+                 fs=SAMPLING_FREQUENCY):
+    from scipy import signal  # deferred: importing scipy.signal takes longer than the rest of startup
+    nyquist = 0.5 * fs
+    return signal.butter(order, [lowcut / nyquist, highcut / nyquist], btype='band', output='sos')
+
+
+class StreamingBandpassFilter:
+    """Causal Butterworth band-pass that keeps its state between chunks.
+
+    All channels are filtered in one sosfilt call along the sample axis, so
+    the cost of a chunk only depends on its own length.
+    """
+
+    def __init__(self, order=FILTER_ORDER, lowcut=LOW_CUTOFF_FREQUENCY,
+                 highcut=HIGH_CUTOFF_FREQUENCY, fs=SAMPLING_FREQUENCY):
+        from scipy import signal
+        self.__signal = signal
+        self.__sos = bandpass_sos(order, lowcut, highcut, fs)
+        self.__zi = None
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if self.__zi is None:
+            # Start in steady state for the first sample to avoid a step transient
+            self.__zi = self.__signal.sosfilt_zi(self.__sos)[:, None, :] * chunk[None, :, 0, None]
+        filtered, self.__zi = self.__signal.sosfilt(self.__sos, chunk, axis=1, zi=self.__zi)
+        return filtered.astype(np.float32)
+
+    def reset(self):
+        self.__zi = None
+
+
+def sliding_rms(data, window=RMS_WINDOW, axis=-1):
+    """Centered moving RMS along `axis` (one channel or a channels x samples matrix).
+
+    Each output averages the squares over [i - window // 2, i + window // 2],
+    clipped at the edges. Uses a cumulative sum of squares, so it is O(n).
+    """
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, -1)
+    length = data.shape[-1]
+    if length == 0:
+        return np.moveaxis(data, -1, axis)
+    if length < window:
+        rms = np.sqrt(np.mean(data ** 2, axis=-1, keepdims=True)) * np.ones_like(data)
+        return np.moveaxis(rms, -1, axis)
+
+    half = window // 2
+    cumulative = np.zeros(data.shape[:-1] + (length + 1,))
+    np.cumsum(data ** 2, axis=-1, out=cumulative[..., 1:])
+    index = np.arange(length)
+    start = np.maximum(0, index - half)
+    end = np.minimum(length, index + half + 1)
+    mean_square = (cumulative[..., end] - cumulative[..., start]) / (end - start)
+    return np.moveaxis(np.sqrt(np.maximum(mean_square, 0.0)), -1, axis)
+
+
+class StreamingRMS:
+    """Incremental form of sliding_rms for channels x samples chunks.
+
+    The value for sample i needs window // 2 samples after it, so each call
+    returns the outputs that became complete with this chunk; sample k of the
+    output stream lines up with sample k of the input stream.
+    """
+
+    def __init__(self, window=RMS_WINDOW):
+        self.__half = window // 2
+        self.__tail = None
+        self.__count = 0
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        tail = chunk[:, :0] if self.__tail is None else self.__tail
+        extended = np.concatenate((tail, chunk), axis=1)
+
+        previous = self.__count
+        self.__count += chunk.shape[1]
+        offset = self.__count - extended.shape[1]  # stream index of extended[:, 0]
+        self.__tail = extended[:, max(0, extended.shape[1] - 2 * self.__half):]
+
+        first = max(0, previous - self.__half)
+        last = self.__count - self.__half
+        if last <= first:
+            return np.empty((chunk.shape[0], 0), dtype=np.float32)
+
+        index = np.arange(first, last)
+        start = np.maximum(0, index - self.__half) - offset
+        end = index + self.__half + 1 - offset
+        cumulative = np.zeros((extended.shape[0], extended.shape[1] + 1))
+        np.cumsum(extended ** 2, axis=1, out=cumulative[:, 1:])
+        mean_square = (cumulative[:, end] - cumulative[:, start]) / (end - start)
+        return np.sqrt(np.maximum(mean_square, 0.0)).astype(np.float32)
+
+    def flush(self):
+        """Return the last window // 2 outputs, whose windows are clipped at the end of the stream."""
+        if self.__tail is None or self.__count == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        tail = self.__tail
+        offset = self.__count - tail.shape[1]
+        index = np.arange(max(0, self.__count - self.__half), self.__count)
+        start = np.maximum(0, index - self.__half) - offset
+        cumulative = np.zeros((tail.shape[0], tail.shape[1] + 1))
+        np.cumsum(tail ** 2, axis=1, out=cumulative[:, 1:])
+        mean_square = (cumulative[:, -1, None] - cumulative[:, start]) / (self.__count - offset - start)
+        self.reset()
+        return np.sqrt(np.maximum(mean_square, 0.0)).astype(np.float32)
+
+    def reset(self):
+        self.__tail = None
+        self.__count = 0
@@ -0,0 +1,233 @@
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from config import (CHANNEL_LENGTH, EVENT_THRESHOLD, EVENT_SATURATION, EVENT_FLATLINE_SAMPLES,
+                    EVENT_FLATLINE_TOLERANCE, EVENT_BURST_FACTOR, EVENT_BURST_ALPHA, EVENT_INDEX_LIMIT)
+from service.metrics import metrics
+
+EVENT_KINDS = ("threshold", "saturation", "flatline", "burst")
+EVENT_DTYPE = np.dtype([('position', '<i8'), ('channel', '<i2'), ('kind', 'u1')])
+
+_FLATLINE = EVENT_KINDS.index("flatline")
+_BURST = EVENT_KINDS.index("burst")
+_BURST_FRAMES = 64  # frames whose baselines are computed with one matrix product
+
+
+class EventDetector:
+    """Finds events in channels x samples chunks as they are ingested.
+
+    Rules, each disabled by passing None:
+      threshold   |x| rises to `threshold` or above
+      saturation  |x| rises to `saturation` or above
+      flatline    `flatline_samples` consecutive samples change by at most `flatline_tolerance`
+      burst       the mean square of a CHANNEL_LENGTH frame exceeds `burst_factor` times its
+                  running baseline, an exponential average with weight `burst_alpha` per frame
+
+    All channels are evaluated at once with whole-array operations; the
+    state each rule needs at the chunk boundary (previous sample, run
+    length, baseline) is carried to the next chunk, so events are found
+    exactly once however the stream is split. Event positions count samples
+    since the first chunk or reset().
+
+    A flat line is stamped where its run starts, which can be chunks before
+    it is detected, so events are held back until no later flat line can
+    start before them. process() therefore returns events in position order
+    across calls; flush() hands out the held-back ones when the stream ends.
+    """
+
+    def __init__(self, number_of_channels, threshold=EVENT_THRESHOLD, saturation=EVENT_SATURATION,
+                 flatline_samples=EVENT_FLATLINE_SAMPLES, flatline_tolerance=EVENT_FLATLINE_TOLERANCE,
+                 burst_factor=EVENT_BURST_FACTOR, burst_alpha=EVENT_BURST_ALPHA):
+        self.__number_of_channels = number_of_channels
+        self.__levels = [(EVENT_KINDS.index(kind), level) for kind, level in
+                         (("threshold", threshold), ("saturation", saturation)) if level is not None]
+        self.__flatline_samples = flatline_samples
+        self.__flatline_tolerance = flatline_tolerance
+        self.__burst_factor = burst_factor
+        self.__burst_alpha = burst_alpha
+        self.reset()
+
+    @property
+    def position(self):
+        """Position the next chunk's first sample gets."""
+        return self.__position
+
+    def process(self, chunk):
+        """Return the events that became final with this chunk as an EVENT_DTYPE array ordered by position."""
+        started = time.perf_counter()
+        chunk = np.asarray(chunk, dtype=np.float32)
+        length = chunk.shape[1]
+        # One kind x channel x sample mask of where events are marked, so all
+        # rules are collected with a single nonzero()
+        marks = np.zeros((len(EVENT_KINDS), self.__number_of_channels, length), dtype=bool)
+        if length:
+            magnitude = np.abs(chunk)
+            for (kind, level), above in zip(self.__levels, self.__above):
+                self.__rising(magnitude >= level, above, marks[kind])
+            if self.__flatline_samples is not None:
+                self.__flatline(chunk, marks[_FLATLINE])
+            if self.__burst_factor is not None:
+                self.__burst(chunk, marks[_BURST])
+            self.__previous = chunk[:, -1].copy()
+
+        # Flat indices are much faster to find than 3-D ones
+        kinds, channels = np.divmod(np.flatnonzero(marks), self.__number_of_channels * length)
+        channels, offsets = np.divmod(channels, length)
+        events = np.empty(len(kinds), dtype=EVENT_DTYPE)
+        if len(events):
+            # A flat-line run is marked where it gets long enough but starts earlier
+            offsets = offsets - np.where(kinds == _FLATLINE, self.__flatline_samples or 0, 0)
+            order = np.argsort(offsets, kind='stable')
+            events['position'] = self.__position + offsets[order]
+            events['channel'] = channels[order]
+            events['kind'] = kinds[order]
+            metrics.count("events_detected", len(events))
+        self.__position += length
+        if len(self.__pending):
+            events = np.concatenate((self.__pending, events))
+            events = events[np.argsort(events['position'], kind='stable')]
+        # Flat lines found later start no earlier than the runs still in progress
+        final = len(events)
+        if self.__flatline_samples is not None:
+            runs = self.__run[self.__run < self.__flatline_samples]
+            cutoff = self.__position - 1 - (runs.max() if len(runs) else -1)
+            final = np.searchsorted(events['position'], cutoff, side='right')
+        events, self.__pending = events[:final], events[final:]
+        metrics.record("detect", time.perf_counter() - started)
+        return events
+
+    def flush(self):
+        """Return the events still held back, for when no more chunks follow."""
+        events, self.__pending = self.__pending, np.empty(0, dtype=EVENT_DTYPE)
+        return events
+
+    @staticmethod
+    def __rising(above, state, out):
+        # Mark the rising edges of a boolean channels x samples mask; state holds
+        # the last column of the previous chunk
+        np.greater(above[:, 0], state, out=out[:, 0])
+        np.greater(above[:, 1:], above[:, :-1], out=out[:, 1:])
+        state[:] = above[:, -1]
+
+    def __flatline(self, chunk, out):
+        # Length of the run of unchanged samples ending at each sample, continued from the previous chunk
+        steps = np.empty(chunk.shape, dtype=bool)
+        np.less_equal(np.abs(chunk[:, 0] - self.__previous), self.__flatline_tolerance, out=steps[:, 0])
+        np.less_equal(np.abs(chunk[:, 1:] - chunk[:, :-1]), self.__flatline_tolerance, out=steps[:, 1:])
+        if not steps.any():
+            self.__run[:] = 0  # the usual case: every sample changed
+            return
+        index = np.arange(chunk.shape[1])
+        last_change = np.maximum.accumulate(np.where(steps, -1, index), axis=1)
+        run = np.where(last_change < 0, index + 1 + self.__run[:, None], index - last_change)
+        self.__run = run[:, -1]
+        np.equal(run, self.__flatline_samples, out=out)
+
+    def __burst(self, chunk, out):
+        length = chunk.shape[1]
+        if length % CHANNEL_LENGTH == 0:
+            energy = np.square(chunk, dtype=np.float64).reshape(chunk.shape[0], -1, CHANNEL_LENGTH).mean(axis=2)
+        else:
+            starts = np.arange(0, length, CHANNEL_LENGTH)
+            energy = np.add.reduceat(np.square(chunk, dtype=np.float64), starts, axis=1)
+            energy /= np.diff(np.append(starts, length))
+        if np.isnan(self.__baseline[0]):
+            self.__baseline = energy[:, 0].copy()
+        frame_marks = out[:, ::CHANNEL_LENGTH]  # a view, so marks land on the frame starts
+        for first in range(0, energy.shape[1], _BURST_FRAMES):
+            frames = energy[:, first:first + _BURST_FRAMES]
+            # Baseline after every frame: b[j] = d^(j+1) b + a * sum(d^(j-i) e[i]) with d = 1 - a
+            decay, weights = _ema_weights(frames.shape[1], self.__burst_alpha)
+            after = self.__baseline[:, None] * decay + frames @ weights.T
+            before = np.concatenate((self.__baseline[:, None], after[:, :-1]), axis=1)
+            self.__rising(frames > self.__burst_factor * before, self.__in_burst,
+                          frame_marks[:, first:first + frames.shape[1]])
+            self.__baseline = after[:, -1]
+
+    def reset(self):
+        channels = self.__number_of_channels
+        self.__position = 0
+        self.__above = [np.zeros(channels, dtype=bool) for _ in self.__levels]
+        self.__previous = np.full(channels, np.nan, dtype=np.float32)  # NaN never counts as unchanged
+        self.__run = np.zeros(channels, dtype=np.int64)
+        self.__baseline = np.full(channels, np.nan)
+        self.__in_burst = np.zeros(channels, dtype=bool)
+        self.__pending = np.empty(0, dtype=EVENT_DTYPE)
+
+
+@lru_cache(maxsize=None)
+def _ema_weights(frames, alpha):
+    powers = (1 - alpha) ** np.arange(frames + 1)
+    index = np.arange(frames)
+    lags = index[:, None] - index[None, :]
+    weights = np.where(lags >= 0, alpha * powers[np.maximum(lags, 0)], 0.0)
+    return powers[1:], weights
+
+
+class EventIndex:
+    """Compact, position-ordered record of the detected events of one source.
+
+    At most `limit` events are kept; the oldest quarter is dropped when it
+    is full. Safe to add from the ingest thread while others query.
+    """
+
+    def __init__(self, limit=EVENT_INDEX_LIMIT):
+        self.limit = limit
+        self.__events = np.empty(min(limit, 1024), dtype=EVENT_DTYPE)
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__size
+
+    def add(self, events):
+        """Append EVENT_DTYPE events; they must not start before the last one added."""
+        if not len(events):
+            return
+        positions = events['position']
+        if np.any(positions[1:] < positions[:-1]):
+            raise ValueError("events are not ordered by position")
+        with self.__lock:
+            if self.__size and positions[0] < self.__events[self.__size - 1]['position']:
+                raise ValueError("events start before the last indexed event")
+            if self.__size + len(events) > len(self.__events):
+                if len(self.__events) < self.limit:
+                    capacity = min(self.limit, max(2 * len(self.__events), self.__size + len(events)))
+                    self.__events = np.resize(self.__events, capacity)
+                if self.__size + len(events) > len(self.__events):
+                    dropped = min(self.__size, max(self.limit // 4, self.__size + len(events) - self.limit))
+                    self.__events[:self.__size - dropped] = self.__events[dropped:self.__size]
+                    self.__size -= dropped
+                    metrics.count("events_dropped", dropped)
+                events = events[-len(self.__events):]
+            self.__events[self.__size:self.__size + len(events)] = events
+            self.__size += len(events)
+
+    def query(self, channels=None, kinds=None, start=None, stop=None, last=None):
+        """Return a copy of the matching events; see select_events."""
+        with self.__lock:
+            return select_events(self.__events[:self.__size], channels, kinds, start, stop, last)
+
+    def clear(self):
+        with self.__lock:
+            self.__size = 0
+
+
+def select_events(events, channels=None, kinds=None, start=None, stop=None, last=None):
+    """Return the events at positions [start, stop) of the given channels and kinds (names), oldest first.
+
+    `events` must be ordered by position. With `last` only the newest that many are returned.
+    """
+    low = 0 if start is None else np.searchsorted(events['position'], start)
+    high = len(events) if stop is None else np.searchsorted(events['position'], stop)
+    selected = events[low:high]
+    if channels is not None:
+        selected = selected[np.isin(selected['channel'], np.atleast_1d(channels))]
+    if kinds is not None:
+        selected = selected[np.isin(selected['kind'], [EVENT_KINDS.index(kind) for kind in np.atleast_1d(kinds)])]
+    if last is not None:
+        selected = selected[max(0, len(selected) - last):]
+    return selected.copy()
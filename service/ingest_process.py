@@ -0,0 +1,166 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from config import INGEST_POLL_INTERVAL, INGEST_METRICS_INTERVAL
+from service.metrics import metrics
+from service.shared_ring import SharedRing
+from service.tcp import TCPService
+
+
+class IngestProcess:
+    """Runs TCPService in a child process, so receiving never waits for the GUI process's GIL.
+
+    The child writes the frames of every source into its own SharedRing and
+    announces new rings and status messages over a queue. start() runs the
+    reading side on an ingest thread of the GUI process: it hands zero-copy
+    channels x samples views of the rings to new_samples_callback(samples,
+    source_name). When a connection ends, its ring is read to the end and
+    released in both processes, then source_closed_callback(source_name) is
+    called. Same start(kill_event)/stop() interface as TCPService.
+    """
+
+    def __init__(self, new_samples_callback, status_callback, host, port, source_closed_callback=None):
+        self.__new_samples_callback = new_samples_callback
+        self.__status_callback = status_callback
+        self.__source_closed_callback = source_closed_callback
+        self.__host = host
+        self.__port = port
+        # spawn, not fork: the GUI process has threads whose locks a fork would copy
+        self.__context = multiprocessing.get_context("spawn")
+        self.__stop_event = self.__context.Event()
+        self.__rings = {}  # source name -> [ring, next position to read]
+
+    def start(self, kill_event):
+        messages = self.__context.Queue()
+        log_records = self.__context.Queue()
+        listener = QueueListener(log_records, _Forward())
+        process = self.__context.Process(target=_serve, name="ingest", daemon=True,
+                                         args=(self.__host, self.__port, messages, log_records, self.__stop_event))
+        self.__status_callback("Starting ingest process...")
+        listener.start()
+        process.start()
+        try:
+            while not kill_event.is_set() and process.is_alive():
+                self.__handle_messages(messages)
+                if not self.__read_rings():
+                    kill_event.wait(INGEST_POLL_INTERVAL)
+        except Exception as e:
+            self.__status_callback(f"Ingest error: {e}")
+            logging.exception("Ingest process reader failed")
+        finally:
+            self.__stop_event.set()
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+            # Samples and messages the child published before it exited
+            self.__handle_messages(messages)
+            while self.__read_rings():
+                pass
+            listener.stop()
+            for ring, _ in self.__rings.values():
+                ring.release(unlink=True)
+            self.__rings.clear()
+            self.__status_callback("Ingest process stopped")
+
+    def __handle_messages(self, messages):
+        while True:
+            try:
+                kind, *content = messages.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "source":
+                name, ring_name = content
+                self.__rings[name] = [SharedRing(ring_name), 0]
+            elif kind == "metrics":
+                metrics.merge(content[0])  # receive and decode timings, frames lost, sender latency
+            elif kind == "closed":
+                name, = content
+                # The child wrote the last samples before it announced the end
+                while self.__read_ring(name, self.__rings[name]):
+                    pass
+                ring, _ = self.__rings.pop(name)
+                ring.release(unlink=True)
+                if self.__source_closed_callback is not None:
+                    self.__source_closed_callback(name)
+            else:
+                self.__status_callback(content[0])
+
+    def __read_rings(self):
+        # Returns whether there were samples
+        found = False
+        for name, state in self.__rings.items():
+            found |= self.__read_ring(name, state)
+        return found
+
+    def __read_ring(self, name, state):
+        ring, position = state
+        samples, start = ring.read(position)
+        if start > position:
+            metrics.count("ingest_ring_overruns", start - position)
+        if samples.shape[1] == 0:
+            return False
+        metrics.gauge("ingest_ring_fill", (ring.total - start) / ring.capacity)
+        self.__new_samples_callback(samples, name)
+        if not ring.intact(start):
+            metrics.count("ingest_ring_torn_reads")  # lapped while being stored; some samples are newer
+        state[1] = start + samples.shape[1]
+        return True
+
+    def stop(self):
+        self.__status_callback("Stopping ingest process...")
+        self.__stop_event.set()
+
+
+class _Forward(logging.Handler):
+    # Hands records from the child to the logger of the same name in this process
+    def emit(self, record):
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
+
+def _serve(host, port, messages, log_records, stop_event):
+    """Body of the ingest process."""
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_records)]
+    root.setLevel(logging.INFO)
+    rings = {}
+
+    def on_new_data(frames, source_name):
+        ring = rings.get(source_name)
+        if ring is None:
+            ring = rings[source_name] = SharedRing()
+            messages.put(("source", source_name, ring.name))
+        ring.write(frames)
+
+    def on_source_closed(source_name):
+        ring = rings.pop(source_name, None)
+        if ring is not None:
+            messages.put(("closed", source_name))
+            ring.release()
+
+    service = TCPService(on_new_data, lambda status: messages.put(("status", status)), host, port,
+                         on_source_closed)
+    kill_event = threading.Event()
+
+    def wait_for_stop():
+        # Also stop when the GUI process died without asking, so the port is
+        # released; meanwhile send the metrics of this process to the GUI process
+        parent = multiprocessing.parent_process()
+        while not stop_event.wait(INGEST_METRICS_INTERVAL) and parent.is_alive():
+            if metrics.enabled:
+                messages.put(("metrics", metrics.take()))
+        kill_event.set()
+        service.stop()
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    try:
+        service.start(kill_event)
+    finally:
+        for ring in rings.values():
+            ring.release()  # the GUI process unlinks the rings once it has read them
+        if metrics.enabled:
+            messages.put(("metrics", metrics.take()))
@@ -0,0 +1,80 @@
+import numpy as np
+
+from config import LOD_FACTOR
+
+
+class MinMaxPyramid:
+    """Per-channel min/max summaries of a sample ring at block sizes factor**k.
+
+    Each level is itself a ring of blocks indexed by absolute block number.
+    Appends fold the new samples into the touched blocks of every level, so
+    the update cost only depends on the chunk length.
+    """
+
+    def __init__(self, number_of_channels, capacity, factor=LOD_FACTOR):
+        self.__levels = []
+        size = factor
+        while size < capacity:
+            blocks = capacity // size + 2
+            mins = np.zeros((number_of_channels, blocks), dtype=np.float32)
+            maxs = np.zeros((number_of_channels, blocks), dtype=np.float32)
+            self.__levels.append((size, mins, maxs))
+            size *= factor
+
+    @property
+    def nbytes(self):
+        return sum(mins.nbytes + maxs.nbytes for _, mins, maxs in self.__levels)
+
+    def append(self, chunk, position):
+        """Fold a channels x samples chunk whose first sample is at `position`."""
+        length = chunk.shape[1]
+        for size, mins, maxs in self.__levels:
+            blocks = np.arange(position // size, (position + length - 1) // size + 1)
+            offsets = np.maximum(blocks * size - position, 0)
+            block_min = np.minimum.reduceat(chunk, offsets, axis=1)
+            block_max = np.maximum.reduceat(chunk, offsets, axis=1)
+            slots = blocks % mins.shape[1]
+            if position % size:
+                # The first block was started by an earlier chunk
+                block_min[:, 0] = np.minimum(block_min[:, 0], mins[:, slots[0]])
+                block_max[:, 0] = np.maximum(block_max[:, 0], maxs[:, slots[0]])
+            mins[:, slots] = block_min
+            maxs[:, slots] = block_max
+
+    def query(self, channel_index, start, stop, points, read_samples):
+        """Envelope of absolute samples [start, stop) with at least `points` blocks.
+
+        Returns (x, y) with two vertices (min then max) per block, or None when
+        the range is short enough that raw samples are the better answer. The
+        first and last block usually stick out of the range; they are taken
+        from read_samples(first, stop), the raw samples of the channel.
+        """
+        level = None
+        for candidate in self.__levels:
+            if (stop - start) // candidate[0] >= points:
+                level = candidate
+        if level is None:
+            return None
+
+        size, mins, maxs = level
+        blocks = np.arange(start // size, (stop - 1) // size + 1)
+        slots = blocks % mins.shape[1]
+        x = np.repeat(np.maximum(blocks * size, start), 2)
+        y = np.column_stack((mins[channel_index, slots], maxs[channel_index, slots])).ravel()
+        if start % size:
+            head = read_samples(start, min(stop, (blocks[0] + 1) * size))
+            y[:2] = head.min(), head.max()
+        if stop % size and (len(blocks) > 1 or start % size == 0):
+            tail = read_samples(max(start, blocks[-1] * size), stop)
+            y[-2:] = tail.min(), tail.max()
+        return x, y
+
+
+def minmax_decimate(data, points):
+    """Reduce a 1-D signal to about `points` min/max pairs, keeping its peaks."""
+    if len(data) <= 2 * points:
+        return np.arange(len(data)), data
+    size = -(-len(data) // points)
+    offsets = np.arange(0, len(data), size)
+    y = np.column_stack((np.minimum.reduceat(data, offsets), np.maximum.reduceat(data, offsets))).ravel()
+    return np.repeat(offsets, 2), y
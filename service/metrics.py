@@ -0,0 +1,137 @@
+import threading
+import time
+
+from config import METRICS_ENABLED
+
+BUCKETS = 32  # bucket i counts durations in [2**(i-1), 2**i) microseconds
+
+
+class Histogram:
+    """Power-of-two duration histogram; add() is a handful of integer operations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound in seconds of the bucket holding the given fraction of samples."""
+        target = fraction * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target:
+                return min((2 ** index) / 1e6, self.max)
+        return self.max
+
+
+class Metrics:
+    """Per-stage timing histograms, counters and gauges for the hot path.
+
+    Updates take no lock: a lost increment under contention is acceptable
+    for monitoring and keeps the overhead low enough to leave on.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.__lock = threading.Lock()
+        self.__started = time.perf_counter()
+        self.__stages = {}
+        self.__counters = {}
+        self.__gauges = {}
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.__stages.get(stage)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__stages.setdefault(stage, Histogram())
+        histogram.add(seconds)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.__gauges[name] = value
+
+    def snapshot(self):
+        with self.__lock:
+            stages = dict(self.__stages)
+        elapsed = time.perf_counter() - self.__started
+        return {
+            "elapsed_s": elapsed,
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "per_second": histogram.count / elapsed if elapsed > 0 else 0.0,
+                    "mean_ms": histogram.total / histogram.count * 1000 if histogram.count else 0.0,
+                    "p50_ms": histogram.percentile(0.5) * 1000,
+                    "p95_ms": histogram.percentile(0.95) * 1000,
+                    "max_ms": histogram.max * 1000,
+                }
+                for stage, histogram in stages.items()
+            },
+            "counters": dict(self.__counters),
+            "gauges": dict(self.__gauges),
+        }
+
+    def take(self):
+        """Return the raw stages, counters and gauges since the last take() or reset(), and start over.
+
+        The result is picklable; merge() adds it to the metrics of another
+        process.
+        """
+        with self.__lock:
+            stages, counters, gauges = self.__stages, self.__counters, self.__gauges
+            self.__stages, self.__counters, self.__gauges = {}, {}, {}
+        return ({stage: (histogram.count, histogram.total, histogram.max, histogram.buckets)
+                 for stage, histogram in stages.items()}, counters, gauges)
+
+    def merge(self, taken):
+        """Add the result of another process's take()."""
+        if not self.enabled:
+            return
+        stages, counters, gauges = taken
+        with self.__lock:
+            for stage, (count, total, maximum, buckets) in stages.items():
+                histogram = self.__stages.setdefault(stage, Histogram())
+                histogram.count += count
+                histogram.total += total
+                histogram.max = max(histogram.max, maximum)
+                histogram.buckets = [mine + theirs for mine, theirs in zip(histogram.buckets, buckets)]
+        for name, amount in counters.items():
+            self.count(name, amount)
+        self.__gauges.update(gauges)
+
+    def reset(self):
+        with self.__lock:
+            self.__started = time.perf_counter()
+            self.__stages = {}
+            self.__counters = {}
+            self.__gauges = {}
+
+
+def format_snapshot(snapshot):
+    lines = [f"{'stage':<22}{'count':>9}{'/s':>9}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for stage, values in sorted(snapshot["stages"].items()):
+        lines.append(f"{stage:<22}{values['count']:>9}{values['per_second']:>9.1f}{values['mean_ms']:>10.3f}"
+                     f"{values['p95_ms']:>10.3f}{values['max_ms']:>10.3f}")
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"{name:<22}{value:>9}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"{name:<22}{value:>9.3f}")
+    return "\n".join(lines)
+
+
+metrics = Metrics()
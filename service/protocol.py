@@ -0,0 +1,124 @@
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH
+from service.metrics import metrics
+
+# Wire protocol v2: every frame is a fixed 28-byte header followed by a
+# channels x samples payload. The legacy protocol is bare 32x18 float32 frames.
+# The magic is the bit pattern of a float32 NaN, so a legacy stream never
+# starts with it and the receiver can tell the two apart from the first bytes.
+MAGIC = b'SG\xf2\x7f'
+VERSION = 2
+HEADER = np.dtype([('magic', 'S4'), ('version', 'u1'), ('dtype', 'u1'), ('channels', '<u2'),
+                   ('sequence', '<u4'), ('timestamp', '<f8'), ('samples', '<u2'), ('reserved', '<u2'),
+                   ('scale', '<f4')])
+DTYPES = {0: np.dtype('<f4'), 1: np.dtype('<i2')}
+DTYPE_CODES = {'float32': 0, 'int16': 1}
+INT16_MAX = 32767
+
+
+@lru_cache(maxsize=None)
+def record_dtype(dtype_code, channels, samples):
+    """Header plus payload of one frame, so a run of equal frames parses with one frombuffer."""
+    return np.dtype(HEADER.descr + [('payload', DTYPES[dtype_code], (channels, samples))])
+
+
+def encode_frames(frames, first_sequence=0, dtype='float32', timestamp=None):
+    """Encode (frames, channels, samples) float data as v2 frames with consecutive sequence numbers.
+
+    int16 frames carry a per-frame scale so each frame uses the full 16 bits.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    count, channels, samples = frames.shape
+    code = DTYPE_CODES[dtype]
+    records = np.zeros(count, dtype=record_dtype(code, channels, samples))
+    records['magic'] = MAGIC
+    records['version'] = VERSION
+    records['dtype'] = code
+    records['channels'] = channels
+    records['samples'] = samples
+    records['sequence'] = (first_sequence + np.arange(count)) % 2 ** 32
+    records['timestamp'] = time.time() if timestamp is None else timestamp
+    if code == DTYPE_CODES['int16']:
+        scale = np.abs(frames).reshape(count, -1).max(axis=1) / INT16_MAX
+        scale[scale == 0] = 1.0
+        records['scale'] = scale
+        records['payload'] = np.rint(frames / scale[:, None, None])
+    else:
+        records['scale'] = 1.0
+        records['payload'] = frames
+    return records.tobytes()
+
+
+class FrameDecoder:
+    """Splits a v2 byte stream into 32x18 float32 frames.
+
+    Tracks sequence gaps (lost frames), frames that arrive out of order and
+    the sender-to-receiver latency. The latency compares the sender's wall
+    clock with ours, so it is only meaningful with synchronized clocks.
+    """
+
+    def __init__(self):
+        self.lost = 0
+        self.out_of_order = 0
+        self.__last_sequence = None
+
+    def decode(self, buffer, length):
+        """Decode the complete frames in buffer[:length]; return (frames, bytes consumed)."""
+        chunks = []
+        offset = 0
+        while length - offset >= HEADER.itemsize:
+            header = np.frombuffer(buffer, HEADER, count=1, offset=offset)[0]
+            if header['magic'] != MAGIC or header['version'] != VERSION:
+                raise ValueError("invalid frame header")
+            if header['dtype'] not in DTYPES:
+                raise ValueError(f"unknown sample type {header['dtype']}")
+            if header['channels'] != NUMBER_OF_CHANNELS or header['samples'] % CHANNEL_LENGTH:
+                raise ValueError(f"unsupported frame layout {header['channels']}x{header['samples']}")
+
+            record = record_dtype(int(header['dtype']), int(header['channels']), int(header['samples']))
+            count = (length - offset) // record.itemsize
+            if count == 0:
+                break
+            records = np.frombuffer(buffer, record, count=count, offset=offset)
+            same = ((records['magic'] == MAGIC) & (records['version'] == VERSION) &
+                    (records['dtype'] == header['dtype']) & (records['channels'] == header['channels']) &
+                    (records['samples'] == header['samples']))
+            if not same.all():
+                records = records[:np.argmin(same)]  # the rest starts with another layout
+            offset += len(records) * record.itemsize
+
+            payload = records['payload'].astype(np.float32)
+            if header['dtype'] == DTYPE_CODES['int16']:
+                payload *= records['scale'][:, None, None]
+            # Split longer frames into 32x18 frames for the rest of the pipeline
+            frames = payload.reshape(len(records), NUMBER_OF_CHANNELS, -1, CHANNEL_LENGTH).transpose(0, 2, 1, 3)
+            chunks.append(frames.reshape(-1, NUMBER_OF_CHANNELS, CHANNEL_LENGTH))
+            self.__track(records['sequence'], records['timestamp'])
+
+        if not chunks:
+            return np.zeros((0, NUMBER_OF_CHANNELS, CHANNEL_LENGTH), dtype=np.float32), offset
+        return (chunks[0] if len(chunks) == 1 else np.concatenate(chunks)), offset
+
+    def __track(self, sequences, timestamps):
+        # Distances from the highest sequence seen so far, unwrapped around 2**32
+        base = int(sequences[0]) - 1 if self.__last_sequence is None else self.__last_sequence
+        relative = (sequences.astype(np.int64) - base + 2 ** 31) % 2 ** 32 - 2 ** 31
+        highest = np.maximum.accumulate(np.concatenate(([0], relative)))
+        steps = relative - highest[:-1]
+        ahead = steps > 0
+        gaps = int(np.sum(steps[ahead] - 1))
+        late = int(np.count_nonzero(steps < 0))  # arrived after a newer frame, so not lost after all
+        self.lost += gaps - late
+        self.out_of_order += len(steps) - int(np.count_nonzero(ahead))
+        if gaps:
+            metrics.count("frames_lost", gaps)
+        if late:
+            metrics.count("frames_lost", -late)
+        if not ahead.all():
+            metrics.count("frames_out_of_order", len(steps) - int(np.count_nonzero(ahead)))
+        self.__last_sequence = (base + int(highest[-1])) % 2 ** 32
+        metrics.record("sender_latency", max(0.0, time.time() - float(timestamps[-1])))
@@ -0,0 +1,196 @@
+import logging
+import os
+import queue
+import struct
+import time
+from threading import Lock, Thread
+
+import numpy as np
+
+from config import SAMPLING_FREQUENCY, PLOT_MAX_POINTS, RECORDING_QUEUE_BYTES
+from service.data_buffer import query_span
+from service.events import EVENT_DTYPE, select_events
+from service.lod import minmax_decimate
+from service.metrics import metrics
+
+# File layout: a fixed-size header, then float32 samples as (samples, channels)
+# rows appended in arrival order. The sidecar <path>.idx holds one
+# (first sample, arrival time) record per written chunk, <path>.events the
+# EVENT_DTYPE records of the events detected while recording.
+MAGIC = b'SIGREC\0\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIId')
+HEADER_SIZE = 64
+INDEX_DTYPE = np.dtype([('position', '<i8'), ('timestamp', '<f8')])
+
+
+class RecordingWriter:
+    """Appends chunks to a recording file from a background thread.
+
+    write() only puts the chunk on a queue, and the directory and files are
+    created on the writer thread, so the receive thread never waits for the
+    disk. Chunks that would take the queue over `queue_bytes` are dropped
+    and counted. After an I/O error the recording stops: write() does
+    nothing and the error is passed to status_callback.
+    """
+
+    def __init__(self, path, number_of_channels, sampling_frequency=SAMPLING_FREQUENCY,
+                 queue_bytes=RECORDING_QUEUE_BYTES, status_callback=None):
+        self.path = path
+        self.failed = False
+        self.__queue = queue.SimpleQueue()
+        self.__queue_bytes = queue_bytes
+        self.__queued_bytes = 0
+        self.__queued_lock = Lock()
+        self.__dropping = False
+        self.__status_callback = status_callback
+        self.__thread = Thread(target=self.__run, args=(number_of_channels, sampling_frequency), daemon=True)
+        self.__thread.start()
+
+    def write(self, chunk, events=None):
+        """Queue a chunk, with the events to record at positions counted from its first sample."""
+        if self.failed:
+            return
+        with self.__queued_lock:
+            if self.__queued_bytes + chunk.nbytes > self.__queue_bytes:
+                metrics.count("recording_chunks_dropped")
+                if not self.__dropping:
+                    self.__dropping = True
+                    self.__report(f"Recording to {self.path} falls behind; dropping chunks", logging.WARNING)
+                return
+            self.__queued_bytes += chunk.nbytes
+            if self.__queued_bytes < self.__queue_bytes // 2:
+                self.__dropping = False  # caught up; report the next overflow again
+        if not chunk.flags.owndata:
+            chunk = chunk.copy()  # a view, e.g. of a shared ingest ring, may be overwritten before it is written
+        self.__queue.put((chunk, time.time(), events))
+
+    def close(self, wait=True):
+        """Finish the files once the queued chunks are written; wait=False returns right away."""
+        self.__queue.put(None)
+        if wait:
+            self.__thread.join()
+
+    def __run(self, number_of_channels, sampling_frequency):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'wb') as data_file, open(self.path + '.idx', 'wb') as index_file, \
+                    open(self.path + '.events', 'wb') as events_file:
+                header = HEADER.pack(MAGIC, VERSION, number_of_channels, sampling_frequency)
+                data_file.write(header.ljust(HEADER_SIZE, b'\0'))
+                position = 0
+                while True:
+                    item = self.__queue.get()
+                    if item is None:
+                        break
+                    chunk, timestamp, events = item
+                    with self.__queued_lock:
+                        self.__queued_bytes -= chunk.nbytes
+                    if chunk.shape[1]:  # an empty chunk only carries events
+                        data_file.write(np.ascontiguousarray(chunk.T, dtype=np.float32).tobytes())
+                        index_file.write(np.array([(position, timestamp)], dtype=INDEX_DTYPE).tobytes())
+                    if events is not None and len(events):
+                        events = events.copy()
+                        events['position'] += position
+                        events_file.write(events.tobytes())
+                    position += chunk.shape[1]
+                    if self.__queue.empty():
+                        # Make the file readable for offline analysis while recording
+                        data_file.flush()
+                        index_file.flush()
+                        events_file.flush()
+        except Exception as e:
+            self.failed = True
+            metrics.count("recording_failures")
+            while not self.__queue.empty():
+                self.__queue.get()  # release the chunks that will not be written
+            self.__report(f"Recording to {self.path} failed: {e}", logging.ERROR, exc_info=True)
+
+    def __report(self, message, level, exc_info=False):
+        logging.log(level, message, exc_info=exc_info)
+        if self.__status_callback is not None:
+            self.__status_callback(message)
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as data_file:
+            magic, version, number_of_channels, sampling_frequency = HEADER.unpack(
+                data_file.read(HEADER_SIZE)[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a recording file")
+
+        self.number_of_channels = number_of_channels
+        self.sampling_frequency = sampling_frequency
+        # A trailing partial row can exist while the writer is still running
+        length = (os.path.getsize(path) - HEADER_SIZE) // (4 * number_of_channels)
+        if length > 0:
+            self.__samples = np.memmap(path, dtype=np.float32, mode='r', offset=HEADER_SIZE,
+                                       shape=(length, number_of_channels))
+        else:
+            self.__samples = np.zeros((0, number_of_channels), dtype=np.float32)
+
+        index_path = path + '.idx'
+        if os.path.exists(index_path):
+            self.index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+        events_path = path + '.events'
+        events = np.fromfile(events_path, dtype=np.uint8) if os.path.exists(events_path) else np.zeros(0, np.uint8)
+        # Drop a partially written trailing record
+        events = events[:len(events) - len(events) % EVENT_DTYPE.itemsize].view(EVENT_DTYPE)
+        if np.any(events['position'][1:] < events['position'][:-1]):
+            # Files written by older versions can hold flat lines out of order
+            events = events[np.argsort(events['position'], kind='stable')]
+        self.events = events
+
+    def __len__(self):
+        return self.__samples.shape[0]
+
+    def get_channel_data(self, channel_index):
+        if channel_index < 0 or channel_index >= self.number_of_channels:
+            return np.array([], dtype=np.float32)
+        return self.__samples[:, channel_index]
+
+    def get_rows(self, start, stop):
+        """Return samples [start, stop) of all channels as (samples, channels)."""
+        return self.__samples[start:stop]
+
+    def read_rows(self, start, stop):
+        """Like get_rows, but read into a new array instead of mapped.
+
+        A scan of a long recording then does not keep every page it touched.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        count = max(0, stop - start)
+        with open(self.path, 'rb') as data_file:
+            data_file.seek(HEADER_SIZE + start * 4 * self.number_of_channels)
+            rows = np.fromfile(data_file, dtype=np.float32, count=count * self.number_of_channels)
+        return rows.reshape(-1, self.number_of_channels)
+
+    def get_version(self):
+        return self.path, 0, len(self)
+
+    def query(self, channels=None, start=None, stop=None, last=None, since=None, until=None):
+        """Return (data, version) of a span, like DataBuffer.query; time bounds use the .idx arrival times.
+
+        The data are views of the memory-mapped file, so only the pages of the
+        span are read. version is (path, first, stop).
+        """
+        first, end = query_span(0, len(self), self.index, start, stop, last, since, until)
+        rows = self.__samples[first:end]
+        data = rows.T if channels is None else rows[:, channels].T
+        return data, (self.path, first, end)
+
+    def get_events(self, channels=None, kinds=None, start=None, stop=None, last=None):
+        """Return the events detected while recording; see select_events."""
+        return select_events(self.events, channels, kinds, start, stop, last)
+
+    def get_channel_envelope(self, channel_index, start=0, stop=None, points=PLOT_MAX_POINTS):
+        data = self.get_channel_data(channel_index)[start:stop]
+        x, y = minmax_decimate(data, points)
+        return x + start, y
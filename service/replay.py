@@ -0,0 +1,76 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, SIGNAL_SIZE, SAMPLING_FREQUENCY, FRAMES_PER_RECEIVE
+from service.recording import Recording
+
+
+class ReplayService:
+    """Feeds a recorded session into the pipeline the same way TCPService does.
+
+    Reads .sigrec recordings or raw dumps of the 576-float wire format. A speed
+    of 1 replays in real time, N replays N times faster and 0 replays as fast
+    as possible.
+    """
+
+    def __init__(self, new_data_callback, status_callback, path, speed=1.0):
+        self.__new_data_callback = new_data_callback
+        self.__status_callback = status_callback
+        self.__path = path
+        self.__speed = speed
+        self.__source_name = f"replay:{os.path.basename(path)}"
+
+    def start(self, kill_event):
+        self.__status_callback(f"Replaying {self.__path}...")
+        try:
+            count, read_frames = self.__open()
+            frame_duration = CHANNEL_LENGTH / SAMPLING_FREQUENCY
+            # Deliver several frames per step unthrottled, one per step otherwise
+            batch = FRAMES_PER_RECEIVE if self.__speed <= 0 else 1
+            started = time.perf_counter()
+
+            for first in range(0, count, batch):
+                if kill_event.is_set():
+                    self.__status_callback("Replay stopped")
+                    return
+                if self.__speed > 0:
+                    # Sleep until this frame's deadline so timing errors do not accumulate
+                    deadline = started + first * frame_duration / self.__speed
+                    delay = deadline - time.perf_counter()
+                    if delay > 0:
+                        kill_event.wait(delay)
+                self.__new_data_callback(read_frames(first, min(first + batch, count)), self.__source_name)
+
+            elapsed = time.perf_counter() - started
+            self.__status_callback(f"Replay finished: {count} frames in {elapsed:.2f} s "
+                                   f"({count / max(elapsed, 1e-9):.0f} frames/s)")
+        except Exception as e:
+            self.__status_callback(f"Replay error: {e}")
+            logging.error(f"Replay error: {e}")
+
+    def __open(self):
+        # Returns the frame count and a reader for (frames, channels, samples)
+        # blocks; both formats are memory-mapped and read lazily.
+        if self.__path.endswith('.sigrec'):
+            recording = Recording(self.__path)
+            if recording.number_of_channels != NUMBER_OF_CHANNELS:
+                raise ValueError(f"recording has {recording.number_of_channels} channels, "
+                                 f"expected {NUMBER_OF_CHANNELS}")
+
+            def read_recording(first, last):
+                rows = recording.get_rows(first * CHANNEL_LENGTH, last * CHANNEL_LENGTH)
+                return rows.reshape(last - first, CHANNEL_LENGTH, NUMBER_OF_CHANNELS).transpose(0, 2, 1)
+
+            return len(recording) // CHANNEL_LENGTH, read_recording
+
+        count = os.path.getsize(self.__path) // (4 * SIGNAL_SIZE)
+        if count == 0:
+            return 0, None
+        frames = np.memmap(self.__path, dtype=np.float32, mode='r', shape=(count, NUMBER_OF_CHANNELS, CHANNEL_LENGTH))
+        return count, lambda first, last: frames[first:last]
+
+    def stop(self):
+        self.__status_callback("Stopping replay...")
@@ -0,0 +1,88 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, INGEST_RING_SAMPLES
+
+_HEADER_BYTES = 64  # int64 total samples written, channels, capacity; the samples start cache-line aligned
+_TOTAL, _CHANNELS, _CAPACITY = range(3)
+
+
+class SharedRing:
+    """Ring of channels x samples float32 in shared memory, written by one process and read by another.
+
+    The writer stores the samples first and then advances the total sample
+    count in the header, the sequence counter readers follow. Readers get
+    zero-copy views and use intact() to find out whether the writer lapped a
+    view while they were using it. Pass `name` to attach to a ring created
+    by another process.
+    """
+
+    def __init__(self, name=None, number_of_channels=NUMBER_OF_CHANNELS, capacity=INGEST_RING_SAMPLES):
+        if name is None:
+            size = _HEADER_BYTES + number_of_channels * capacity * 4
+            self.__memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.__memory = shared_memory.SharedMemory(name=name)
+        self.__header = np.ndarray(3, dtype=np.int64, buffer=self.__memory.buf)
+        if name is None:
+            self.__header[:] = (0, number_of_channels, capacity)
+        self.capacity = int(self.__header[_CAPACITY])
+        self.__data = np.ndarray((int(self.__header[_CHANNELS]), self.capacity), dtype=np.float32,
+                                 buffer=self.__memory.buf, offset=_HEADER_BYTES)
+
+    @property
+    def name(self):
+        return self.__memory.name
+
+    @property
+    def total(self):
+        """Samples written since the ring was created."""
+        return int(self.__header[_TOTAL])
+
+    def write(self, frames):
+        """Append (frames, channels, CHANNEL_LENGTH) frames; only the writing process calls this."""
+        total = int(self.__header[_TOTAL])
+        kept = frames[-(self.capacity // CHANNEL_LENGTH):]
+        total += (len(frames) - len(kept)) * CHANNEL_LENGTH  # readers see the dropped frames as overwritten
+        frames = kept
+        written = 0
+        while written < len(frames):
+            start = (total % self.capacity) // CHANNEL_LENGTH
+            count = min(len(frames) - written, self.capacity // CHANNEL_LENGTH - start)
+            # The frames are transposed straight into the ring, one copy in all
+            target = self.__data[:, start * CHANNEL_LENGTH:(start + count) * CHANNEL_LENGTH]
+            target.reshape(target.shape[0], count, CHANNEL_LENGTH)[...] = \
+                frames[written:written + count].transpose(1, 0, 2)
+            written += count
+            total += count * CHANNEL_LENGTH
+        self.__header[_TOTAL] = total
+
+    def read(self, position, max_samples=None):
+        """Return (samples, start) for the samples written from absolute sample `position` on.
+
+        samples is a channels x n view of the shared block, up to the end of
+        the ring, so more may be left for the next call. start is later than
+        position when the writer already overwrote the samples in between.
+        """
+        total = int(self.__header[_TOTAL])
+        start = max(position, total - self.capacity)
+        offset = start % self.capacity
+        count = min(total - start, self.capacity - offset)
+        if max_samples is not None:
+            count = min(count, max_samples)
+        return self.__data[:, offset:offset + count], start
+
+    def intact(self, start):
+        """Whether samples from `start` on have not been overwritten yet."""
+        return int(self.__header[_TOTAL]) - self.capacity <= start
+
+    def release(self, unlink=False):
+        """Detach from the shared block; the reading process also unlinks it."""
+        self.__header = self.__data = None
+        try:
+            self.__memory.close()
+        except BufferError:
+            pass  # a reader still holds a view; the mapping goes away with it
+        if unlink:
+            self.__memory.unlink()
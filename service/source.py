@@ -0,0 +1,124 @@
+import threading
+import time
+
+import numpy as np
+
+from config import BUFFER_MEMORY_BYTES, DERIVED_HISTORY_SAMPLES, NUMBER_OF_CHANNELS
+from service.data_buffer import DataBuffer
+from service.dsp import StreamingBandpassFilter, StreamingRMS
+from service.events import EventDetector, EventIndex
+from service.metrics import metrics
+from service.recording import RecordingWriter
+from service.spectrogram import StreamingSpectrogram
+
+
+class SourceData:
+    """History buffers and streaming DSP state of one connected data source.
+
+    append() runs on the ingest thread, clear() and the recording methods
+    also on others; a lock keeps them from interleaving within a chunk.
+    """
+
+    def __init__(self, name, recording_path=None, status_callback=None):
+        self.name = name
+        self.__status_callback = status_callback
+        self.__buffer = DataBuffer(BUFFER_MEMORY_BYTES, NUMBER_OF_CHANNELS)
+        # Offline analysis derives its signals from the raw history; these only feed the live views
+        self.__filtered_buffer = DataBuffer(None, NUMBER_OF_CHANNELS, lod=False, hot_samples=DERIVED_HISTORY_SAMPLES)
+        self.__rms_buffer = DataBuffer(None, NUMBER_OF_CHANNELS, lod=False, hot_samples=DERIVED_HISTORY_SAMPLES)
+        self.__bandpass_filter = StreamingBandpassFilter()
+        self.__rms = StreamingRMS()
+        self.__spectrogram = StreamingSpectrogram(NUMBER_OF_CHANNELS)
+        self.__detector = EventDetector(NUMBER_OF_CHANNELS)
+        self.__events = EventIndex()
+        self.__lock = threading.Lock()
+        self.__recording = None
+        if recording_path:
+            self.__recording = RecordingWriter(recording_path, NUMBER_OF_CHANNELS, status_callback=status_callback)
+
+    def append(self, chunk):
+        with self.__lock:
+            self.__append(chunk)
+
+    def __append(self, chunk):
+        started = time.perf_counter()
+        self.__buffer.append_chunk(chunk)
+        appended = time.perf_counter()
+        first = self.__detector.position
+        events = self.__detector.process(chunk)
+        self.__events.add(events)
+        if self.__recording is not None:
+            self.__recording.write(chunk, self.__relative(events, first))
+        detected = time.perf_counter()
+        filtered = self.__bandpass_filter.process(chunk)
+        rms = self.__rms.process(chunk)
+        self.__spectrogram.process(chunk)
+        processed = time.perf_counter()
+        self.__filtered_buffer.append_chunk(filtered)
+        self.__rms_buffer.append_chunk(rms)
+        metrics.record("dsp", processed - detected)
+        metrics.record("append", appended - started + time.perf_counter() - processed)
+
+    @staticmethod
+    def __relative(events, first):
+        # The recording counts event positions from the chunk they are written with;
+        # held-back events can lie before it
+        if len(events):
+            events = events.copy()
+            events['position'] -= first
+        return events
+
+    def __flush_events(self):
+        events = self.__detector.flush()
+        self.__events.add(events)
+        if self.__recording is not None and len(events):
+            empty = np.empty((NUMBER_OF_CHANNELS, 0), dtype=np.float32)
+            self.__recording.write(empty, self.__relative(events, self.__detector.position))
+
+    def get_buffer(self, signal_type="unfiltered"):
+        buffers = {"unfiltered": self.__buffer, "filtered": self.__filtered_buffer, "rms": self.__rms_buffer}
+        return buffers[signal_type]
+
+    def get_events(self):
+        return self.__events
+
+    def get_spectrogram(self):
+        return self.__spectrogram
+
+    def open_recording(self, path):
+        """Record the chunks from now on to a new file at `path`, e.g. after the source reconnected."""
+        with self.__lock:
+            recording = self.__detach_recording()
+            if path:
+                self.__recording = RecordingWriter(path, NUMBER_OF_CHANNELS, status_callback=self.__status_callback)
+        if recording is not None:
+            recording.close(wait=False)
+
+    def close_recording(self, wait=True):
+        with self.__lock:
+            recording = self.__detach_recording()
+        if recording is not None:
+            recording.close(wait)  # outside the lock, so appends need not wait for the disk
+
+    def __detach_recording(self):
+        self.__flush_events()
+        recording, self.__recording = self.__recording, None
+        return recording
+
+    def occupancy(self):
+        return self.__buffer.occupancy()
+
+    def is_empty(self):
+        return self.__buffer.is_empty()
+
+    def clear(self):
+        with self.__lock:
+            self.__flush_events()  # so the recording keeps them
+            self.__buffer.clear()
+            self.__filtered_buffer.clear()
+            self.__rms_buffer.clear()
+            self.__bandpass_filter.reset()
+            self.__rms.reset()
+            self.__spectrogram.reset()
+            self.__detector.reset()
+            self.__events.clear()
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import (SAMPLING_FREQUENCY, SPECTROGRAM_WINDOW, SPECTROGRAM_HOP, SPECTROGRAM_COLUMNS, WELCH_SEGMENT,
+                    WELCH_BLOCK_SEGMENTS)
+
+
+class StreamingSpectrogram:
+    """Short-time power spectra of every channel, computed as chunks arrive.
+
+    Only the windows completed by the new chunk are transformed, so the work
+    per chunk does not depend on the history length. The newest `columns`
+    spectra (in dB) are kept in a mirrored ring like DataBuffer's, so the
+    rolling image is always one contiguous slice.
+    """
+
+    def __init__(self, number_of_channels, window=SPECTROGRAM_WINDOW, hop=SPECTROGRAM_HOP,
+                 columns=SPECTROGRAM_COLUMNS, fs=SAMPLING_FREQUENCY):
+        self.window = window
+        self.hop = hop
+        self.columns = columns
+        self.freqs = np.fft.rfftfreq(window, 1.0 / fs)
+        self.__number_of_channels = number_of_channels
+        self.__taper = hann(window).astype(np.float32)
+        # One-sided power spectral density scaling, as in scipy.signal.welch
+        self.__scale = np.full(len(self.freqs), 2.0 / (fs * np.sum(self.__taper ** 2)), dtype=np.float32)
+        self.__scale[0] /= 2
+        if window % 2 == 0:
+            self.__scale[-1] /= 2
+        self.__image = np.zeros((number_of_channels, 2 * columns, len(self.freqs)), dtype=np.float32)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def process(self, chunk):
+        """Add a channels x samples chunk and return the number of new spectra."""
+        pending = np.concatenate((self.__pending, np.asarray(chunk, dtype=np.float32)), axis=1)
+        count = (pending.shape[1] - self.window) // self.hop + 1 if pending.shape[1] >= self.window else 0
+        if count > 0:
+            windows = sliding_window_view(pending, self.window, axis=1)[:, ::self.hop][:, :count]
+            power = np.abs(np.fft.rfft(windows * self.__taper, axis=-1)) ** 2 * self.__scale
+            self.__append(10 * np.log10(power + 1e-12))
+            pending = pending[:, count * self.hop:]
+        self.__pending = pending
+        return count
+
+    def __append(self, spectra):
+        produced = spectra.shape[1]
+        spectra = spectra[:, -self.columns:]
+        slots = (self.__head + np.arange(spectra.shape[1])) % self.columns
+        with self.__lock:
+            self.__image[:, slots] = spectra
+            self.__image[:, slots + self.columns] = spectra
+            self.__head = (self.__head + spectra.shape[1]) % self.columns
+            self.__size = min(self.__size + spectra.shape[1], self.columns)
+            self.__total += produced
+
+    def get_columns_since(self, channel_index, position, max_columns=None):
+        """Return (spectra, next_position): the columns x bins spectra after absolute column `position`."""
+        if channel_index < 0 or channel_index >= self.__number_of_channels:
+            return np.zeros((0, len(self.freqs)), dtype=np.float32), position
+        with self.__lock:
+            total = self.__total
+            if position > total:
+                position = 0  # reset since the last read
+            count = min(total - position, self.__size)
+            if max_columns is not None:
+                count = min(count, max_columns)
+            start = (self.__head - count) % self.columns
+            return self.__image[channel_index, start:start + count].copy(), total
+
+    def reset(self):
+        with self.__lock:
+            self.__pending = np.zeros((self.__number_of_channels, 0), dtype=np.float32)
+            self.__head = 0
+            self.__size = 0
+            self.__total = 0
+
+
+def hann(length):
+    """Periodic Hann window, as scipy.signal.get_window('hann', length), without importing SciPy."""
+    return np.hanning(length + 1)[:-1]
+
+
+def welch_psd(data, fs=SAMPLING_FREQUENCY, segment=WELCH_SEGMENT, block=WELCH_BLOCK_SEGMENTS):
+    """One-sided Welch PSD of a 1-D signal (Hann windows, 50% overlap, constant detrend).
+
+    Matches scipy.signal.welch, but transforms `block` segments at a time and
+    only keeps their running sum, so memory stays bounded for memory-mapped
+    recordings of any length. Returns (freqs in Hz, psd).
+    """
+    segment = min(segment, len(data))
+    if segment < 2:
+        return np.array([]), np.array([])
+    hop = segment - segment // 2
+    count = (len(data) - segment) // hop + 1
+    taper = hann(segment)
+    total = np.zeros(segment // 2 + 1)
+    for first in range(0, count, block):
+        last = min(first + block, count)
+        windows = sliding_window_view(np.asarray(data[first * hop:(last - 1) * hop + segment], dtype=np.float64),
+                                      segment)[::hop]
+        windows = windows - windows.mean(axis=1, keepdims=True)
+        total += np.sum(np.abs(np.fft.rfft(windows * taper, axis=1)) ** 2, axis=0)
+
+    psd = total / (count * fs * np.sum(taper ** 2))
+    psd[1:len(psd) - (segment % 2 == 0)] *= 2
+    return np.fft.rfftfreq(segment, 1.0 / fs), psd
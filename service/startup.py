@@ -0,0 +1,66 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """Wall-clock durations of the startup stages, from the first import of this module.
+
+    Stages are recorded whether or not profiling is enabled; report() formats
+    them. Stages that run after the report (widgets created on first use)
+    are logged one by one when profiling is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.__started = time.perf_counter()
+        self.__stages = []  # (name, seconds since start, duration, thread name)
+        self.__reported = False
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__add(name, started, time.perf_counter() - started)
+
+    def mark(self, name):
+        """Record an instant, like the window being shown."""
+        self.__add(name, time.perf_counter(), 0.0)
+
+    def __add(self, name, started, duration):
+        with self.__lock:
+            self.__stages.append((name, started - self.__started, duration, threading.current_thread().name))
+            late = self.__reported
+        if late and self.enabled:
+            logging.info(f"Startup profile: {name} took {duration * 1000:.0f} ms")
+
+    def report(self):
+        with self.__lock:
+            self.__reported = True
+            stages = sorted(self.__stages, key=lambda stage: stage[1])
+        lines = [f"{'stage':<32}{'at ms':>9}{'took ms':>9}  thread"]
+        for name, at, duration, thread in stages:
+            lines.append(f"{name:<32}{at * 1000:>9.0f}{duration * 1000:>9.0f}  {thread}")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
+
+
+def prefetch(module_names):
+    """Import modules on a background thread, so their first use does not wait for the import."""
+    def run():
+        for name in module_names:
+            if name not in sys.modules:
+                with startup_profile.stage(f"prefetch {name}"):
+                    importlib.import_module(name)
+
+    thread = threading.Thread(target=run, name="prefetch", daemon=True)
+    thread.start()
+    return thread
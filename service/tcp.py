@@ -1,20 +1,42 @@
 import logging
+import selectors
 import socket
-import struct
+import time
 
-from config import RECEIVE_CHUNK_SIZE
-from service.data_buffer import to_chunk
+import numpy as np
+
+from config import RECEIVE_CHUNK_SIZE, SIGNAL_SIZE, NUMBER_OF_CHANNELS, CHANNEL_LENGTH, FRAMES_PER_RECEIVE
+from service.metrics import metrics
+from service.protocol import MAGIC, FrameDecoder
+from service.throttle import MessageThrottle
 
 
 class TCPService:
+    """Event-driven ingest server that serves any number of sources on one thread.
+
+    Every accepted connection is a separate source; complete frames are passed
+    to new_data_callback(frames, source_name) and source_closed_callback(source_name)
+    is called when the connection ends. A source is named after the client's
+    host, with "#2", "#3", ... for further connections from the same host at
+    the same time, so a device that reconnects gets its old name back rather
+    than a new one per client port. Status and log messages of the
+    receive loop go through a MessageThrottle, so a burst of connections or
+    errors turns into a few messages instead of one per event.
+    """
 
-    def __init__(self, new_data_callback, status_callback, host, port):
+    def __init__(self, new_data_callback, status_callback, host, port, source_closed_callback=None):
 
         self.__new_data_callback = new_data_callback
         self.__status_callback = status_callback
+        self.__source_closed_callback = source_closed_callback
+        self.__status = MessageThrottle(self.__publish)
         self.__host = host
         self.__port = port
         self.__server_socket = None
+        self.__selector = selectors.DefaultSelector()
+        self.__source_names = set()  # of the open connections
+        # stop() writes to this pair to wake the select loop immediately
+        self.__wakeup_receiver, self.__wakeup_sender = socket.socketpair()
 
     def start(self, kill_event):
         self.__status_callback("Starting TCP server...")
@@ -22,62 +44,175 @@ class TCPService:
             self.__server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.__server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.__server_socket.bind((self.__host, self.__port))
-            self.__server_socket.listen(1)
+            self.__server_socket.listen(socket.SOMAXCONN)
+            self.__server_socket.setblocking(False)
+            self.__wakeup_receiver.setblocking(False)
+            self.__selector.register(self.__server_socket, selectors.EVENT_READ)
+            self.__selector.register(self.__wakeup_receiver, selectors.EVENT_READ)
 
             self.__status_callback(f"TCP Server started on {self.__host}:{self.__port}")
             self.__status_callback("Waiting for connections...")
 
-
             while not kill_event.is_set():
+                # Wake up when a coalesced message is due, otherwise only for socket events
+                for key, _ in self.__selector.select(self.__status.flush()):
+                    if key.fileobj is self.__server_socket:
+                        self.__accept()
+                    elif key.fileobj is self.__wakeup_receiver:
+                        self.__wakeup_receiver.recv(64)
+                    else:
+                        self.__receive(key.data)
 
-                client_socket, client_address = self.__server_socket.accept()
-                self.__status_callback(f"Client connected: {client_address}")
-                logging.info(f"Client connected: {client_address}")
-
-                try:
-                    self.handle_connection(client_socket, kill_event)
-                except OSError:
-                    self.__status_callback("Error accepting connection")
-                    logging.exception("Error accepting connection")
-                except (ConnectionResetError, BrokenPipeError):
-                    pass
-                except Exception as e:
-                    self.__status_callback(f"Connection closed: error handling client {client_address}: {e}")
-                    logging.error(f"Connection closed: error handling client {client_address}: {e}")
-
-                self.__status_callback(f"Client {client_address} disconnected")
-                logging.info(f"Client {client_address} disconnected")
-                client_socket.close()
-
-        except ConnectionAbortedError:
-            pass
         except Exception as e:
-            self.__status_callback(f"Server error: {e}")
-            logging.error(f"Server error: {e}")
-
-    def handle_connection(self, client_socket, kill_event):
-            while not kill_event.is_set():
-                try:
-                    data = b''
-                    while len(data) < RECEIVE_CHUNK_SIZE:
-                        packet = client_socket.recv(RECEIVE_CHUNK_SIZE - len(data))
+            self.__status(f"Server error: {e}", logging.ERROR)
+        finally:
+            self.__close_all()
+            self.__status.flush(final=True)
+            self.__status_callback("TCP Server stopped")
 
-                        if len(packet) == 0:
-                            return
-
-                        data += packet
-
-                    if len(data) == RECEIVE_CHUNK_SIZE:
-                        chunk = struct.unpack('576f', data)
-                        self.__new_data_callback(to_chunk(chunk))
+    def __accept(self):
+        try:
+            client_socket, client_address = self.__server_socket.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.__status(f"Error accepting connection: {e}", logging.ERROR, key="accept error")
+            return
+
+        client_socket.setblocking(False)
+        connection = _Connection(client_socket, client_address, self.__source_name(client_address[0]))
+        self.__selector.register(client_socket, selectors.EVENT_READ, connection)
+        self.__status(f"Client connected: {client_address}", key="connected")
+
+    def __receive(self, connection):
+        try:
+            frames = connection.receive()
+        except (BlockingIOError, InterruptedError):
+            return
+        except (ConnectionResetError, BrokenPipeError):
+            frames = None
+        except Exception as e:
+            self.__status(f"Connection closed: error handling client {connection.address}: {e}", logging.ERROR,
+                          key=f"client error {type(e).__name__}")
+            frames = None
 
-                except socket.timeout:
-                    continue
+        if frames is None:
+            self.__disconnect(connection)
+            return
+        try:
+            if len(frames):
+                self.__new_data_callback(frames, connection.name)
+        except Exception as e:
+            # A failure storing one source's data must not stop the others
+            self.__status(f"Connection closed: error storing data of client {connection.address}: {e}",
+                          logging.ERROR, key=f"store error {type(e).__name__}")
+            logging.exception(f"Storing data of {connection.name} failed")
+            self.__disconnect(connection)
+            return
+        connection.consume()
+
+    def __disconnect(self, connection):
+        self.__selector.unregister(connection.socket)
+        connection.socket.close()
+        self.__source_names.discard(connection.name)
+        if self.__source_closed_callback is not None:
+            self.__source_closed_callback(connection.name)
+        message = f"Client {connection.address} disconnected"
+        key = "disconnected"
+        decoder = connection.decoder
+        if decoder is not None:
+            message += f" (protocol v2, {decoder.lost} frames lost, {decoder.out_of_order} out of order)"
+            if decoder.lost or decoder.out_of_order:
+                key = message  # always report a connection that lost frames
+        self.__status(message, key=key)
+
+    def __source_name(self, host):
+        name, number = host, 1
+        while name in self.__source_names:
+            number += 1
+            name = f"{host}#{number}"
+        self.__source_names.add(name)
+        return name
+
+    def __publish(self, message, level):
+        self.__status_callback(message)
+        logging.log(level, message)
+
+    def __close_all(self):
+        for key in list(self.__selector.get_map().values()):
+            if isinstance(key.data, _Connection):
+                self.__disconnect(key.data)
+        self.__selector.close()
+        if self.__server_socket:
+            self.__server_socket.close()
+        self.__wakeup_receiver.close()
+        self.__wakeup_sender.close()
 
     def stop(self):
         self.__status_callback("Stopping TCP Server...")
 
-        if self.__server_socket:
-            self.__server_socket.close()
-
-        self.__status_callback("TCP Server stopped")
+        try:
+            self.__wakeup_sender.send(b'\0')
+        except OSError:
+            pass  # the server loop has already exited
+
+
+class _Connection:
+    # Frames are received straight into one reusable buffer. The protocol is
+    # detected from the first bytes: legacy streams are exposed as a
+    # (frames, channels, samples) float32 view that is only valid until
+    # consume() is called, v2 streams are decoded into a new array.
+
+    def __init__(self, client_socket, address, name):
+        self.socket = client_socket
+        self.address = address
+        self.name = name
+        self.protocol = None
+        self.decoder = None
+        self.__buffer = bytearray(RECEIVE_CHUNK_SIZE * FRAMES_PER_RECEIVE)
+        self.__view = memoryview(self.__buffer)
+        self.__filled = 0
+        self.__complete = 0  # bytes of the frames returned by the last receive()
+
+    def receive(self):
+        """Read what the socket has; return complete frames, or None on EOF."""
+        started = time.perf_counter()
+        received = self.socket.recv_into(self.__view[self.__filled:])
+        received_at = time.perf_counter()
+        metrics.record("recv", received_at - started)
+        if received == 0:
+            return None
+        self.__filled += received
+        if self.protocol is None:
+            if self.__filled < len(MAGIC):
+                return _NO_FRAMES
+            self.protocol = "v2" if self.__buffer[:len(MAGIC)] == MAGIC else "raw"
+            if self.protocol == "v2":
+                self.decoder = FrameDecoder()
+
+        if self.protocol == "v2":
+            samples, self.__complete = self.decoder.decode(self.__buffer, self.__filled)
+            if self.__complete == 0 and self.__filled == len(self.__buffer):
+                self.__grow()  # a single frame is larger than the buffer
+        else:
+            frames = self.__filled // RECEIVE_CHUNK_SIZE
+            self.__complete = frames * RECEIVE_CHUNK_SIZE
+            samples = np.frombuffer(self.__buffer, dtype=np.float32, count=frames * SIGNAL_SIZE)
+            samples = samples.reshape(frames, NUMBER_OF_CHANNELS, CHANNEL_LENGTH)
+        metrics.record("decode", time.perf_counter() - received_at)
+        return samples
+
+    def consume(self):
+        """Release the frames returned by the last receive(), keeping the partial frame."""
+        end = self.__complete
+        self.__view[:self.__filled - end] = self.__view[end:self.__filled]
+        self.__filled -= end
+        self.__complete = 0
+
+    def __grow(self):
+        self.__view.release()
+        self.__buffer.extend(bytes(len(self.__buffer)))
+        self.__view = memoryview(self.__buffer)
+
+
+_NO_FRAMES = np.zeros((0, NUMBER_OF_CHANNELS, CHANNEL_LENGTH), dtype=np.float32)
@@ -0,0 +1,63 @@
+import logging
+import time
+
+from config import STATUS_INTERVAL
+from service.metrics import metrics
+
+
+class MessageThrottle:
+    """Coalesces repeated status and error messages of a hot loop.
+
+    The first message of a kind is published at once; more of the same kind
+    within `interval` seconds are only counted. When the interval ends, the
+    latest of them is published once with the count, unless a message of
+    another kind was published after it: the summary would then replace a
+    newer status, so it only goes to the log. Messages of a kind share
+    a key (the message itself by default), so errors that differ only in the
+    client address still coalesce. Not thread-safe: use it from one thread.
+    """
+
+    def __init__(self, publish, interval=STATUS_INTERVAL):
+        self.__publish = publish
+        self.__interval = interval
+        self.__kinds = {}  # key -> [end of the interval, suppressed count, latest message, its level, its number]
+        self.__received = 0  # messages so far, to number them
+        self.__published = 0  # number of the last message published
+
+    def __call__(self, message, level=logging.INFO, key=None):
+        key = message if key is None else key
+        self.flush()
+        self.__received += 1
+        state = self.__kinds.get(key)
+        if state is not None:
+            state[1] += 1
+            state[2] = message
+            state[3] = level
+            state[4] = self.__received
+            metrics.count("status_suppressed")
+            return
+        self.__kinds[key] = [time.monotonic() + self.__interval, 0, message, level, self.__received]
+        self.__published = self.__received
+        self.__publish(message, level)
+
+    def flush(self, final=False):
+        """Publish the counts of intervals that have ended; return seconds until the next ends, or None.
+
+        With final=True the counts of all intervals are published, e.g. when the loop exits.
+        """
+        now = time.monotonic()
+        next_end = None
+        for key, (end, suppressed, message, level, number) in list(self.__kinds.items()):
+            if now < end and not final:
+                next_end = end if next_end is None else min(next_end, end)
+                continue
+            del self.__kinds[key]
+            if not suppressed:
+                continue
+            summary = f"{message} (and {suppressed} more like this within {self.__interval:g} s)"
+            if number < self.__published:
+                logging.log(level, summary)  # a newer message is already shown
+            else:
+                self.__published = number
+                self.__publish(summary, level)
+        return None if next_end is None else next_end - now
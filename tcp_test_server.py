@@ -1,86 +1,90 @@
 import socket
-import struct
 import time
-import math
 import threading
 import argparse
-import signal
 import sys
-from typing import List, Tuple
+
+import numpy as np
+
+from config import NUMBER_OF_CHANNELS, CHANNEL_LENGTH, SAMPLING_FREQUENCY, SERVER_HOST, SERVER_PORT
+from service.protocol import HEADER, encode_frames
+
+FRAMES_PER_BATCH = 64
+
 
 class TCPTestClient:
-    def __init__(self, host: str = 'localhost', port: int = 5000, channels: int = 4, rate: float = 20.0):
+    """Streams 32x18 frames in either wire format TCPService accepts.
+
+    "raw" sends bare float32 frames, "v2" sends framed protocol v2 frames
+    with sequence numbers and timestamps, as float32 or scaled int16.
+
+    Frames are generated a batch at a time with NumPy and sent on absolute
+    deadlines, so the rate does not drift. A rate of 0 sends unthrottled.
+    """
+
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, rate: float = 20.0,
+                 duration: float = 0.0, protocol: str = "raw", dtype: str = "float32"):
         self.host = host
         self.port = port
-        self.channels = channels
         self.rate = rate
+        self.duration = duration
+        self.protocol = protocol
+        self.dtype = dtype
         self.running = False
         self.socket = None
-
-    def generate_signal_data(self, t: float) -> List[float]:
-        signals = []
-
-        for i in range(self.channels):
-            if i == 0:
-                # Sine wave with noise
-                signal = math.sin(t) * 100 + math.sin(t * 10) * 10
-            elif i == 1:
-                # Cosine wave
-                signal = math.cos(t * 0.5) * 75
-            elif i == 2:
-                # Square wave approximation
-                signal = 50 * (1 if math.sin(t * 2) > 0 else -1)
-            elif i == 3:
-                # Sawtooth wave
-                signal = (t % (2 * math.pi)) / math.pi * 60 - 30
-            else:
-                # Additional channels: combination waves
-                signal = math.sin(t * (i + 1)) * (100 / (i + 1))
-
-            signals.append(signal)
-
-        return signals
+        self.frames_sent = 0
+        self.elapsed = 0.0
+
+        channels = np.arange(NUMBER_OF_CHANNELS)
+        self.frequencies = (channels + 1).astype(np.float64)[:, None]
+        self.amplitudes = (100.0 / (channels + 1))[:, None]
+
+    def generate_frames(self, first_frame, count):
+        """Return `count` frames starting at `first_frame` as (frames, channels, samples) float32."""
+        samples = first_frame * CHANNEL_LENGTH + np.arange(count * CHANNEL_LENGTH)
+        t = samples / SAMPLING_FREQUENCY * 2 * np.pi
+        signals = np.sin(self.frequencies * t) * self.amplitudes
+        # Sine with a 10 Hz ripple, cosine, square and sawtooth waves on the first channels
+        signals[0] = np.sin(t) * 100 + np.sin(t * 10) * 10
+        signals[1] = np.cos(t * 0.5) * 75
+        signals[2] = 50 * np.sign(np.sin(t * 2))
+        signals[3] = (t % (2 * np.pi)) / np.pi * 60 - 30
+        frames = signals.reshape(NUMBER_OF_CHANNELS, count, CHANNEL_LENGTH).transpose(1, 0, 2)
+        return np.ascontiguousarray(frames, dtype=np.float32)
+
+    def encode(self, frames):
+        if self.protocol == "v2":
+            return encode_frames(frames, first_sequence=self.frames_sent, dtype=self.dtype)
+        return frames.tobytes()
 
     def start(self):
         try:
-            print("Connecting to server...")
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(5.0)
-            self.socket.connect((self.host, self.port))
+            self.socket = socket.create_connection((self.host, self.port), timeout=5.0)
             self.socket.settimeout(None)
-            print("Connected")
-
-
             self.running = True
 
-            print(f"Channels: {self.channels}, Update rate: {self.rate} Hz")
-            print(f"Data format: {self.channels} floats per packet ({self.channels * 4} bytes)")
-            print("Started sending data... (Press Ctrl+C to stop)")
-
+            started = time.perf_counter()
             while self.running:
-                try:
-                    t = 0.0
-                    dt = 1.0 / self.rate
-
-                    while self.running:
-                        signals = self.generate_signal_data(t)
-
-                        format_string = 'f' * self.channels
-                        data = struct.pack(format_string, *signals)
-
-                        self.socket.send(data)
-
-                        t += dt
-
-                        time.sleep(dt)
-
-                except OSError:
-                    if self.running:
-                        print("Error accepting connection")
+                now = time.perf_counter()
+                if self.duration and now - started >= self.duration:
                     break
 
-        except Exception as e:
-            print(f"Server error: {e}")
+                if self.rate > 0:
+                    due = int((now - started) * self.rate) + 1  # frames that should have been sent
+                    count = min(due - self.frames_sent, FRAMES_PER_BATCH)
+                    if count <= 0:
+                        time.sleep(started + self.frames_sent / self.rate - now)
+                        continue
+                else:
+                    count = FRAMES_PER_BATCH
+
+                self.socket.sendall(self.encode(self.generate_frames(self.frames_sent, count)))
+                self.frames_sent += count
+                self.elapsed = time.perf_counter() - started
+
+        except OSError as e:
+            if self.running:
+                print(f"Connection error: {e}")
         finally:
             self.stop()
 
@@ -89,31 +93,66 @@ class TCPTestClient:
         if self.socket:
             self.socket.close()
 
+
 def main():
-    parser = argparse.ArgumentParser(description='TCP Client for Signal Visualization')
-    parser.add_argument('--host', default='localhost', help='Server hostname (default: localhost)')
-    parser.add_argument('--port', type=int, default=5000, help='Server port (default: 12345)')
-    parser.add_argument('--channels', type=int, default=32, help='Number of channels (default: 4)')
-    parser.add_argument('--rate', type=float, default=20.0, help='Update rate in Hz (default: 20.0)')
+    parser = argparse.ArgumentParser(description='Load generator for the signal visualization app')
+    parser.add_argument('--host', default=SERVER_HOST, help=f'Server hostname (default: {SERVER_HOST})')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help=f'Server port (default: {SERVER_PORT})')
+    parser.add_argument('--rate', type=float, default=20.0,
+                        help='Frames per second per connection, 0 for unthrottled (default: 20.0)')
+    parser.add_argument('--connections', type=int, default=1, help='Concurrent connections (default: 1)')
+    parser.add_argument('--protocol', choices=('raw', 'v2'), default='raw',
+                        help='Wire format: bare float32 frames or framed protocol v2 (default: raw)')
+    parser.add_argument('--dtype', choices=('float32', 'int16'), default='float32',
+                        help='Sample type of v2 frames; int16 halves the bandwidth (default: float32)')
+    parser.add_argument('--duration', type=float, default=0.0, help='Seconds to run, 0 for forever (default: 0)')
 
     args = parser.parse_args()
 
-    if args.channels < 1:
-        print("Error: Number of channels must be at least 1")
+    if args.connections < 1:
+        print("Error: Number of connections must be at least 1")
         sys.exit(1)
 
-    if args.rate <= 0:
-        print("Error: Update rate must be positive")
+    if args.rate < 0:
+        print("Error: Rate must not be negative")
         sys.exit(1)
 
-    server = TCPTestClient(args.host, args.port, args.channels, args.rate)
+    clients = [TCPTestClient(args.host, args.port, args.rate, args.duration, args.protocol, args.dtype)
+               for _ in range(args.connections)]
+    threads = [threading.Thread(target=client.start, daemon=True) for client in clients]
+
+    frame_bytes = NUMBER_OF_CHANNELS * CHANNEL_LENGTH * 4
+    if args.protocol == "v2":
+        frame_bytes = HEADER.itemsize + NUMBER_OF_CHANNELS * CHANNEL_LENGTH * (2 if args.dtype == "int16" else 4)
+    rate_text = "unthrottled" if args.rate == 0 else f"{args.rate} frames/s"
+    print(f"{args.connections} connection(s) to {args.host}:{args.port}, {rate_text}, "
+          f"{frame_bytes} bytes per frame (Press Ctrl+C to stop)")
+
+    for thread in threads:
+        thread.start()
 
     try:
-        server.start()
+        last_frames, last_time = 0, time.perf_counter()
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1.0)
+            frames = sum(client.frames_sent for client in clients)
+            now = time.perf_counter()
+            print(f"{(frames - last_frames) / (now - last_time):10.0f} frames/s "
+                  f"({(frames - last_frames) * frame_bytes / (now - last_time) / 1e6:.1f} MB/s)")
+            last_frames, last_time = frames, now
     except KeyboardInterrupt:
         print("\nReceived keyboard interrupt")
     finally:
-        server.stop()
+        for client in clients:
+            client.stop()
+        for thread in threads:
+            thread.join(timeout=1.0)
+
+    frames = sum(client.frames_sent for client in clients)
+    achieved = sum(client.frames_sent / client.elapsed for client in clients if client.elapsed > 0)
+    print(f"Sent {frames} frames: {achieved:.0f} frames/s achieved "
+          f"({achieved * CHANNEL_LENGTH:.0f} samples/s per channel)")
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,93 +1,156 @@
-import logging
+import time
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QWidget, QVBoxLayout
 from vispy import scene
 from vispy.scene import Line
 import numpy as np
-from scipy import signal
 
-from config import SAMPLING_FREQUENCY, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, RMS_WINDOW, FILTER_ORDER
+from config import LIVE_WINDOW_SAMPLES, LIVE_MAX_COLUMNS, LIVE_DROP_POLICY, LIVE_MAX_BACKLOG, LIVE_FPS
+from service.metrics import metrics
 
 
 class ChannelPlotWidget(QWidget):
-    def __init__(self):
+    def __init__(self, get_new_data_callback, window_size=LIVE_WINDOW_SAMPLES, max_columns=LIVE_MAX_COLUMNS,
+                 drop_policy=LIVE_DROP_POLICY, max_backlog=LIVE_MAX_BACKLOG):
         super().__init__()
         self.canvas = scene.SceneCanvas(keys='interactive', show=True)  # Create canvas
         self.view = self.canvas.central_widget.add_view()
 
-        self.data = np.zeros(1)
-        initial_pos = np.column_stack((np.arange(1), self.data))
-        self.line = Line(pos=initial_pos, parent=self.view.scene, color='blue', width=2)
+        # Sweep display: x positions are fixed, new samples overwrite the oldest
+        # ones at the write index, so only fresh samples touch the vertex buffer.
+        # Samples are folded into min/max pairs per column, so the vertex count
+        # follows the plot width rather than the window length.
+        self.window_size = window_size
+        self.column_size = -(-window_size // max_columns)
+        columns = -(-window_size // self.column_size)
+        self.pos = np.zeros((2 * columns, 2), dtype=np.float32)
+        self.pos[:, 0] = np.repeat(np.arange(columns) * self.column_size, 2)
+        self.write_index = 0
+        self.filled = 0
+        self.dirty = False
+        self.line = Line(pos=self.pos, parent=self.view.scene, color='blue', width=2)
 
         self.view.camera = 'panzoom'
-        self.view.camera.set_range(x=(0, 1000), y=(-1, 1))
+        self.view.camera.set_range(x=(0, window_size), y=(-1, 1))
+        self.y_range = None
 
         layout = QVBoxLayout()
         layout.addWidget(self.canvas.native)
         self.setLayout(layout)
 
+        self.get_new_data_callback = get_new_data_callback
         self.channel_index = 0
-        self.sample_count = 0
+        self.position = 0
         self.signal_type = "unfiltered"
 
-        self.fs = SAMPLING_FREQUENCY
-        self.lowcut = LOW_CUTOFF_FREQUENCY
-        self.highcut = HIGH_CUTOFF_FREQUENCY
-        self.filter_order = FILTER_ORDER
-
-        self.rms_window = RMS_WINDOW
+        # "latest" jumps straight to the newest window on every frame; "paced"
+        # draws every sample in order and only skips once it lags by more than
+        # max_backlog samples. Either way the stored history is untouched.
+        self.drop_policy = drop_policy
+        self.max_backlog = max_backlog
+        # A paced frame draws at most a window; the rest is drawn on the next
+        # frame even if no new data arrives to trigger one
+        self.backlog_timer = QTimer(self)
+        self.backlog_timer.setSingleShot(True)
+        self.backlog_timer.setInterval(int(1000 / LIVE_FPS))
+        self.backlog_timer.timeout.connect(self.render_frame)
+
+        # Bracket the canvas draw handlers to time the actual GPU draw
+        self.canvas.events.draw.connect(self._on_draw_started, position='first')
+        self.canvas.events.draw.connect(self._on_draw_finished, position='last')
+        self.draw_started = None
 
     def clear_plot_data(self):
-        self.update_plot(np.zeros(1))
+        self.position = 0
+        self._reset_trace()
+
+    def set_channel(self, channel_index):
+        self.channel_index = channel_index
+        self.position = 0
+        self._reset_trace()
+        self.render_frame()
 
     def set_signal_type(self, signal_type):
+        # Every signal type is its own stream, so refetch the window
         self.signal_type = signal_type
-        self.update_plot(self.data)
-
-    def update_plot(self, data):
-
-        self.data = data
-
-        if self.signal_type == "filtered":
-            data = self._apply_bandpass_filter()
-        elif self.signal_type == "rms":
-            data = self._calculate_rms()
-
-        x_data = np.arange(len(data))
-
-        self.line.set_data(pos=np.column_stack((x_data, data)))
-
-        self._update_camera_range(data)
-
-    def _apply_bandpass_filter(self):
-        if len(self.data) < 2 * self.filter_order:
-            return self.data  # Not enough self.data for filtering
-
-        try:
-            nyquist = 0.5 * self.fs
-            low = self.lowcut / nyquist
-            high = self.highcut / nyquist
-            b, a = signal.butter(self.filter_order, [low, high], btype='band')
-            return signal.filtfilt(b, a, self.data)
-        except Exception as e:
-            logging.error(e)
-            return self.data  # Return original data if filtering fails
-
-    def _calculate_rms(self):
-        if len(self.data) < self.rms_window:
-            return np.sqrt(np.mean(self.data ** 2)) * np.ones_like(self.data)
-
-        rms_values = np.zeros_like(self.data)
-        for i in range(len(self.data)):
-            start_idx = max(0, i - self.rms_window // 2)
-            end_idx = min(len(self.data), i + self.rms_window // 2 + 1)
-            rms_values[i] = np.sqrt(np.mean(self.data[start_idx:end_idx] ** 2))
-        return rms_values
+        self.position = 0
+        self._reset_trace()
+        self.render_frame()
+
+    def _on_draw_started(self, event):
+        self.draw_started = time.perf_counter()
+
+    def _on_draw_finished(self, event):
+        if self.draw_started is not None:
+            metrics.record("canvas_draw", time.perf_counter() - self.draw_started)
+            self.draw_started = None
+
+    def render_frame(self):
+        max_backlog = self.window_size if self.drop_policy == "latest" else max(self.max_backlog, self.window_size)
+        previous = self.position
+        data, self.position = self.get_new_data_callback(self.channel_index, self.position, self.window_size,
+                                                         self.signal_type, max_backlog)
+        if self.position - previous > len(data) and previous > 0:
+            metrics.count("live_samples_skipped", self.position - previous - len(data))
+        if len(data):
+            self._write_samples(data)
+        if self.drop_policy == "paced" and len(data) == self.window_size:
+            self.backlog_timer.start()  # the read was capped, so more may be pending
+
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        started = time.perf_counter()
+        self.line.set_data(pos=self.pos)
+        metrics.record("line_set_data", time.perf_counter() - started)
+        self._update_camera_range(self.pos[:2 * -(-self.filled // self.column_size), 1])
+
+    def _reset_trace(self):
+        self.pos[:, 1] = 0
+        self.write_index = 0
+        self.filled = 0
+        self.y_range = None
+        self.dirty = True
+
+    def _write_samples(self, samples):
+        samples = samples[-self.window_size:]
+        while len(samples):
+            count = min(len(samples), self.window_size - self.write_index)
+            self._write_run(self.write_index, samples[:count])
+            samples = samples[count:]
+            self.write_index = (self.write_index + count) % self.window_size
+            self.filled = min(self.filled + count, self.window_size)
+        self.dirty = True
+
+    def _write_run(self, start, samples):
+        columns = np.arange(start // self.column_size, (start + len(samples) - 1) // self.column_size + 1)
+        offsets = np.maximum(columns * self.column_size - start, 0)
+        column_min = np.minimum.reduceat(samples, offsets)
+        column_max = np.maximum.reduceat(samples, offsets)
+        if start % self.column_size:
+            # Continue the column started by the previous frame
+            column_min[0] = min(column_min[0], self.pos[2 * columns[0], 1])
+            column_max[0] = max(column_max[0], self.pos[2 * columns[0] + 1, 1])
+        self.pos[2 * columns, 1] = column_min
+        self.pos[2 * columns + 1, 1] = column_max
 
     def _update_camera_range(self, data):
+        if len(data) == 0:
+            return
         y_min, y_max = np.min(data), np.max(data)
         y_range = y_max - y_min
-        x_range = len(data)
-        if y_range > 0:
-            margin = y_range * 0.1
-            self.view.camera.set_range(x=(0, x_range), y=(y_min - margin, y_max + margin))
+        if y_range <= 0:
+            return
+
+        # Only move the camera when the trace leaves the visible band or
+        # shrinks to less than half of it, not on every frame.
+        if self.y_range is not None:
+            low, high = self.y_range
+            if low <= y_min and y_max <= high and y_range > 0.5 * (high - low):
+                return
+
+        margin = y_range * 0.1
+        self.y_range = (y_min - margin, y_max + margin)
+        self.view.camera.set_range(x=(0, self.window_size), y=self.y_range)
@@ -1,28 +1,54 @@
-from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QLabel
+import logging
 
-from config import NUMBER_OF_CHANNELS
-from view.channel_plot_widget import ChannelPlotWidget
-from view.offline_analysis_widget import OfflineAnalysisWidget
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QFontDatabase
+from PyQt5.QtWidgets import (QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QLabel,
+                             QFileDialog)
+
+from config import NUMBER_OF_CHANNELS, LAZY_STARTUP, INGEST_PROCESS
+from service.metrics import format_snapshot
+from service.startup import startup_profile, prefetch
 from viewmodel.main import MainViewModel
 
+SIGNAL_TYPES = ["unfiltered", "filtered", "rms"]
+
 
 class MainView(QMainWindow):
-    def __init__(self):
+    """Main window. The plot widgets and the offline window are built on first use.
+
+    They pull in VisPy, Matplotlib and SciPy, which take longer to import than
+    the rest of the application. With LAZY_STARTUP the window and the ingest
+    path come up first; the live plot is built right after the window is
+    shown, the other widgets when they are opened.
+    """
+
+    def __init__(self, ingest_process=INGEST_PROCESS):
         super().__init__()
         self.setWindowTitle("Signal Visualization")
         self.setGeometry(100, 100, 1000, 600)
 
-        self.viewModel = MainViewModel()  # Link to business logic
+        self.viewModel = MainViewModel(ingest_process=ingest_process)  # Link to business logic
 
-        self.plot_widget = ChannelPlotWidget()  # Plot area
+        self.__plot_widget = None
+        self.__stacked_plot_widget = None
+        self.__spectrogram_widget = None
+        self.__offline_window = None
 
-        self.offline_window = OfflineAnalysisWidget(self.viewModel.get_channel_data)
+        # Dropdown to choose the data source (one per connected device)
+        self.source_selector = QComboBox()
+        self.source_selector.currentTextChanged.connect(self.change_source)
+        self.viewModel.sources_changed.connect(self.update_sources)
 
         # Dropdown to choose channel
         self.channel_selector = QComboBox()
         self.channel_selector.addItems([f"Channel {i}" for i in range(NUMBER_OF_CHANNELS)])
         self.channel_selector.currentIndexChanged.connect(self.change_channel)
 
+        # Single channel or all channels stacked
+        self.layout_selector = QComboBox()
+        self.layout_selector.addItems(["Single Channel", "All Channels"])
+        self.layout_selector.currentIndexChanged.connect(self.change_layout)
+
         # Signal type selector
         self.signal_type_selector = QComboBox()
         self.signal_type_selector.addItems(["Unfiltered", "Filtered", "RMS"])
@@ -36,6 +62,13 @@ class MainView(QMainWindow):
         self.stop_receiving_button.clicked.connect(self.stop_tcp)
         self.stop_receiving_button.setEnabled(False)
 
+        # Replay of a recorded session instead of TCP
+        self.replay_button = QPushButton("Replay File...")
+        self.replay_button.clicked.connect(self.start_replay)
+
+        self.replay_speed_selector = QComboBox()
+        self.replay_speed_selector.addItems(["1x", "2x", "10x", "100x", "Max"])
+
         # STOP/RESUME buttons
         self.stop_button = QPushButton("STOP")
         self.stop_button.clicked.connect(self.stop_visualization)
@@ -54,17 +87,36 @@ class MainView(QMainWindow):
         self.clear_button = QPushButton("Clear Data")
         self.clear_button.clicked.connect(self.clear_data)
 
+        self.spectrogram_button = QPushButton("Show Spectrogram")
+        self.spectrogram_button.setCheckable(True)
+        self.spectrogram_button.toggled.connect(self.toggle_spectrogram)
+
+        # Toggleable panel with per-stage pipeline metrics
+        self.metrics_button = QPushButton("Show Metrics")
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.toggled.connect(self.toggle_metrics)
+
+        self.metrics_label = QLabel()
+        self.metrics_label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.metrics_label.setVisible(False)
+
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics)
+
         # Label to show connection status
         self.status_label = QLabel("Server not active")
         self.viewModel.status_changed.connect(self.update_status)
         self.viewModel.new_data.connect(self.apply_new_data)
-        self.viewModel.new_data.connect(self.check_offline_data_availability)
 
         # Layout for the UI
         layout = QVBoxLayout()
 
         # Control panel layout
         control_layout = QHBoxLayout()
+        control_layout.addWidget(QLabel("Source:"))
+        control_layout.addWidget(self.source_selector)
+        control_layout.addWidget(QLabel("View:"))
+        control_layout.addWidget(self.layout_selector)
         control_layout.addWidget(QLabel("Channel:"))
         control_layout.addWidget(self.channel_selector)
         control_layout.addWidget(QLabel("Signal Type:"))
@@ -74,6 +126,8 @@ class MainView(QMainWindow):
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.receive_button)
         button_layout.addWidget(self.stop_receiving_button)
+        button_layout.addWidget(self.replay_button)
+        button_layout.addWidget(self.replay_speed_selector)
         button_layout.addWidget(self.stop_button)
         button_layout.addWidget(self.resume_button)
 
@@ -81,11 +135,21 @@ class MainView(QMainWindow):
         action_layout = QHBoxLayout()
         action_layout.addWidget(self.offline_button)
         action_layout.addWidget(self.clear_button)
+        action_layout.addWidget(self.spectrogram_button)
+        action_layout.addWidget(self.metrics_button)
+
+        # Slots the plot widgets are added to when they are built
+        self.__plot_slot = QVBoxLayout()
+        self.__stacked_slot = QVBoxLayout()
+        self.__spectrogram_slot = QVBoxLayout()
 
         layout.addLayout(control_layout)
-        layout.addWidget(self.plot_widget)
+        layout.addLayout(self.__plot_slot)
+        layout.addLayout(self.__stacked_slot)
+        layout.addLayout(self.__spectrogram_slot)
         layout.addLayout(button_layout)
         layout.addLayout(action_layout)
+        layout.addWidget(self.metrics_label)
         layout.addWidget(self.status_label)
 
         container = QWidget()
@@ -95,28 +159,146 @@ class MainView(QMainWindow):
         # Check initial offline data availability
         self.check_offline_data_availability()
 
+        self.__started = False
+        if not LAZY_STARTUP:
+            for name in ("plot_widget", "stacked_plot_widget", "spectrogram_widget", "offline_window"):
+                getattr(self, name)  # builds the widget
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.__started:
+            self.__started = True
+            startup_profile.mark("main window shown")
+            QTimer.singleShot(0, self.__finish_startup)
+
+    def __finish_startup(self):
+        # The streaming filter needs SciPy as soon as the first source connects
+        prefetch(["scipy.signal"])
+        self.plot_widget.render_frame()
+        startup_profile.mark("live plot ready")
+        if startup_profile.enabled:
+            logging.info("Startup profile:\n" + startup_profile.report())
+
+    @property
+    def plot_widget(self):
+        if self.__plot_widget is None:
+            with startup_profile.stage("live plot widget"):
+                from view.channel_plot_widget import ChannelPlotWidget
+                self.__plot_widget = ChannelPlotWidget(self.viewModel.get_new_channel_data)
+                self.__plot_widget.channel_index = self.channel_selector.currentIndex()
+                self.__plot_widget.signal_type = SIGNAL_TYPES[self.signal_type_selector.currentIndex()]
+                self.__plot_widget.setVisible(self.layout_selector.currentIndex() == 0)
+                self.__plot_slot.addWidget(self.__plot_widget)
+        return self.__plot_widget
+
+    @property
+    def stacked_plot_widget(self):
+        # All channels stacked in one draw call, shown instead of the single channel
+        if self.__stacked_plot_widget is None:
+            with startup_profile.stage("all-channel plot widget"):
+                from view.stacked_plot_widget import StackedPlotWidget
+                self.__stacked_plot_widget = StackedPlotWidget(self.viewModel.get_new_data)
+                self.__stacked_plot_widget.signal_type = SIGNAL_TYPES[self.signal_type_selector.currentIndex()]
+                self.__stacked_plot_widget.setVisible(self.layout_selector.currentIndex() == 1)
+                self.__stacked_slot.addWidget(self.__stacked_plot_widget)
+        return self.__stacked_plot_widget
+
+    @property
+    def spectrogram_widget(self):
+        # Live spectrogram of the selected channel, hidden until toggled
+        if self.__spectrogram_widget is None:
+            with startup_profile.stage("spectrogram widget"):
+                from view.spectrogram_widget import SpectrogramWidget
+                self.__spectrogram_widget = SpectrogramWidget(self.viewModel.get_new_spectrogram_columns)
+                self.__spectrogram_widget.channel_index = self.channel_selector.currentIndex()
+                self.__spectrogram_widget.setVisible(self.spectrogram_button.isChecked())
+                self.__spectrogram_slot.addWidget(self.__spectrogram_widget)
+        return self.__spectrogram_widget
+
+    @property
+    def offline_window(self):
+        if self.__offline_window is None:
+            with startup_profile.stage("offline analysis window"):
+                from view.offline_analysis_widget import OfflineAnalysisWidget
+                self.__offline_window = OfflineAnalysisWidget(self.viewModel.query,
+                                                              self.viewModel.get_channel_envelope,
+                                                              self.viewModel.open_recording,
+                                                              self.viewModel.get_events,
+                                                              self.viewModel.get_version)
+        return self.__offline_window
+
+
+    def apply_new_data(self, first_sequence, chunk_count):
+        self.live_plot().render_frame()
+        if self.__spectrogram_widget is not None and self.__spectrogram_widget.isVisible():
+            self.__spectrogram_widget.render_frame()
+        self.check_offline_data_availability()
 
-    def apply_new_data(self):
-        data = self.viewModel.get_channel_data(self.channel_selector.currentIndex())
-        self.plot_widget.update_plot(data)
+    def update_sources(self, source_names):
+        current = self.source_selector.currentText()
+        self.source_selector.blockSignals(True)
+        self.source_selector.clear()
+        self.source_selector.addItems(source_names)
+        self.source_selector.setCurrentText(current or source_names[0])
+        self.source_selector.blockSignals(False)
+
+    def change_source(self, source_name):
+        self.viewModel.select_source(source_name)
+        self.plot_widget.set_channel(self.channel_selector.currentIndex())
+        if self.__stacked_plot_widget is not None:
+            self.__stacked_plot_widget.clear_plot_data()
+        if self.__spectrogram_widget is not None:
+            self.__spectrogram_widget.set_channel(self.channel_selector.currentIndex())
+        self.check_offline_data_availability()
 
     def change_channel(self, index):
-        data = self.viewModel.get_channel_data(index)
-        self.plot_widget.update_plot(data)  # Update channel shown
+        self.plot_widget.set_channel(index)  # Update channel shown
+        if self.__spectrogram_widget is not None:
+            self.__spectrogram_widget.set_channel(index)
+
+    def live_plot(self):
+        return self.stacked_plot_widget if self.layout_selector.currentIndex() == 1 else self.plot_widget
+
+    def change_layout(self, index):
+        stacked = index == 1
+        self.plot_widget.setVisible(not stacked)
+        if stacked or self.__stacked_plot_widget is not None:
+            self.stacked_plot_widget.setVisible(stacked)
+        self.channel_selector.setEnabled(not stacked)
+        # The hidden widget stopped following the stream; start it afresh
+        if stacked:
+            self.stacked_plot_widget.clear_plot_data()
+        else:
+            self.plot_widget.set_channel(self.channel_selector.currentIndex())
 
     def change_signal_type(self, index):
-        signal_types = ["unfiltered", "filtered", "rms"]
-        self.plot_widget.set_signal_type(signal_types[index])
+        self.plot_widget.set_signal_type(SIGNAL_TYPES[index])
+        if self.__stacked_plot_widget is not None:
+            self.__stacked_plot_widget.set_signal_type(SIGNAL_TYPES[index])
 
     def start_tcp(self):
         self.viewModel.start_tcp()
         self.receive_button.setEnabled(False)
+        self.replay_button.setEnabled(False)
+        self.stop_receiving_button.setEnabled(True)
+        self.stop_button.setEnabled(True)
+
+    def start_replay(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Replay File", "", "Recordings (*.sigrec);;Raw frames (*)")
+        if not path:
+            return
+        speed_text = self.replay_speed_selector.currentText()
+        speed = 0 if speed_text == "Max" else float(speed_text.rstrip("x"))
+        self.viewModel.start_replay(path, speed)
+        self.receive_button.setEnabled(False)
+        self.replay_button.setEnabled(False)
         self.stop_receiving_button.setEnabled(True)
         self.stop_button.setEnabled(True)
 
     def stop_tcp(self):
         self.viewModel.stop_tcp()
         self.receive_button.setEnabled(True)
+        self.replay_button.setEnabled(True)
         self.stop_receiving_button.setEnabled(False)
         self.stop_button.setEnabled(False)
         self.resume_button.setEnabled(False)
@@ -134,6 +316,25 @@ class MainView(QMainWindow):
     def update_status(self, status):
         self.status_label.setText(status)
 
+    def toggle_spectrogram(self, visible):
+        if visible or self.__spectrogram_widget is not None:
+            self.spectrogram_widget.setVisible(visible)
+        self.spectrogram_button.setText("Hide Spectrogram" if visible else "Show Spectrogram")
+        if visible:
+            self.spectrogram_widget.render_frame()
+
+    def toggle_metrics(self, visible):
+        self.metrics_label.setVisible(visible)
+        self.metrics_button.setText("Hide Metrics" if visible else "Show Metrics")
+        if visible:
+            self.update_metrics()
+            self.metrics_timer.start(1000)
+        else:
+            self.metrics_timer.stop()
+
+    def update_metrics(self):
+        self.metrics_label.setText(format_snapshot(self.viewModel.get_metrics()))
+
     def check_offline_data_availability(self):
         if self.viewModel.has_data():
             self.offline_button.setEnabled(True)
@@ -147,4 +348,14 @@ class MainView(QMainWindow):
     def clear_data(self):
         self.viewModel.clear_data()
         self.plot_widget.clear_plot_data()
+        for widget in (self.__stacked_plot_widget, self.__spectrogram_widget):
+            if widget is not None:
+                widget.clear_plot_data()
         self.offline_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        # Stop the ingest thread and flush recordings before exiting
+        self.viewModel.stop_tcp()
+        if self.__offline_window is not None:
+            self.__offline_window.close()
+        super().closeEvent(event)
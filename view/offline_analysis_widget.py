@@ -1,16 +1,43 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QLabel, QPushButton
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QLabel, QPushButton,
+                             QFileDialog, QProgressBar, QTableWidget, QTableWidgetItem)
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
 from matplotlib.figure import Figure
 import numpy as np
 from scipy import signal
 
-from config import SAMPLING_FREQUENCY, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, FILTER_ORDER, RMS_WINDOW
+from config import (SAMPLING_FREQUENCY, LOW_CUTOFF_FREQUENCY, HIGH_CUTOFF_FREQUENCY, FILTER_ORDER, RMS_WINDOW,
+                    PLOT_MAX_POINTS, ANALYSIS_WORKERS, ALL_CHANNEL_POOL_SAMPLES, ALL_CHANNEL_CHUNK_SAMPLES,
+                    NUMBER_OF_CHANNELS, OFFLINE_DENSE_SAMPLES, OFFLINE_PAGE_SAMPLES)
+from service.analysis import (STATISTICS, StreamingStatistics, signal_statistics, recording_statistics,
+                              paged_statistics)
+from service.cache import DerivedCache, extend_sliding_rms
+from service.dsp import bandpass_sos, sliding_rms
+from service.events import EVENT_DTYPE, EVENT_KINDS
+from service.lod import minmax_decimate
+from service.spectrogram import welch_psd
+
+# Analysed span of the history: label, newest seconds (None for all of it)
+SPANS = [("All", None), ("Last 10 s", 10), ("Last 1 min", 60), ("Last 10 min", 600)]
+ZOOM_DELAY_MS = 150  # wait for panning or zooming to settle before fetching the visible range
+EVENT_LIST_LIMIT = 10_000  # newest events listed in the Events view
+EVENT_CONTEXT_SECONDS = 1.0  # shown on each side of an event jumped to
+PAGE_MARGIN_SECONDS = 5.0  # neighbouring samples filtered with each page of a long span, so pages join up
+
+
+class _Superseded(Exception):
+    pass
 
 
 class OfflineAnalysisWidget(QWidget):
-    def __init__(self, get_data_callback):
+    analysis_progress = pyqtSignal(int, int)  # job, percent
+    analysis_finished = pyqtSignal(int, object)  # job, result of _analyze
+
+    def __init__(self, query_callback, get_envelope_callback, open_recording_callback, get_events_callback=None,
+                 get_version_callback=None):
         super().__init__()
         self.setWindowTitle("Offline Signal Analysis")
         self.setGeometry(200, 200, 1200, 800)
@@ -21,10 +48,27 @@ class OfflineAnalysisWidget(QWidget):
         self.highcut = HIGH_CUTOFF_FREQUENCY  # High cutoff frequency
         self.filter_order = FILTER_ORDER
         self.rms_window = RMS_WINDOW# RMS window size
+
+        # Derived signals keyed on channel, transform, parameters and data version
+        self.cache = DerivedCache()
+
+        # Analysis runs on workers; only the newest job's result is drawn
+        self.__executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+        self.__job = 0
+        self.__future = None
+        self.analysis_progress.connect(self._on_analysis_progress)
+        self.analysis_finished.connect(self._on_analysis_finished)
         
         self.init_ui()
 
-        self.get_data_callback = get_data_callback
+        self.query_callback = query_callback
+        self.get_events_callback = get_events_callback
+        self.get_version_callback = get_version_callback
+        self.get_envelope_callback = get_envelope_callback
+        self.open_recording_callback = open_recording_callback
+        self.recording = None  # memory-mapped session file, None for the live buffer
+        self.__complete_view = None  # what the Complete Signal plot shows, for fetching zoomed ranges
+        self.__jump = None  # position of the event to show once the Complete Signal plot is drawn
 
     def init_ui(self):
         layout = QVBoxLayout()
@@ -49,21 +93,70 @@ class OfflineAnalysisWidget(QWidget):
         # View mode selector
         control_layout.addWidget(QLabel("View Mode:"))
         self.view_mode_selector = QComboBox()
-        self.view_mode_selector.addItems(["Complete Signal", "Signal Statistics"])
+        self.view_mode_selector.addItems(["Complete Signal", "Signal Statistics", "All Channels", "Events"])
         self.view_mode_selector.currentIndexChanged.connect(self.plot)
         control_layout.addWidget(self.view_mode_selector)
+
+        # Span selector; only the selected span is read and analysed
+        control_layout.addWidget(QLabel("Span:"))
+        self.span_selector = QComboBox()
+        self.span_selector.addItems([label for label, _ in SPANS])
+        self.span_selector.currentIndexChanged.connect(self.plot)
+        control_layout.addWidget(self.span_selector)
         
         # Refresh button
         self.refresh_button = QPushButton("Refresh")
         self.refresh_button.clicked.connect(self.plot)
         control_layout.addWidget(self.refresh_button)
+
+        # Recording buttons
+        self.open_recording_button = QPushButton("Open Recording...")
+        self.open_recording_button.clicked.connect(self.open_recording)
+        control_layout.addWidget(self.open_recording_button)
+
+        self.live_buffer_button = QPushButton("Use Live Buffer")
+        self.live_buffer_button.clicked.connect(self.use_live_buffer)
+        self.live_buffer_button.setEnabled(False)
+        control_layout.addWidget(self.live_buffer_button)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(150)
+        self.progress_bar.hide()
+        control_layout.addWidget(self.progress_bar)
         
         layout.addLayout(control_layout)
         
         # Matplotlib figure
         self.figure = Figure(figsize=(12, 8))
         self.canvas = FigureCanvas(self.figure)
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        layout.addWidget(self.toolbar)
         layout.addWidget(self.canvas)
+
+        # Zooming the Complete Signal plot fetches just the visible range at screen resolution
+        self.zoom_timer = QTimer(self)
+        self.zoom_timer.setSingleShot(True)
+        self.zoom_timer.setInterval(ZOOM_DELAY_MS)
+        self.zoom_timer.timeout.connect(self._show_visible_range)
+
+        # Per-channel summary for the "All Channels" view; click a header to sort
+        self.table = QTableWidget(0, len(STATISTICS) + 1)
+        self.table.setHorizontalHeaderLabels(["Channel"] + list(STATISTICS))
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSortIndicator(0, Qt.AscendingOrder)
+        self.table.hide()
+        layout.addWidget(self.table)
+
+        # Events found while ingesting; double-click one to show it in the Complete Signal view
+        self.events_table = QTableWidget(0, 4)
+        self.events_table.setHorizontalHeaderLabels(["Sample", "Time (s)", "Channel", "Type"])
+        self.events_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.events_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.events_table.verticalHeader().hide()
+        self.events_table.cellDoubleClicked.connect(self._jump_to_event)
+        self.events_table.hide()
+        layout.addWidget(self.events_table)
         
         # Statistics label
         self.stats_label = QLabel("Statistics will appear here")
@@ -71,37 +164,381 @@ class OfflineAnalysisWidget(QWidget):
         
         self.setLayout(layout)
 
+    def open_recording(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Recording", "", "Recordings (*.sigrec)")
+        if not path:
+            return
+        try:
+            self.recording = self.open_recording_callback(path)
+        except Exception as e:
+            logging.error(f"Could not open recording {path}: {e}")
+            self.stats_label.setText(f"Could not open recording: {e}")
+            return
+        self.setWindowTitle(f"Offline Signal Analysis - {path}")
+        self.live_buffer_button.setEnabled(True)
+        self.plot()
+
+    def use_live_buffer(self):
+        self.recording = None
+        self.setWindowTitle("Offline Signal Analysis")
+        self.live_buffer_button.setEnabled(False)
+        self.plot()
+
+    def _query(self, channels, recording=None, **bounds):
+        """Return (data, version) of a span of the live buffer or the recording; see DataBuffer.query."""
+        if recording is not None:
+            return recording.query(channels, **bounds)
+        return self.query_callback(channels, **bounds)
+
+    def _get_channel_envelope(self, channel_index, recording=None):
+        if recording is not None:
+            return recording.get_channel_envelope(channel_index, 0, None, PLOT_MAX_POINTS)
+        return self.get_envelope_callback(channel_index, 0, None, PLOT_MAX_POINTS)
+
     def plot(self):
-        channel_index = self.channel_selector.currentIndex()
-        signal_type = self.signal_type_selector.currentIndex()
-        view_mode = self.view_mode_selector.currentIndex()
-        
-        raw_data = self.get_data_callback(channel_index)
+        """Start analysing the current selection on a worker; the figure updates when it finishes.
+
+        A newer call supersedes any job still queued or running.
+        """
+        self.__job += 1
+        if self.__future is not None:
+            self.__future.cancel()
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.__future = self.__executor.submit(self._run_analysis, self.__job, self.channel_selector.currentIndex(),
+                                               self.signal_type_selector.currentIndex(),
+                                               self.view_mode_selector.currentIndex(), self.recording,
+                                               SPANS[self.span_selector.currentIndex()][1])
+
+    def wait_for_analysis(self):
+        """Block until the latest job has finished and its result is drawn."""
+        if self.__future is not None:
+            try:
+                self.__future.result()
+            except CancelledError:
+                pass
+        QApplication.processEvents()
+
+    def closeEvent(self, event):
+        self.__job += 1  # lets a running job stop at its next step
+        super().closeEvent(event)
+
+    def _run_analysis(self, job, channel_index, signal_type, view_mode, recording, span):
+        try:
+            result = self._analyze(job, channel_index, signal_type, view_mode, recording, span)
+        except _Superseded:
+            return
+        except Exception as e:
+            logging.exception("Offline analysis failed")
+            result = {"channel_index": channel_index, "signal_type": signal_type, "error": str(e)}
+        self.analysis_finished.emit(job, result)
+
+    def _check(self, job, percent):
+        if job != self.__job:
+            raise _Superseded()
+        self.analysis_progress.emit(job, percent)
+
+    def _analyze(self, job, channel_index, signal_type, view_mode, recording, span):
+        """Compute everything plot needs for one selection; runs on a worker thread.
+
+        `span` limits the analysis to the newest seconds of the history.
+        """
+        last = None if span is None else int(span * self.fs)
+        if view_mode == 2:
+            return self._analyze_all_channels(job, signal_type, recording, last)
+        if view_mode == 3:
+            return self._list_events(signal_type, recording, last)
+
+        version, first, stop = self._span(recording, last)
+        if stop - first > OFFLINE_DENSE_SAMPLES:
+            return self._analyze_paged(job, channel_index, signal_type, view_mode, recording, version, first, stop,
+                                       last)
+
+        raw_data, version = self._query(channel_index, recording, last=last)
+        self._check(job, 10)
 
         # Process signal based on selected type
-        channel_data = self._process_signal(raw_data, signal_type)
+        channel_data = self._process_signal(raw_data, signal_type, channel_index, version, last)
+        self._check(job, 40)
+        result = {"channel_index": channel_index, "signal_type": signal_type, "view_mode": view_mode,
+                  "samples": len(channel_data), "first": version[-2], "recording": recording}
+        if len(channel_data) == 0:
+            return result
+
+        signal_key = (channel_index, signal_type, self.filter_order, self.lowcut, self.highcut, self.fs,
+                      self.rms_window, last)
+
+        def cached(name, compute):
+            return self.cache.get(signal_key + (name,), version, compute)
+
+        if view_mode == 0:  # Complete Signal
+            # Plot a min/max envelope at roughly screen resolution
+            if signal_type == 0 and last is None:
+                result["complete"] = self._get_channel_envelope(channel_index, recording)
+            else:
+                result["complete"] = cached("decimated", lambda: minmax_decimate(channel_data, PLOT_MAX_POINTS))
+            if signal_type != 0:
+                result["signal"] = channel_data  # zoomed ranges are sliced from it instead of refiltered
+        else:  # Signal Statistics
+            result["histogram"] = cached("histogram", lambda: np.histogram(channel_data, bins=50))
+            self._check(job, 50)
+
+            window_size = max(1, len(channel_data) // 100)
+            running_avg = cached("running_average", lambda: np.convolve(channel_data, np.ones(window_size)/window_size,
+                                                                        mode='valid'))
+            result["running_average"] = cached("running_average_plot",
+                                               lambda: minmax_decimate(running_avg, PLOT_MAX_POINTS))
+            result["running_average_window"] = window_size
+            self._check(job, 60)
+
+            result["psd"] = cached("psd", lambda: welch_psd(channel_data, self.fs))
+            self._check(job, 75)
+
+            envelope = cached("hilbert_envelope", lambda: np.abs(signal.hilbert(channel_data)))
+            result["decimated"] = cached("decimated", lambda: minmax_decimate(channel_data, PLOT_MAX_POINTS))
+            result["envelope"] = cached("envelope_plot", lambda: minmax_decimate(envelope, PLOT_MAX_POINTS))
+            self._check(job, 90)
+
+        result["statistics"] = cached("statistics", lambda: (
+            np.mean(channel_data), np.std(channel_data), np.min(channel_data), np.max(channel_data),
+            np.sqrt(np.mean(channel_data**2))))
+        self._check(job, 95)
+        return result
+
+    def _analyze_all_channels(self, job, signal_type, recording, last):
+        parameters = (self.filter_order, self.lowcut, self.highcut, self.fs, self.rms_window)
+        result = {"channel_index": None, "signal_type": signal_type, "view_mode": 2}
+        if (recording is not None and last is None
+                and len(recording) * recording.number_of_channels > ALL_CHANNEL_POOL_SAMPLES):
+            # Too long for one matrix: split the channels over processes that
+            # each stream the memory-mapped file in chunks
+            version = (recording.path, 0, len(recording))
+            result["table"] = self.cache.get(("all_channels", signal_type) + parameters, version, lambda: (
+                recording_statistics(recording.path, recording.number_of_channels, signal_type, parameters,
+                                     on_progress=lambda done, total: self._check(job, 10 + 85 * done // total))))
+            result["samples"] = len(recording)
+            return result
+
+        # Live history (decompressed cold blocks included) or a recording span too
+        # long for one matrix is analysed a page at a time
+        number_of_channels = NUMBER_OF_CHANNELS if recording is None else recording.number_of_channels
+        version, first, total = self._span(recording, last)
+        if (total - first) * number_of_channels > ALL_CHANNEL_POOL_SAMPLES:
+            result["table"] = self.cache.get(("all_channels", signal_type, last) + parameters, version, lambda: (
+                paged_statistics(self._pages(job, recording, first, total), number_of_channels, signal_type,
+                                 parameters)))
+            result["samples"] = total - first
+            return result
+
+        data, version = self._query(None, recording, last=last)
+        self._check(job, 20)
+        result["table"] = self.cache.get(("all_channels", signal_type, last) + parameters, version,
+                                         lambda: signal_statistics(data, signal_type, *parameters))
+        result["samples"] = data.shape[1]
+        return result
+
+    def _span(self, recording, last):
+        """Return (version, first, stop) of the span to analyse, without reading it."""
+        if recording is not None:
+            version = recording.get_version()
+        elif self.get_version_callback is not None:
+            version = self.get_version_callback()
+        else:
+            version = (None, 0, 0)
+        oldest, total = version[-2:]
+        first = oldest if last is None else max(oldest, total - last)
+        return version[:-2] + (first, total), first, total
+
+    def _analyze_paged(self, job, channel_index, signal_type, view_mode, recording, version, first, stop, last):
+        # The span is too long to hold: everything is computed from processed
+        # pages in one pass, plus a second one for the histogram, whose bins
+        # need the range. Filters and the Hilbert envelope see margins of
+        # neighbouring samples, so the pages join up.
+        count = stop - first
+        result = {"channel_index": channel_index, "signal_type": signal_type, "view_mode": view_mode,
+                  "samples": count, "first": first, "recording": recording}
+        key = (channel_index, signal_type, self.filter_order, self.lowcut, self.highcut, self.fs, self.rms_window,
+               last, view_mode, "paged")
+
+        def compute():
+            statistics = StreamingStatistics(1, self.fs, (self.lowcut, self.highcut))
+            window = max(1, count // 100)
+            block = max(1, window // 16)  # the running average is evaluated every `block` samples
+            window = max(1, window // block) * block
+            decimated, envelope, sums, carry = [], [], [], np.zeros(0)
+            for offset, page, lead, length in self._channel_pages(job, channel_index, recording, signal_type,
+                                                                  first, stop, 10, 70):
+                samples = page[lead:lead + length]
+                statistics.process(samples[None])
+                points = max(1, PLOT_MAX_POINTS * length // count)
+                x, y = minmax_decimate(samples, points)
+                decimated.append((x + offset, y))
+                if view_mode == 1:
+                    x, y = minmax_decimate(np.abs(signal.hilbert(page))[lead:lead + length], points)
+                    envelope.append((x + offset, y))
+                    carry = np.concatenate((carry, samples))
+                    blocks = len(carry) // block
+                    sums.append(carry[:blocks * block].reshape(blocks, block).sum(axis=1))
+                    carry = carry[blocks * block:]
+            joined = tuple(np.concatenate(part) for part in zip(*decimated))
+            mean, std, minimum, maximum, rms = statistics.result()[0, :5]
+            if view_mode != 1:
+                return joined, (mean, std, minimum, maximum, rms)
+
+            counts, edges = np.zeros(50, dtype=np.int64), np.histogram_bin_edges([], 50, (minimum, maximum))
+            for _, page, lead, length in self._channel_pages(job, channel_index, recording, signal_type,
+                                                             first, stop, 70, 95):
+                counts += np.histogram(page[lead:lead + length], edges)[0]
+            cumulative = np.concatenate(([0.0], np.cumsum(np.concatenate(sums))))
+            steps = window // block
+            average = (cumulative[steps:] - cumulative[:-steps]) / window
+            freqs, psd = statistics.psd()
+            return (joined, (mean, std, minimum, maximum, rms), (counts, edges),
+                    (np.arange(len(average)) * block, average), window, (freqs, psd[0]),
+                    tuple(np.concatenate(part) for part in zip(*envelope)))
+
+        computed = self.cache.get(key, version, compute)
+        result["statistics"] = computed[1]
+        if view_mode == 0:
+            result["complete"] = computed[0]
+        else:
+            result["decimated"] = computed[0]
+            (result["histogram"], result["running_average"], result["running_average_window"], result["psd"],
+             result["envelope"]) = computed[2:]
+        return result
+
+    def _channel_pages(self, job, channel_index, recording, signal_type, first, stop, progress, progress_end):
+        """Yield (offset, page, lead, length) for processed pages of one channel's samples [first, stop).
+
+        page[lead:lead + length] are the processed samples from `offset` on,
+        counted from `first`; the rest of page is the margin around them.
+        """
+        margin = max(self.rms_window, int(PAGE_MARGIN_SECONDS * self.fs))
+        position = first
+        while position < stop:
+            data, version = self._query(channel_index, recording, start=max(first, position - margin),
+                                        stop=min(stop, position + OFFLINE_PAGE_SAMPLES + margin))
+            start, end = version[-2:]
+            position = max(position, start)  # later when the start has left the live history
+            length = min(stop, position + OFFLINE_PAGE_SAMPLES, end) - position
+            if length <= 0:
+                return
+            yield position - first, self._process_range(data, signal_type), position - start, length
+            position += length
+            self._check(job, progress + (progress_end - progress) * (position - first) // (stop - first))
+
+    def _process_range(self, data, signal_type):
+        if signal_type == 1:
+            return self._apply_bandpass_filter(data)
+        if signal_type == 2:
+            return self._calculate_rms(data)
+        return np.asarray(data)
+
+    def _pages(self, job, recording, first, stop, page_samples=ALL_CHANNEL_CHUNK_SAMPLES):
+        # Consecutive all-channel pages of [first, stop); samples evicted meanwhile are skipped
+        position = first
+        while position < stop:
+            data, version = self._query(None, recording, start=position, stop=min(stop, position + page_samples))
+            if data.shape[1] == 0:
+                return
+            position = version[-1]
+            self._check(job, 10 + 85 * (position - first) // (stop - first))
+            yield data
+
+    def _list_events(self, signal_type, recording, last):
+        # Events come from the index built while ingesting; no samples are read
+        result = {"channel_index": None, "signal_type": signal_type, "view_mode": 3}
+        if recording is not None:
+            _, oldest, total = recording.get_version()
+            get_events = recording.get_events
+        elif self.get_events_callback is not None:
+            _, _, oldest, total = self.get_version_callback()
+            get_events = self.get_events_callback
+        else:
+            result["events"] = np.zeros(0, dtype=EVENT_DTYPE)
+            result["samples"] = 0
+            return result
+        start = oldest if last is None else max(oldest, total - last)
+        result["events"] = get_events(start=start, stop=total, last=EVENT_LIST_LIMIT)
+        result["samples"] = total - start
+        return result
+
+    def _jump_to_event(self, row, column):
+        position = int(self.events_table.item(row, 0).data(Qt.DisplayRole))
+        channel = int(self.events_table.item(row, 2).data(Qt.DisplayRole))
+        self.__jump = position
+        for selector, index in ((self.channel_selector, channel), (self.view_mode_selector, 0),
+                                (self.span_selector, 0)):
+            selector.blockSignals(True)
+            selector.setCurrentIndex(index)
+            selector.blockSignals(False)
+        self.plot()
+
+    def _on_analysis_progress(self, job, percent):
+        if job == self.__job:
+            self.progress_bar.setValue(percent)
+
+    def _on_analysis_finished(self, job, result):
+        if job != self.__job:
+            return  # superseded while the result was in the event queue
+        self.progress_bar.hide()
+        self._draw(result)
+
+    def _draw(self, result):
+        channel_index = result["channel_index"]
         
         # Get signal type name for display
         signal_type_names = ["Unfiltered", "Filtered", "RMS"]
-        signal_type_name = signal_type_names[signal_type]
+        signal_type_name = signal_type_names[result["signal_type"]]
+
+        if "error" in result:
+            self.stats_label.setText(f"Analysis failed: {result['error']}")
+            return
+
+        show_table = result["view_mode"] == 2 and result["samples"] > 0
+        show_events = result["view_mode"] == 3
+        self.table.setVisible(show_table)
+        self.events_table.setVisible(show_events)
+        self.canvas.setVisible(not show_table and not show_events)
+        self.toolbar.setVisible(not show_table and not show_events)
+        if show_events:
+            self._fill_events_table(result["events"])
+            counts = np.bincount(result["events"]["kind"], minlength=len(EVENT_KINDS))
+            self.stats_label.setText(f"{len(result['events'])} events in {result['samples']} samples: " +
+                                     ", ".join(f"{kind} {count}" for kind, count in zip(EVENT_KINDS, counts)))
+            return
+        if show_table:
+            self._fill_table(result["table"])
+            self.stats_label.setText(f"All channels ({signal_type_name}): {result['samples']} samples each")
+            return
         
-        if len(channel_data) == 0:
+        if result["samples"] == 0:
             self.figure.clear()
             ax = self.figure.add_subplot(111)
             ax.text(0.5, 0.5, 'No data available', 
                    horizontalalignment='center', verticalalignment='center',
                    transform=ax.transAxes, fontsize=16)
-            ax.set_title(f'Channel {channel_index} ({signal_type_name}) - No Data')
+            ax.set_title(f'{"All Channels" if channel_index is None else f"Channel {channel_index}"} '
+                         f'({signal_type_name}) - No Data')
             self.canvas.draw()
             self.stats_label.setText("No data available for statistics")
             return
         
         self.figure.clear()
+        self.__complete_view = None
         
-        if view_mode == 0:  # Complete Signal
+        if result["view_mode"] == 0:  # Complete Signal
             ax = self.figure.add_subplot(111)
-            time_axis = np.arange(len(channel_data))
-            ax.plot(time_axis, channel_data, 'b-', linewidth=0.5)
+            time_axis, plot_data = result["complete"]
+            line, = ax.plot(time_axis, plot_data, 'b-', linewidth=0.5)
+            self.__complete_view = (ax, line, result, time_axis, plot_data)
+            ax.callbacks.connect('xlim_changed', lambda _: self.zoom_timer.start())
+            if self.__jump is not None:
+                event = self.__jump - result["first"]
+                context = EVENT_CONTEXT_SECONDS * self.fs
+                ax.axvline(event, color='r', linewidth=1)
+                ax.set_xlim(event - context, event + context)
+                self.__jump = None
             ax.set_title(f'Channel {channel_index} ({signal_type_name}) - Complete Signal')
             ax.set_xlabel('Sample Number')
             ax.set_ylabel('Amplitude')
@@ -115,35 +552,30 @@ class OfflineAnalysisWidget(QWidget):
             ax4 = self.figure.add_subplot(2, 2, 4)
             
             # Histogram
-            ax1.hist(channel_data, bins=50, alpha=0.7, color='blue', edgecolor='black')
+            counts, edges = result["histogram"]
+            ax1.hist(edges[:-1], edges, weights=counts, alpha=0.7, color='blue', edgecolor='black')
             ax1.set_title(f'{signal_type_name} Signal Histogram')
             ax1.set_xlabel('Amplitude')
             ax1.set_ylabel('Frequency')
             ax1.grid(True, alpha=0.3)
             
             # Running average
-            window_size = max(1, len(channel_data) // 100)
-            running_avg = np.convolve(channel_data, np.ones(window_size)/window_size, mode='valid')
-            ax2.plot(running_avg, 'r-', linewidth=1)
-            ax2.set_title(f'{signal_type_name} Running Average (window={window_size})')
+            ax2.plot(*result["running_average"], 'r-', linewidth=1)
+            ax2.set_title(f'{signal_type_name} Running Average (window={result["running_average_window"]})')
             ax2.set_xlabel('Sample Number')
             ax2.set_ylabel('Amplitude')
             ax2.grid(True, alpha=0.3)
             
             # Frequency domain
-            fft_data = np.fft.fft(channel_data)
-            freqs = np.fft.fftfreq(len(channel_data))
-            ax3.plot(freqs[:len(freqs)//2], np.abs(fft_data[:len(fft_data)//2]), 'g-', linewidth=1)
-            ax3.set_title(f'{signal_type_name} Frequency Domain')
-            ax3.set_xlabel('Frequency (normalized)')
-            ax3.set_ylabel('Magnitude')
+            ax3.semilogy(*result["psd"], 'g-', linewidth=1)
+            ax3.set_title(f'{signal_type_name} Power Spectral Density (Welch)')
+            ax3.set_xlabel('Frequency (Hz)')
+            ax3.set_ylabel('PSD (units²/Hz)')
             ax3.grid(True, alpha=0.3)
             
             # Signal envelope
-            envelope = np.abs(signal.hilbert(channel_data))
-            time_axis = np.arange(len(channel_data))
-            ax4.plot(time_axis, channel_data, 'b-', alpha=0.5, linewidth=0.5, label='Signal')
-            ax4.plot(time_axis, envelope, 'r-', linewidth=1, label='Envelope')
+            ax4.plot(*result["decimated"], 'b-', alpha=0.5, linewidth=0.5, label='Signal')
+            ax4.plot(*result["envelope"], 'r-', linewidth=1, label='Envelope')
             ax4.set_title(f'{signal_type_name} Signal Envelope')
             ax4.set_xlabel('Sample Number')
             ax4.set_ylabel('Amplitude')
@@ -155,56 +587,99 @@ class OfflineAnalysisWidget(QWidget):
         self.canvas.draw()
         
         # Update statistics
-        if len(channel_data) > 0:
-            mean_val = np.mean(channel_data)
-            std_val = np.std(channel_data)
-            min_val = np.min(channel_data)
-            max_val = np.max(channel_data)
-            rms_val = np.sqrt(np.mean(channel_data**2))
-            
-            stats_text = f"""
+        mean_val, std_val, min_val, max_val, rms_val = result["statistics"]
+        stats_text = f"""
         Channel {channel_index} ({signal_type_name}) Statistics:
         Mean: {mean_val:.4f}
         Std Dev: {std_val:.4f}
         Min: {min_val:.4f}
         Max: {max_val:.4f}
         RMS: {rms_val:.4f}
-        Samples: {len(channel_data)}
+        Samples: {result["samples"]}
         """
-            self.stats_label.setText(stats_text)
-        else:
-            self.stats_label.setText("No data available for statistics")
+        self.stats_label.setText(stats_text)
+
+    def _show_visible_range(self):
+        """Replace the Complete Signal line by the samples in the visible x range.
+
+        Filtered and RMS ranges are sliced from the analysed signal; raw
+        ranges are queried by absolute position, so zooming into a long
+        recording reads only the pages on screen.
+        """
+        if self.__complete_view is None:
+            return
+        ax, line, result, time_axis, plot_data = self.__complete_view
+        low, high = ax.get_xlim()
+        low, high = max(0, int(low)), min(result["samples"], int(np.ceil(high)) + 1)
+        if low == 0 and high == result["samples"]:
+            line.set_data(time_axis, plot_data)  # zoomed out again
+        elif high > low:
+            if "signal" in result:
+                data, offset = result["signal"][low:high], low
+            elif result["signal_type"] == 0:
+                first = result["first"]
+                data, version = self._query(result["channel_index"], result["recording"],
+                                            start=first + low, stop=first + high)
+                offset = version[-2] - first  # later when the start has left the live history
+            else:
+                # A paged analysis keeps no processed signal; process the visible range with margins
+                first = result["first"]
+                margin = max(self.rms_window, int(PAGE_MARGIN_SECONDS * self.fs))
+                data, version = self._query(result["channel_index"], result["recording"],
+                                            start=max(first, first + low - margin), stop=first + high + margin)
+                lead = max(0, first + low - version[-2])
+                data = self._process_range(data, result["signal_type"])[lead:lead + high - low]
+                offset = version[-2] + lead - first
+            x, y = minmax_decimate(data, PLOT_MAX_POINTS)
+            line.set_data(x + offset, y)
+        self.canvas.draw_idle()
+
+    def _fill_table(self, table):
+        self.table.setSortingEnabled(False)  # keep rows in place while filling
+        self.table.setRowCount(len(table))
+        for channel, values in enumerate(table):
+            for column, value in enumerate((channel, *values)):
+                item = QTableWidgetItem()
+                # Numeric data so the columns sort by value, not as text
+                item.setData(Qt.DisplayRole, int(value) if column == 0 else round(float(value), 4))
+                self.table.setItem(channel, column, item)
+        self.table.setSortingEnabled(True)
+
+    def _fill_events_table(self, events):
+        self.events_table.setSortingEnabled(False)
+        self.events_table.setRowCount(len(events))
+        for row, (position, channel, kind) in enumerate(events.tolist()):
+            for column, value in enumerate((position, round(position / self.fs, 3), channel, EVENT_KINDS[kind])):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                self.events_table.setItem(row, column, item)
+        self.events_table.setSortingEnabled(True)
 
     def _apply_bandpass_filter(self, data):
         if len(data) < 2 * self.filter_order:
             return data  # Not enough data for filtering
 
         try:
-            nyquist = 0.5 * self.fs
-            low = self.lowcut / nyquist
-            high = self.highcut / nyquist
-            b, a = signal.butter(self.filter_order, [low, high], btype='band')
-            return signal.filtfilt(b, a, data)
+            sos = bandpass_sos(self.filter_order, self.lowcut, self.highcut, self.fs)
+            return signal.sosfiltfilt(sos, data)
         except Exception as e:
             logging.error(e)
             return data
 
     def _calculate_rms(self, data):
-        if len(data) < self.rms_window:
-            return np.sqrt(np.mean(data ** 2)) * np.ones_like(data)
-
-        rms_values = np.zeros_like(data)
-        for i in range(len(data)):
-            start_idx = max(0, i - self.rms_window // 2)
-            end_idx = min(len(data), i + self.rms_window // 2 + 1)
-            rms_values[i] = np.sqrt(np.mean(data[start_idx:end_idx] ** 2))
-        return rms_values
+        return sliding_rms(data, self.rms_window)
 
-    def _process_signal(self, data, signal_type):
+    def _process_signal(self, data, signal_type, channel_index, version, last=None):
         if signal_type == 0:  # Unfiltered
             return data
         elif signal_type == 1:  # Filtered
-            return self._apply_bandpass_filter(data)
+            # Zero-phase filtering runs backwards from the newest sample, so it
+            # cannot be extended and is recomputed whenever the data changes
+            key = (channel_index, "filtered", self.filter_order, self.lowcut, self.highcut, self.fs, last)
+            return self.cache.get(key, version, lambda: self._apply_bandpass_filter(data))
         elif signal_type == 2:  # RMS
-            return self._calculate_rms(data)
+            return self.cache.get((channel_index, "rms", self.rms_window, last), version,
+                                  lambda: self._calculate_rms(data),
+                                  lambda previous, dropped: extend_sliding_rms(previous, data, dropped,
+                                                                               self.rms_window))
         return data
\ No newline at end of file
@@ -0,0 +1,64 @@
+import time
+
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+from vispy import scene
+from vispy.visuals.transforms import STTransform
+import numpy as np
+
+from config import SAMPLING_FREQUENCY, SPECTROGRAM_WINDOW, SPECTROGRAM_HOP, SPECTROGRAM_COLUMNS
+from service.metrics import metrics
+
+
+class SpectrogramWidget(QWidget):
+    """Rolling time-frequency image of one channel, fed with new spectra only.
+
+    Like the live trace it sweeps: new columns overwrite the oldest ones at
+    the write index. The y axis is in Hz, the x axis in seconds of the sweep.
+    """
+
+    def __init__(self, get_new_columns_callback, columns=SPECTROGRAM_COLUMNS, fs=SAMPLING_FREQUENCY,
+                 window=SPECTROGRAM_WINDOW, hop=SPECTROGRAM_HOP):
+        super().__init__()
+        self.canvas = scene.SceneCanvas(keys='interactive', show=True)
+        self.view = self.canvas.central_widget.add_view()
+
+        bins = window // 2 + 1
+        self.columns = columns
+        self.image_data = np.full((bins, columns), np.nan, dtype=np.float32)
+        self.image = scene.visuals.Image(self.image_data, parent=self.view.scene, cmap='viridis',
+                                         clim=(-60, 20), interpolation='nearest')
+        self.image.transform = STTransform(scale=(hop / fs, fs / window))
+
+        self.view.camera = 'panzoom'
+        self.view.camera.set_range(x=(0, columns * hop / fs), y=(0, fs / 2), margin=0)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.canvas.native)
+        self.setLayout(layout)
+
+        self.get_new_columns_callback = get_new_columns_callback
+        self.channel_index = 0
+        self.position = 0
+        self.write_index = 0
+
+    def set_channel(self, channel_index):
+        self.channel_index = channel_index
+        self.clear_plot_data()
+
+    def clear_plot_data(self):
+        self.position = 0
+        self.write_index = 0
+        self.image_data[:] = np.nan
+        self.render_frame()
+
+    def render_frame(self):
+        spectra, self.position = self.get_new_columns_callback(self.channel_index, self.position, self.columns)
+        if len(spectra) == 0:
+            return
+        started = time.perf_counter()
+        columns = (self.write_index + np.arange(len(spectra))) % self.columns
+        self.image_data[:, columns] = spectra.T
+        self.write_index = (self.write_index + len(spectra)) % self.columns
+        self.image.set_data(self.image_data)
+        self.image.update()
+        metrics.record("spectrogram_set_data", time.perf_counter() - started)
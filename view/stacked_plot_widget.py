@@ -0,0 +1,220 @@
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+from vispy import gloo, scene
+from vispy.color import Color
+from vispy.visuals import Visual
+import numpy as np
+
+from config import (NUMBER_OF_CHANNELS, LIVE_WINDOW_SAMPLES, STACKED_MAX_COLUMNS, LIVE_DROP_POLICY,
+                    LIVE_MAX_BACKLOG, LIVE_FPS)
+from service.metrics import metrics
+
+VERTEX_SHADER = """
+attribute float a_x;
+attribute float a_y;
+attribute float a_channel;
+uniform vec2 u_lanes[%d];  // (center, gain) of each channel
+
+void main() {
+    vec2 lane = u_lanes[int(a_channel)];
+    float y = %.1f - a_channel + (a_y - lane.x) * lane.y;
+    gl_Position = $transform(vec4(a_x, y, 0.0, 1.0));
+}
+"""
+
+FRAGMENT_SHADER = """
+uniform vec4 u_color;
+
+void main() {
+    gl_FragColor = u_color;
+}
+"""
+
+
+class StackedLinesVisual(Visual):
+    """Many line traces in one vertex buffer and one draw call.
+
+    Vertex i of channel c is stored at i * channels + c, so a run of columns
+    of every channel is one contiguous range of the y buffer. x and the
+    channel number are uploaded once; each channel's offset and gain are
+    uniforms applied in the vertex shader.
+    """
+
+    def __init__(self, x, channels, color='blue'):
+        Visual.__init__(self, vcode=VERTEX_SHADER % (channels, channels - 1), fcode=FRAGMENT_SHADER)
+        vertices = len(x)
+        self.__y = gloo.VertexBuffer(np.zeros(vertices * channels, dtype=np.float32))
+        self.shared_program['a_x'] = gloo.VertexBuffer(np.repeat(x, channels).astype(np.float32))
+        self.shared_program['a_channel'] = gloo.VertexBuffer(
+            np.tile(np.arange(channels, dtype=np.float32), vertices))
+        self.shared_program['a_y'] = self.__y
+        self.shared_program['u_color'] = Color(color).rgba
+        self.set_lanes(np.tile([0.0, 1.0], (channels, 1)))
+
+        # Segments between consecutive vertices of the same channel
+        first = np.arange(vertices - 1)[:, None] * channels + np.arange(channels)
+        segments = np.stack((first, first + channels), axis=-1).astype(np.uint32)
+        self._index_buffer = gloo.IndexBuffer(segments.ravel())
+        self._draw_mode = 'lines'
+        self.set_gl_state('translucent', depth_test=False)
+
+    def set_y(self, y, first_vertex=0):
+        """Upload vertices x channels values starting at vertex `first_vertex`."""
+        self.__y.set_subdata(np.ascontiguousarray(y, dtype=np.float32).ravel(),
+                             offset=first_vertex * y.shape[1], copy=True)
+        self.update()
+
+    def set_lanes(self, lanes):
+        self.shared_program['u_lanes'] = np.asarray(lanes, dtype=np.float32)
+        self.update()
+
+    def _prepare_transforms(self, view):
+        view.view_program.vert['transform'] = view.get_transform()
+
+
+StackedLines = scene.visuals.create_visual_node(StackedLinesVisual)
+
+
+class StackedPlotWidget(QWidget):
+    """Live sweep of every channel, stacked in lanes (channel 0 at the top).
+
+    Works like ChannelPlotWidget, but folds the new samples of all channels
+    into min/max columns at once and uploads only the touched columns.
+    """
+
+    def __init__(self, get_new_data_callback, window_size=LIVE_WINDOW_SAMPLES, max_columns=STACKED_MAX_COLUMNS,
+                 channels=NUMBER_OF_CHANNELS, drop_policy=LIVE_DROP_POLICY, max_backlog=LIVE_MAX_BACKLOG):
+        super().__init__()
+        self.canvas = scene.SceneCanvas(keys='interactive', show=True)
+        self.view = self.canvas.central_widget.add_view()
+
+        self.window_size = window_size
+        self.channels = channels
+        self.column_size = -(-window_size // max_columns)
+        self.columns = -(-window_size // self.column_size)
+        self.y = np.zeros((2 * self.columns, channels), dtype=np.float32)  # min/max rows per column
+        self.lines = StackedLines(np.repeat(np.arange(self.columns) * self.column_size, 2), channels,
+                                  parent=self.view.scene)
+        self.write_index = 0
+        self.filled = 0
+        self.touched = None  # (first, last) column written since the last upload
+
+        # Per-channel (center, gain) and the band it was fitted to
+        self.lanes = np.tile([0.0, 1.0], (channels, 1)).astype(np.float32)
+        self.bands = None
+
+        self.view.camera = 'panzoom'
+        self.view.camera.set_range(x=(0, window_size), y=(-0.5, channels - 0.5))
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.canvas.native)
+        self.setLayout(layout)
+
+        self.get_new_data_callback = get_new_data_callback
+        self.position = 0
+        self.signal_type = "unfiltered"
+        self.drop_policy = drop_policy
+        self.max_backlog = max_backlog
+        # A paced frame draws at most a window; the rest is drawn on the next
+        # frame even if no new data arrives to trigger one
+        self.backlog_timer = QTimer(self)
+        self.backlog_timer.setSingleShot(True)
+        self.backlog_timer.setInterval(int(1000 / LIVE_FPS))
+        self.backlog_timer.timeout.connect(self.render_frame)
+
+    def clear_plot_data(self):
+        self.position = 0
+        self._reset_trace()
+        self.render_frame()
+
+    def set_signal_type(self, signal_type):
+        self.signal_type = signal_type
+        self.clear_plot_data()
+
+    def render_frame(self):
+        max_backlog = self.window_size if self.drop_policy == "latest" else max(self.max_backlog, self.window_size)
+        previous = self.position
+        data, self.position = self.get_new_data_callback(self.position, self.window_size, self.signal_type,
+                                                         max_backlog)
+        if self.position - previous > data.shape[1] and previous > 0:
+            metrics.count("live_samples_skipped", self.position - previous - data.shape[1])
+        if data.shape[1]:
+            self._write_samples(data)
+        if self.drop_policy == "paced" and data.shape[1] == self.window_size:
+            self.backlog_timer.start()  # the read was capped, so more may be pending
+        if self.touched is None:
+            return
+
+        started = time.perf_counter()
+        first, last = self.touched
+        self.touched = None
+        if first <= last:
+            self.lines.set_y(self.y[2 * first:2 * last + 2], 2 * first)
+        else:  # the write wrapped around the end of the sweep
+            self.lines.set_y(self.y[2 * first:], 2 * first)
+            self.lines.set_y(self.y[:2 * last + 2], 0)
+        self._update_lanes()
+        metrics.record("stacked_set_data", time.perf_counter() - started)
+
+    def _reset_trace(self):
+        self.y[:] = 0
+        self.write_index = 0
+        self.filled = 0
+        self.bands = None
+        self.touched = (0, self.columns - 1)
+
+    def _write_samples(self, samples):
+        samples = samples[:, -self.window_size:]
+        first = self.write_index // self.column_size
+        written = samples.shape[1]
+        while samples.shape[1]:
+            count = min(samples.shape[1], self.window_size - self.write_index)
+            self._write_run(self.write_index, samples[:, :count])
+            samples = samples[:, count:]
+            self.write_index = (self.write_index + count) % self.window_size
+            self.filled = min(self.filled + count, self.window_size)
+        last = (self.write_index - 1) % self.window_size // self.column_size
+        if self.touched is not None or written + self.column_size >= self.window_size:
+            self.touched = (0, self.columns - 1)
+        else:
+            self.touched = (first, last)
+
+    def _write_run(self, start, samples):
+        columns = np.arange(start // self.column_size, (start + samples.shape[1] - 1) // self.column_size + 1)
+        offsets = np.maximum(columns * self.column_size - start, 0)
+        column_min = np.minimum.reduceat(samples, offsets, axis=1).T
+        column_max = np.maximum.reduceat(samples, offsets, axis=1).T
+        if start % self.column_size:
+            # Continue the column started by the previous frame
+            column_min[0] = np.minimum(column_min[0], self.y[2 * columns[0]])
+            column_max[0] = np.maximum(column_max[0], self.y[2 * columns[0] + 1])
+        self.y[2 * columns] = column_min
+        self.y[2 * columns + 1] = column_max
+
+    def _update_lanes(self):
+        visible = self.y[:2 * -(-self.filled // self.column_size)]
+        if len(visible) == 0:
+            return
+        # float64, so a narrow band around a large value keeps a non-zero width
+        low, high = visible.min(axis=0).astype(np.float64), visible.max(axis=0).astype(np.float64)
+        # Refit a channel only when its trace leaves its band or shrinks to
+        # less than half of it, like the single-channel camera
+        if self.bands is None:
+            refit = np.ones(self.channels, dtype=bool)
+        else:
+            band_low, band_high = self.bands
+            refit = (low < band_low) | (high > band_high) | (high - low < 0.5 * (band_high - band_low))
+        if not refit.any():
+            return
+        span = np.maximum(high - low, 1e-6 * np.maximum(1.0, np.abs(low)))  # a flat channel still gets a band
+        if self.bands is None:
+            self.bands = (low - 0.1 * span, high + 0.1 * span)
+        else:
+            self.bands[0][refit] = (low - 0.1 * span)[refit]
+            self.bands[1][refit] = (high + 0.1 * span)[refit]
+        band_low, band_high = self.bands
+        self.lanes[:, 0] = (band_low + band_high) / 2
+        self.lanes[:, 1] = 0.9 / np.maximum(band_high - band_low, np.finfo(np.float64).tiny)
+        self.lines.set_lanes(self.lanes)
@@ -1,44 +1,199 @@
+import logging
+import os
+import re
 import threading
+import time
 from threading import Thread
-from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 import numpy as np
 
-from config import SERVER_HOST, SERVER_PORT, BUFFER_LIMIT, NUMBER_OF_CHANNELS
-from service.data_buffer import DataBuffer
+from config import (SERVER_HOST, SERVER_PORT, PLOT_MAX_POINTS, RECORD_SESSIONS, RECORDING_DIRECTORY, SIGNAL_SIZE,
+                    METRICS_LOG_INTERVAL, LIVE_FPS, NUMBER_OF_CHANNELS, CHANNEL_LENGTH, INGEST_PROCESS)
+from service.data_buffer import to_samples
+from service.events import EVENT_DTYPE
+from service.ingest_process import IngestProcess
+from service.metrics import metrics, format_snapshot
+from service.recording import Recording
+from service.replay import ReplayService
+from service.source import SourceData
 from service.tcp import TCPService
 
 
 class MainViewModel(QObject):
     status_changed = pyqtSignal(str)  # Signal to show status
-    new_data = pyqtSignal(np.ndarray)  # Signal for new data
+    new_data = pyqtSignal(int, int)  # Signal with (first new chunk sequence, new chunk count), once per tick
+    sources_changed = pyqtSignal(list)  # Signal with the names of known sources
 
-    def __init__(self):
+    def __init__(self, record_sessions=RECORD_SESSIONS, ingest_process=INGEST_PROCESS):
         super().__init__()
 
-        self.__buffer = DataBuffer(BUFFER_LIMIT, NUMBER_OF_CHANNELS)
-        self.__tcp_kill_event = threading.Event()
-        self.__tcp_service = TCPService(self.on_new_data, self.on_status_change, SERVER_HOST, SERVER_PORT)
-        self.__tcp_thread = None
+        self.__record_sessions = record_sessions
+        self.__ingest_process = ingest_process
+
+        # Every connected source gets its own buffers; getters read the selected one.
+        # A source that disconnected keeps its history and records to a new file
+        # when it connects again.
+        self.__sources = {}
+        self.__closed_sources = set()
+        self.__recording_paths = set()
+        self.__sources_lock = threading.Lock()
+        self.__selected_source = None
+        self.__ingest_kill_event = threading.Event()
+        self.__ingest_service = None
+        self.__ingest_thread = None
         self.__visualization_paused = False
 
+        # The ingest thread only stores chunks and advances the sequence; the
+        # GUI is told about new data at most once per display tick, so the Qt
+        # event queue stays bounded whatever the input rate.
+        self.__sequence = 0
+        self.__notified_sequence = 0
+        self.__pending_since = None
+        self.__last_tick = None
+        self.__display_interval = 1.0 / LIVE_FPS
+        self.__display_timer = QTimer(self)
+        self.__display_timer.timeout.connect(self.__on_display_tick)
+        self.__display_timer.start(int(1000 / LIVE_FPS))
+
+        self.__metrics_log_timer = QTimer(self)
+        self.__metrics_log_timer.timeout.connect(self.log_metrics)
+        if metrics.enabled and METRICS_LOG_INTERVAL > 0:
+            self.__metrics_log_timer.start(int(METRICS_LOG_INTERVAL * 1000))
+
     def start_tcp(self):
-        self.__tcp_kill_event.clear()
-        self.__tcp_service = TCPService(self.on_new_data, self.on_status_change, SERVER_HOST, SERVER_PORT)
-        self.__tcp_thread = Thread(target=self.__tcp_service.start, args=(self.__tcp_kill_event,))
-        self.__tcp_thread.start()
+        self.__ingest_kill_event.clear()
+        if self.__ingest_process:
+            self.__ingest_service = IngestProcess(self.on_new_samples, self.on_status_change, SERVER_HOST, SERVER_PORT,
+                                                  self.on_source_closed)
+        else:
+            self.__ingest_service = TCPService(self.on_new_data, self.on_status_change, SERVER_HOST, SERVER_PORT,
+                                               self.on_source_closed)
+        self.__ingest_thread = Thread(target=self.__ingest_service.start, args=(self.__ingest_kill_event,))
+        self.__ingest_thread.start()
+
+    def start_replay(self, path, speed=1.0):
+        self.__ingest_kill_event.clear()
+        self.__ingest_service = ReplayService(self.on_new_data, self.on_status_change, path, speed)
+        self.__ingest_thread = Thread(target=self.__ingest_service.start, args=(self.__ingest_kill_event,))
+        self.__ingest_thread.start()
 
     def stop_tcp(self):
-        if self.__tcp_service:
-            self.__tcp_kill_event.set()
-            self.__tcp_service.stop()
+        if self.__ingest_service:
+            self.__ingest_kill_event.set()
+            self.__ingest_service.stop()
+        if self.__ingest_thread:
+            self.__ingest_thread.join()
+        self.close_recordings()
+
+    def close_recordings(self):
+        with self.__sources_lock:
+            sources = list(self.__sources.values())
+            self.__closed_sources.update(self.__sources)
+        for source in sources:
+            source.close_recording()
+
+    def on_source_closed(self, source_name):
+        with self.__sources_lock:
+            source = self.__sources.get(source_name)
+            if source is None:
+                return
+            self.__closed_sources.add(source_name)
+        # Called on the ingest thread, which should not wait for the disk
+        source.close_recording(wait=False)
+
+    def open_recording(self, path):
+        return Recording(path)
 
     def on_status_change(self, status):
         self.status_changed.emit(status)
 
-    def on_new_data(self, chunk):
+    def on_new_data(self, frames, source_name="default"):
+        frame_count = np.size(frames) // SIGNAL_SIZE
+        metrics.count("frames_received", frame_count)
         if not self.__visualization_paused:
-            self.__buffer.append_chunk(chunk)
-            self.new_data.emit(chunk)
+            self.__store(to_samples(frames), frame_count, source_name)
+        else:
+            metrics.count("frames_dropped", frame_count)
+
+    def on_new_samples(self, samples, source_name="default"):
+        """Like on_new_data for a channels x samples array, such as a view of a shared ingest ring."""
+        frame_count = samples.shape[1] // CHANNEL_LENGTH
+        metrics.count("frames_received", frame_count)
+        if not self.__visualization_paused:
+            self.__store(samples, frame_count, source_name)
+        else:
+            metrics.count("frames_dropped", frame_count)
+
+    def __store(self, chunk, frame_count, source_name):
+        self.__get_or_add_source(source_name).append(chunk)
+        if self.__pending_since is None:
+            self.__pending_since = time.perf_counter()
+        self.__sequence += frame_count
+
+    def __on_display_tick(self):
+        now = time.perf_counter()
+        if self.__last_tick is not None and now - self.__last_tick > 1.5 * self.__display_interval:
+            metrics.count("late_display_ticks")
+        self.__last_tick = now
+
+        sequence = self.__sequence
+        if sequence == self.__notified_sequence:
+            return
+        pending_since, self.__pending_since = self.__pending_since, None
+        if pending_since is not None:
+            metrics.record("new_data_handoff", now - pending_since)
+        first, self.__notified_sequence = self.__notified_sequence, sequence
+        self.new_data.emit(first, sequence - first)
+
+    def get_metrics(self):
+        source = self.__current_source()
+        if source is not None:
+            metrics.gauge("buffer_occupancy", source.occupancy())
+        return metrics.snapshot()
+
+    def log_metrics(self):
+        logging.info("Pipeline metrics:\n" + format_snapshot(self.get_metrics()))
+
+    def __get_or_add_source(self, source_name):
+        with self.__sources_lock:
+            source = self.__sources.get(source_name)
+            if source is not None:
+                if source_name in self.__closed_sources:
+                    self.__closed_sources.discard(source_name)
+                    source.open_recording(self.__recording_path(source_name))
+                return source
+            source = SourceData(source_name, self.__recording_path(source_name), self.on_status_change)
+            self.__sources[source_name] = source
+            if self.__selected_source is None:
+                self.__selected_source = source_name
+            names = list(self.__sources)
+        self.sources_changed.emit(names)
+        return source
+
+    def __recording_path(self, source_name):
+        if not self.__record_sessions or source_name.startswith("replay:"):
+            return None  # replays already come from a recording
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}_{re.sub(r'[^0-9A-Za-z]+', '-', source_name)}"
+        path, number = os.path.join(RECORDING_DIRECTORY, stem + ".sigrec"), 1
+        # A source that reconnects within the same second must not overwrite its last file
+        while path in self.__recording_paths or os.path.exists(path):
+            number += 1
+            path = os.path.join(RECORDING_DIRECTORY, f"{stem}_{number}.sigrec")
+        self.__recording_paths.add(path)
+        return path
+
+    def __current_source(self):
+        with self.__sources_lock:
+            return self.__sources.get(self.__selected_source)
+
+    def get_source_names(self):
+        with self.__sources_lock:
+            return list(self.__sources)
+
+    def select_source(self, source_name):
+        with self.__sources_lock:
+            if source_name in self.__sources:
+                self.__selected_source = source_name
     
     def stop_visualization(self):
         self.__visualization_paused = True
@@ -47,11 +202,71 @@ class MainViewModel(QObject):
         self.__visualization_paused = False
 
     def get_channel_data(self, channel_index):
-        return self.__buffer.get_channel_data(channel_index)
+        source = self.__current_source()
+        if source is None:
+            return np.array([], dtype=np.float32)
+        return source.get_buffer().get_channel_data(channel_index)
+
+    def query(self, channels=None, start=None, stop=None, last=None, since=None, until=None):
+        """Return (data, version) of a span of the selected source's history; see DataBuffer.query.
+
+        The source name is prepended to the version for the derived-signal cache.
+        """
+        source = self.__current_source()
+        if source is None:
+            shape = (0,) if np.ndim(channels) == 0 and channels is not None else (
+                NUMBER_OF_CHANNELS if channels is None else len(channels), 0)
+            return np.zeros(shape, dtype=np.float32), (None, 0, 0, 0)
+        data, version = source.get_buffer().query(channels, start, stop, last, since, until)
+        return data, (source.name,) + version
+
+    def get_version(self):
+        """Return the version of the selected source's whole history; see DataBuffer.get_version."""
+        source = self.__current_source()
+        if source is None:
+            return None, 0, 0, 0
+        return (source.name,) + source.get_buffer().get_version()
+
+    def get_events(self, channels=None, kinds=None, start=None, stop=None, last=None):
+        """Return the events detected in the selected source; see select_events."""
+        source = self.__current_source()
+        if source is None:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        return source.get_events().query(channels, kinds, start, stop, last)
+
+    def get_channel_envelope(self, channel_index, start=0, stop=None, points=PLOT_MAX_POINTS):
+        source = self.__current_source()
+        if source is None:
+            return np.array([]), np.array([], dtype=np.float32)
+        return source.get_buffer().get_channel_envelope(channel_index, start, stop, points)
+
+    def get_new_channel_data(self, channel_index, position, max_samples=None, signal_type="unfiltered",
+                             max_backlog=None):
+        source = self.__current_source()
+        if source is None:
+            return np.array([], dtype=np.float32), position
+        return source.get_buffer(signal_type).get_channel_data_since(channel_index, position, max_samples,
+                                                                     max_backlog)
     
+    def get_new_data(self, position, max_samples=None, signal_type="unfiltered", max_backlog=None):
+        source = self.__current_source()
+        if source is None:
+            return np.zeros((NUMBER_OF_CHANNELS, 0), dtype=np.float32), position
+        return source.get_buffer(signal_type).get_data_since(position, max_samples, max_backlog)
+
+    def get_new_spectrogram_columns(self, channel_index, position, max_columns=None):
+        source = self.__current_source()
+        if source is None:
+            return np.zeros((0, 0), dtype=np.float32), position
+        return source.get_spectrogram().get_columns_since(channel_index, position, max_columns)
+
     def clear_data(self):
-        self.__buffer.clear()
+        with self.__sources_lock:
+            sources = list(self.__sources.values())
+        for source in sources:
+            source.clear()
 
     def has_data(self):
-        return not self.__buffer.is_empty()
+        source = self.__current_source()
+        return source is not None and not source.is_empty()
 